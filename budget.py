@@ -0,0 +1,125 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Token and cost budget of a run. Every model answer is booked from its usage field, per model, per file and for
+# the whole run, and priced with the MODEL_PROFILES of estimate.py. Past the soft limit the functions are routed one
+# tier lower (large -> small model, small model -> local template); past the hard limit no model call is made any
+# more and the watchdog stops admitting new files (they wait in the push folder). In watchdog mode the spend of every
+# file is written next to its output (file.py.usage.json).
+import json
+import threading
+from contextlib import contextmanager
+
+from estimate import DEFAULT_MODEL, MODEL_PROFILES
+
+# Tier used past the soft limit
+DEGRADED_TIERS = {"large": "small", "small": "local", "local": "local"}
+
+
+def _new_account():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "models": {}}
+
+
+class BudgetLedger:
+    def __init__(self, soft_tokens: int = None, hard_tokens: int = None, soft_cost: float = None,
+                 hard_cost: float = None):
+        """
+        Ledger of the tokens spent by a run.
+
+        :param soft_tokens: Tokens (prompt + completion) of the run after which the functions are degraded
+        :param hard_tokens: Tokens of the run after which the model is not called any more
+        :param soft_cost: Same as soft_tokens, in dollars
+        :param hard_cost: Same as hard_tokens, in dollars
+        """
+        self.soft_tokens = soft_tokens
+        self.hard_tokens = hard_tokens
+        self.soft_cost = soft_cost
+        self.hard_cost = hard_cost
+        self.run = _new_account()
+        self.files = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._warned = set()
+
+    @staticmethod
+    def price(model, prompt_tokens, completion_tokens):
+        """Returns the cost in dollars of a call (prices of the default model for the unknown ones)."""
+        profile = MODEL_PROFILES.get(model, MODEL_PROFILES[DEFAULT_MODEL])
+        return (prompt_tokens * profile["prompt_price"] + completion_tokens * profile["completion_price"]) / 1000
+
+    @contextmanager
+    def account(self, name):
+        """Books the calls of the current thread to the file name (None : to the run only)."""
+        previous = getattr(self._local, "name", None)
+        self._local.name = name
+        try:
+            yield
+        finally:
+            self._local.name = previous
+
+    def current(self):
+        """Returns the file the calls of the current thread are booked to, to carry it to worker threads."""
+        return getattr(self._local, "name", None)
+
+    def record(self, model, prompt_tokens, completion_tokens):
+        """Books a model answer to the run and to the current file."""
+        cost = self.price(model, prompt_tokens, completion_tokens)
+        name = self.current()
+        with self._lock:
+            accounts = [self.run] if name is None else [self.run, self.files.setdefault(name, _new_account())]
+            for account in accounts:
+                account["calls"] += 1
+                account["prompt_tokens"] += prompt_tokens
+                account["completion_tokens"] += completion_tokens
+                account["cost"] += cost
+                usage = account["models"].setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+                usage["calls"] += 1
+                usage["prompt_tokens"] += prompt_tokens
+                usage["completion_tokens"] += completion_tokens
+
+    def _over(self, tokens_limit, cost_limit):
+        tokens = self.run["prompt_tokens"] + self.run["completion_tokens"]
+        return ((tokens_limit is not None and tokens >= tokens_limit)
+                or (cost_limit is not None and self.run["cost"] >= cost_limit))
+
+    def state(self):
+        """Returns "hard" past a hard limit, "soft" past a soft limit, "ok" otherwise."""
+        with self._lock:
+            if self._over(self.hard_tokens, self.hard_cost):
+                return "hard"
+            if self._over(self.soft_tokens, self.soft_cost):
+                return "soft"
+        return "ok"
+
+    def exhausted(self):
+        return self.state() == "hard"
+
+    def tier(self, tier):
+        """Returns the tier to use for a function of the given tier, one lower past the soft limit."""
+        return DEGRADED_TIERS.get(tier, tier) if self.state() != "ok" else tier
+
+    def first(self, state):
+        """Returns True the first time a state is reached, to warn once."""
+        with self._lock:
+            if state in self._warned:
+                return False
+            self._warned.add(state)
+            return True
+
+    def pop_file(self, name):
+        """Returns and forgets the spend of a file, None if the model was not called for it."""
+        with self._lock:
+            return self.files.pop(name, None)
+
+    def write_usage(self, name, path):
+        """Writes the spend of a file (see pop_file) in path, returns False if nothing was spent."""
+        account = self.pop_file(name)
+        if account is None:
+            return False
+        with open(path, "w") as f:
+            json.dump(dict(account, file=name), f, indent=1)
+        return True
+
+    def describe(self):
+        run = self.run
+        return (f"Budget : {run['calls']} calls, {run['prompt_tokens']} prompt tokens, "
+                f"{run['completion_tokens']} completion tokens, ${run['cost']:.2f}")
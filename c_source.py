@@ -0,0 +1,284 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# C sources: linear-time extraction of the function definitions and the local stages of their documentation.
+# The lexer skips comments, string and char literals and preprocessor lines (with their continuations), so braces
+# and parentheses inside them are ignored; the function spans are found by a single pass over its tokens, including
+# multi-line and K&R style signatures. The generated comment block is placed before the signature of its function.
+from checkpoint import Checkpoint
+from compaction import count_tokens
+
+_SPACES = " \t\f\v\r"
+_IDENTIFIER = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$")
+_KEYWORDS = {"if", "for", "while", "switch", "return", "sizeof", "do", "else", "case", "goto", "typedef", "struct",
+             "union", "enum", "_Alignof", "alignof", "_Generic", "__attribute__", "__declspec", "_Static_assert",
+             "static_assert", "int", "char", "void", "long", "short", "float", "double", "signed", "unsigned"}
+
+# Prompt formats of the C langages (see commentateur.format_langage)
+PROMPTS = {
+    "docstring c": {
+        "langue": "c", "com1": "/* ", "com2": "*/", "start": "/**",
+        "prompt": "# An elaborate, high quality docstring for the above c function:\n",
+        "role": "You must write the detailed Doxygen comment of the C function below as a C block "
+                "comment starting with /** and ending with */, without the code of the function",
+        "stop": ["*/"], "engine": "Turbo"}
+}
+
+
+def tokenize_c(code):
+    """
+    Splits C code into tokens in one pass.
+
+    Args:
+        code (str): The C code.
+
+    Yields:
+        tuple: (kind, text, start offset, line) where kind is "name" (identifiers and numbers), "string" (string and
+            char literals), "comment", "pp" (preprocessor line) or "op" (any other character). Blanks are skipped.
+    """
+    i, n, line = 0, len(code), 0
+    line_start = True
+    while i < n:
+        c = code[i]
+        if c == "\n":
+            line += 1
+            line_start = True
+            i += 1
+            continue
+        if c in _SPACES:
+            i += 1
+            continue
+        start, start_line = i, line
+        if c == "#" and line_start:
+            # Ligne du préprocesseur, avec ses continuations et ses commentaires
+            while i < n and code[i] != "\n":
+                if code[i] == "\\" and i + 1 < n and code[i + 1] == "\n":
+                    line += 1
+                    i += 2
+                elif code.startswith("/*", i):
+                    end = code.find("*/", i + 2)
+                    end = n if end < 0 else end + 2
+                    line += code.count("\n", i, end)
+                    i = end
+                else:
+                    i += 1
+            kind = "pp"
+        elif code.startswith("//", i):
+            while i < n and code[i] != "\n":
+                i += 2 if code[i] == "\\" and i + 1 < n and code[i + 1] == "\n" else 1
+            line += code.count("\n", start, i)
+            kind = "comment"
+        elif code.startswith("/*", i):
+            end = code.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            line += code.count("\n", start, i)
+            kind = "comment"
+        elif c == '"' or c == "'":
+            i += 1
+            while i < n and code[i] != c and code[i] != "\n":
+                i += 2 if code[i] == "\\" else 1
+            i = min(i + 1, n)
+            line += code.count("\n", start, i)
+            kind = "string"
+        elif c in _IDENTIFIER:
+            while i < n and code[i] in _IDENTIFIER:
+                i += 1
+            kind = "name"
+        else:
+            i += 1
+            kind = "op"
+        line_start = False
+        yield kind, code[start:i], start, start_line
+
+
+def extract_c_functions(code):
+    """
+    Extracts the function definitions of C code in one pass over its tokens.
+
+    Args:
+        code (str): The C code.
+
+    Returns:
+        list: One dict per function: name, line (index of the first line of its signature), start and end (offsets
+            of the signature and of the end of the body), indent (indentation of the signature) and source.
+    """
+    functions = []
+    tokens = tokenize_c(code)
+    statement = None  # Début de la déclaration en cours
+    name = None  # Identifiant devant la première liste de paramètres
+    previous = None
+    paren_depth = 0
+    params_closed = False  # La liste de paramètres est fermée
+    kr = False  # Déclarations K&R (ou attributs) entre les paramètres et le corps
+    invalid = False  # Initialisation, liste de déclarations... : pas une définition de fonction
+    extern_block = False
+    statement_line, kr_start = 0, None
+
+    def reset():
+        nonlocal statement, name, paren_depth, params_closed, kr, invalid, extern_block, kr_start
+        statement, name, paren_depth, params_closed, kr, invalid, extern_block = None, None, 0, False, False, False, False
+        kr_start = None
+
+    for kind, text, start, line in tokens:
+        if kind in ("comment", "pp"):
+            continue
+        if statement is None:
+            if text == "}" or text == ";":
+                # Fin d'un bloc extern "C" ou déclaration vide
+                previous = None
+                continue
+            statement, statement_line = start, line
+        if kind == "string" and previous is not None and previous[1] == "extern":
+            extern_block = True
+        elif text == "(":
+            paren_depth += 1
+            if paren_depth == 1 and params_closed and kr:
+                # Une nouvelle déclaration commence après une macro sans point-virgule
+                statement, statement_line = kr_start
+                params_closed, kr, invalid, name = False, False, False, None
+            if not params_closed and name is None and previous is not None and previous[0] == "name" \
+                    and previous[1] not in _KEYWORDS and not previous[1][0].isdigit():
+                # Le premier identifiant suivi d'une parenthèse, void (*handler(int sig))(int) compris
+                name = previous[1]
+        elif text == ")":
+            paren_depth = max(0, paren_depth - 1)
+            if paren_depth == 0 and name is not None:
+                params_closed = True
+                kr_start = None
+        elif paren_depth > 0:
+            pass
+        elif text == "{":
+            if extern_block and previous[0] == "string":
+                # Le contenu d'un bloc extern "C" est au niveau global
+                reset()
+                previous = None
+                continue
+            body = _skip_block(tokens)
+            if params_closed and name is not None and not invalid and body is not None:
+                start_offset = code.rfind("\n", 0, statement) + 1
+                prefix = code[start_offset:statement]
+                functions.append({"name": name, "line": statement_line, "start": start_offset, "end": body,
+                                  "indent": prefix[:len(prefix) - len(prefix.lstrip())],
+                                  "source": code[start_offset:body]})
+                reset()
+            elif body is None:
+                break
+            elif previous is not None and previous[1] == ")":
+                # Définition non reconnue (macro...) : elle se termine avec son bloc
+                reset()
+                previous = None
+                continue
+            else:
+                # struct, enum, initialisation... : la déclaration continue jusqu'au point-virgule
+                invalid = True
+        elif text == ";":
+            if kr and params_closed and not invalid:
+                kr_start = None
+            else:
+                reset()
+                previous = None
+                continue
+        elif text == "=" or text == "[" or (text == "," and not kr):
+            invalid = True
+        elif params_closed and not kr and kind == "name":
+            kr = True
+        if params_closed and kr and kr_start is None and text not in (")", ";"):
+            kr_start = (start, line)
+        previous = (kind, text)
+    return functions
+
+
+def _skip_block(tokens):
+    """Consumes the tokens up to the brace closing an opened block, returns the offset after it (None at EOF)."""
+    depth = 1
+    for kind, text, start, line in tokens:
+        if kind != "op":
+            continue
+        if text == "{":
+            depth += 1
+        elif text == "}":
+            depth -= 1
+            if depth == 0:
+                return start + 1
+    return None
+
+
+def plan_c_code(code, **options):
+    """
+    Prepares the documentation of C code without calling the model (see pipeline.plan_python_code), the options
+    of the python plan are ignored.
+
+    Returns:
+        dict: "jobs", one dict per function (name, line, indent, checkpoint key, prompt and its tokens), "digest"
+            is always None: C files get no summary header.
+    """
+    jobs = []
+    for function in extract_c_functions(code):
+        tokens = count_tokens(function["source"])
+        jobs.append({"name": function["name"], "line": function["line"], "indent": function["indent"],
+                     "insert": True, "key": Checkpoint.key(function["source"]), "fingerprint": None,
+                     "identifiers": None, "tier": "small", "prompt": function["source"], "tokens": (tokens, tokens),
+                     "template": None, "langage": "docstring c", "summary": False})
+    return {"jobs": jobs, "digest": None}
+
+
+def format_c_comment(comment, indentation):
+    """Cleans a comment answered by the model into a C block comment indented by `indentation`."""
+    lines = [line.rstrip() for line in comment.strip("\n").split("\n")]
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if not lines:
+        return None
+    if not lines[0].lstrip().startswith("/*") or not lines[-1].rstrip().endswith("*/"):
+        # Réponse sans délimiteurs : un bloc /** ... */ est construit
+        lines = ["/**"] + [" * " + line.replace("*/", "* /") if line.strip() else " *" for line in lines] + [" */"]
+    common = min(len(line) - len(line.lstrip()) for line in lines if line.strip())
+    return "\n".join(indentation + line[common:] if line.strip() else "" for line in lines)
+
+
+def splice_c_comments(code, job_positions, comments):
+    """
+    Inserts the comment blocks before the first line of the signature of their function, in one pass.
+
+    Args:
+        code (str): The C code.
+        job_positions (list): (line, indent, insert) of every job (see pipeline.positions).
+        comments (dict): {index of the job: comment answered by the model}.
+
+    Returns:
+        str: The code with the comments.
+    """
+    inserts = {}
+    for index, comment in comments.items():
+        line, indent, _ = job_positions[index]
+        block = format_c_comment(comment, indent)
+        if block is not None:
+            inserts[line] = block
+    out = []
+    for number, line in enumerate(code.split("\n")):
+        if number in inserts:
+            out.append(inserts[number])
+        out.append(line)
+    return "\n".join(out)
+
+
+def insert_c_comments(code, job_positions, comments, header=None, reformat=True, replace_header=False):
+    """Splices the comment blocks in one pass (C files get no summary header)."""
+    return splice_c_comments(code, job_positions, comments)
+
+
+def validate_c(code):
+    """
+    Checks that no block comment is left unterminated (it would swallow the code after it). There is no compiler in
+    the loop, the code is returned unchanged.
+
+    Raises:
+        ValueError: If a block comment is not terminated.
+    """
+    for kind, text, start, line in tokenize_c(code):
+        if kind == "comment" and text.startswith("/*") and (len(text) < 4 or not text.endswith("*/")):
+            raise ValueError(f"Unterminated comment block at line {line + 1}")
+    return code
+
+
+LANGUAGE = {"name": "c", "extract": plan_c_code, "insert": insert_c_comments, "validate": validate_c,
+            "check": validate_c, "prompts": PROMPTS}
@@ -0,0 +1,111 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Record/replay of the model traffic. In record mode every request/response pair going through GPT_choice is
+# appended to a JSON lines archive, flushed to the disk as soon as it arrives, so a crash or a SIGTERM of the
+# watchdog loses at most the line being written; in replay mode the responses are served back from the archive,
+# indexed by the hash of the request, with their recorded latency or without latency, so the local stages of the
+# pipeline can be profiled and regression-tested offline.
+import json
+import os
+import threading
+import time
+
+
+class CassetteMiss(KeyError):
+    pass
+
+
+class Cassette:
+    def __init__(self, path, mode: str = "replay", latency: str = "zero"):
+        """
+        Archive of model responses.
+
+        :param path: JSON lines archive, one line per request (key, request, response, latency)
+        :param mode: "record" appends the new responses to the archive, "replay" serves them back
+        :param latency: In replay mode, "recorded" sleeps the recorded latency of each response, "zero" does not
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        if latency not in ("recorded", "zero"):
+            raise ValueError(f"Unknown replay latency {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.hits = 0
+        self._lock = threading.Lock()
+        # Index de l'archive : hash de la requête -> position de sa ligne
+        self._index = {}
+        self._file = open(path, "a+b" if mode == "record" else "rb")
+        self._load_index()
+
+    def _load_index(self):
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                # Dernière ligne tronquée par un crash : elle est écrasée par le prochain enregistrement
+                if self.mode == "record":
+                    self._file.truncate(offset)
+                break
+            try:
+                self._index.setdefault(json.loads(line)["key"], offset)
+            except (ValueError, KeyError):
+                pass
+            offset += len(line)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def play(self, key):
+        """
+        Returns the recorded response of a request.
+
+        Args:
+            key (str): Hash of the request (see commentateur.cache_key).
+
+        Returns:
+            str: The recorded response.
+
+        Raises:
+            CassetteMiss: If the request was not recorded.
+        """
+        position = self._index.get(key)
+        if position is None:
+            raise CassetteMiss(key)
+        with self._lock:
+            self._file.seek(position)
+            record = json.loads(self._file.readline())
+            self.hits += 1
+        if self.latency == "recorded":
+            time.sleep(record["latency"])
+        return record["response"]
+
+    def record(self, key, request, response, latency):
+        """
+        Appends a response to the archive and flushes it to the disk (the first recording of a request is kept).
+
+        Args:
+            key (str): Hash of the request.
+            request (dict): Description of the request (engine, langage, model, content).
+            response (str): The response of the model.
+            latency (float): Duration of the call in seconds.
+        """
+        line = json.dumps({"key": key, "request": request, "response": response, "latency": latency}) + "\n"
+        with self._lock:
+            if key in self._index or self._file is None or self.mode != "record":
+                return
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(line.encode("utf-8"))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._index[key] = offset
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = None
@@ -0,0 +1,107 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Crash-safe journal of the docstrings generated for a file. Each function result is appended to a sidecar file
+# as soon as it arrives, so a rerun after a crash (or after failed functions) resumes without paying again for the
+# functions already documented.
+import hashlib
+import json
+import os
+import threading
+
+from snapshot import hash_file
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """
+        Journal of the results of a documentation run, one JSON line per function.
+
+        :param path: Sidecar file of the journal, existing results are loaded from it
+        """
+        self.path = path
+        self.records = {}
+        # sha256 of the contents the journal applies to (the documented source and the file written from it)
+        self.files = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Last line truncated by a crash
+                        continue
+                    if "file" in record:
+                        self.files.add(record["file"])
+                    else:
+                        self.records[record["key"]] = record
+
+    @staticmethod
+    def path_for(file_path):
+        """Returns the path of the checkpoint of a documented file : .name.checkpoint next to it."""
+        directory, name = os.path.split(file_path)
+        return os.path.join(directory, f".{name}.checkpoint")
+
+    @staticmethod
+    def key(function_str):
+        return hashlib.sha256(function_str.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key):
+        """Returns the successful record of a function, or None if it must be (re)computed."""
+        record = self.records.get(key)
+        if record is None or record["status"] != "ok":
+            return None
+        return record
+
+    def failures(self):
+        return [r for r in self.records.values() if r["status"] == "failed"]
+
+    def _append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_file(self, file_path):
+        """
+        Journals the sha256 of a file the journal applies to: the source being documented, or the file written
+        from it while some functions failed.
+
+        Args:
+            file_path (str): The file to hash.
+        """
+        digest = hash_file(file_path)
+        with self._lock:
+            if digest not in self.files:
+                self.files.add(digest)
+                self._append({"file": digest})
+
+    def matches(self, file_path):
+        """Returns True if the content of file_path is one recorded by record_file (the user did not edit it)."""
+        return os.path.exists(file_path) and hash_file(file_path) in self.files
+
+    def record(self, key, name, doc_string=None, short_docstring=None, error=None):
+        """
+        Appends the result of a function to the journal and flushes it to the disk.
+
+        Args:
+            key (str): Key of the function (see Checkpoint.key).
+            name (str): Name of the function.
+            doc_string (str): Generated docstring, None if the function failed.
+            short_docstring (str): Generated short docstring, None if the function failed.
+            error (str): Reason of the failure.
+        """
+        status = "ok" if doc_string is not None and short_docstring is not None else "failed"
+        record = {"key": key, "name": name, "status": status, "doc_string": doc_string,
+                  "short_docstring": short_docstring, "error": error}
+        with self._lock:
+            self.records[key] = record
+            self._append(record)
+
+    def remove(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
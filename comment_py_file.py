@@ -10,22 +10,38 @@ import os
 import shutil
 import subprocess
 import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import openai
 import re
 import ast
 from openai.error import OpenAIError
 import autopep8
-from distutils import dir_util
-
-
-API_langage = {"en": "You are able to write doc-strings respecting PEP 7 and google style convention by adding them to the "
-               "python function provided as input. the response should not be in a comment block, "
-               "should only contain the function and the docstring without any other comments. "
-               "You then need to delete the first and last line of the response.",
-               "fr": "Vous êtes capable d’écrire des doc-string en respectant la PEP 7 et google style convention en les "
-               "ajoutant à la fonction python fournie en entrée. la réponse ne doit pas être dans un "
-               "bloc de commentaire, ne doit contenir que la fonction et le docstring sans aucun "
-               "autre commentaire. Vous devez ensuite supprimer la première et dernière ligne de la réponse."}
+from snapshot import SnapshotStore
+from event_log import EventLog
+import git_diff
+from fingerprint import DocstringIndex
+import tiering
+from hedging import DeadlineExceeded, HedgedCaller
+from checkpoint import Checkpoint
+from budget import BudgetLedger
+from options import LocalOptions, LogOptions, ModelOptions, WatchOptions
+from cassette import Cassette
+from metrics import MetricsServer, PipelineMetrics
+from shared_cache import SharedCache, open_cache
+from results import ResultStore
+from scheduler import Scheduler
+import languages
+import normalize
+import streaming
+import patches
+import pipeline
+import digest
+
+
+from pipeline import API_langage
 
 
 # API key of openai
@@ -153,116 +169,325 @@ def generate_prompt(dot_file_path, code_string):
 
 
 class commentateur:
-    def __init__(self, path_to_watch=None, path_to_save=None, path_to_copy=None, watchdog: bool = False):
+    # Méthode appelée pour chaque moteur de GPT_choice : (langage, function_or_method, model) -> réponse
+    ENGINES = {"Turbo": "GPT_turbo", "text-davinci-003": "GPT_classic", "code-davinci-002": "GPT_classic"}
+    # Un dossier déposé reste le même dépôt tant qu'il a des fichiers dans le dossier de dépôt, et ce délai après
+    # (copie lente en plusieurs passages) : ensuite il s'agit d'un nouveau dépôt (see _drop_seen)
+    DROP_QUIET_SECONDS = 30.0
+
+    def __init__(self, watchdog: bool = False, model: ModelOptions = None, local: LocalOptions = None,
+                 logs: LogOptions = None, watch: WatchOptions = None, cassette: Cassette = None,
+                 shared_cache: SharedCache = None, budget: BudgetLedger = None):
         """
         This program allow to auto comment py file with gpt3.5 by pushing file in a folder
-        :param path_to_watch: Waiting a new file
-        :param path_to_save: Retrieve your commented py file
-        :param path_to_copy: Make a copy of an original file
+        :param watchdog: Watch the push folder (see process_folder) instead of documenting files on demand
+        :param model: Requests sent to the model (see options.py), command line defaults if None
+        :param local: Local stages and files written
+        :param logs: Events and metrics
+        :param watch: Folders and queue of the watchdog mode
+        :param cassette: Records the model responses, or replays them without calling the model (see cassette.py)
+        :param shared_cache: Cache of the model responses shared with other machines, behind the in-memory cache
+                             (see shared_cache.py)
+        :param budget: Ledger of the tokens spent, with its soft and hard limits (see budget.py), by default the
+                       tokens are only booked
         """
-        if path_to_watch is None:
-            path_to_watch = "./Push_code_here"
-        if path_to_save is None:
-            path_to_save = "./Modified"
-        if path_to_copy is None:
-            path_to_copy = "./Original"
-
-        self.print = []
-
+        model = model or ModelOptions()
+        local = local or LocalOptions()
+        logs = logs or LogOptions()
+        watch = watch or WatchOptions()
+
+        self.log = EventLog(capacity=logs.log_capacity, log_file=logs.log_file, echo_level=logs.log_level)
+        self.compact_prompts = model.compact_prompts
+        # Tokens of the functions sent to the model, per file : {file: {"original": n, "compacted": m}}
+        self.token_report = {}
+        # Cache LRU des réponses du modèle, partagé par les threads (mode daemon)
+        self.cache_size = model.cache_size
+        self.response_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.shared_cache = shared_cache
+        # Docstrings par classe de fonctions structurellement identiques
+        self.docstring_index = DocstringIndex() if model.reuse_docstrings else None
+        # Routage des fonctions par complexité, avec une limite de concurrence par niveau
+        self.tiering_enabled = model.tiering_enabled
+        self.tiers = tiering.TierLimiter(large_model=model.large_model)
+        # Délai maximal et requêtes doublées pour borner la latence de queue
+        self.hedger = HedgedCaller(deadline=model.deadline, hedge=model.hedge, hedge_budget=model.hedge_budget)
+        self.max_deadline_retries = 2
+        self.max_error_retries = 3
+        # Attente après une erreur de débit, doublée à chaque essai et bornée par le délai d'un appel
+        self.rate_limit_wait = 20.0
+        self.classic_max_tokens = 1000
+        # Jetons dépensés par appel, fichier et lancement, limites souple et dure
+        self.budget = budget if budget is not None else BudgetLedger()
+        self.cassette = cassette
+        # Étapes locales dans un pool de processus, appels au modèle dans des threads du processus parent
+        self.local_stages = pipeline.LocalStagePool(local.processes)
+        self.file_concurrency = max(1, local.processes)
+        self.model_concurrency = model.model_concurrency
+        self._report_lock = threading.Lock()
+        self.output = local.output
+        self.stream_threshold = local.stream_threshold
+        self.stream_window = local.stream_window
+        # Compteurs mis à jour par les étapes, jauges lues seulement à la collecte
+        self.metrics = PipelineMetrics()
+        self.metrics.gauge("commentateur_cache_entries", "Model answers in the in-memory cache",
+                           function=lambda: len(self.response_cache))
+        self.metrics.counter("commentateur_api_hedges_total", "Duplicate requests fired for slow model calls",
+                             function=lambda: self.hedger.tracker.hedges)
+        self.metrics.counter("commentateur_api_hedge_tokens_total", "Tokens of the losing duplicates of hedged calls",
+                             function=lambda: self.hedger.tracker.hedge_tokens)
+        self.metrics.counter("commentateur_api_timeouts_total", "Model calls without answer before the deadline",
+                             function=lambda: self.hedger.tracker.timeouts)
+        self.metrics.counter("commentateur_spent_dollars_total", "Cost of the model calls of the run",
+                             function=lambda: self.budget.run["cost"])
+
+        self.watchdog = watchdog
         if watchdog:
             # Vérifiez si le dossier "Push code here" existe
-            self.push_code_here_path = path_to_watch
+            self.push_code_here_path = watch.path_to_watch
             if not os.path.exists(self.push_code_here_path):
-                self._print(f"The Folder {path_to_watch} doesn't exist")
+                self._print(f"The Folder {watch.path_to_watch} doesn't exist")
                 os.mkdir(self.push_code_here_path)
-                self._print(f"Folder {path_to_watch} created")
+                self._print(f"Folder {watch.path_to_watch} created")
 
 
             # Vérifiez si le dossier "Original" existe, sinon le créez
-            self.original_path = path_to_copy
+            self.original_path = watch.path_to_copy
             if not os.path.exists(self.original_path):
                 os.mkdir(self.original_path)
-                self._print(f"Folder {path_to_copy} created")
+                self._print(f"Folder {watch.path_to_copy} created")
 
             # Vérifiez si le dossier "Modified" existe, sinon le créez
-            self.modified_path = path_to_save
+            self.modified_path = watch.path_to_save
             if not os.path.exists(self.modified_path):
                 os.mkdir(self.modified_path)
-                self._print(f"Folder {path_to_save} created")
+                self._print(f"Folder {watch.path_to_save} created")
+
+            # Fichiers déposés en échec : déplacés hors du dossier de dépôt, jamais supprimés
+            self.failed_path = watch.path_to_failed
+            # État interne (magasins, statut de la file) hors des dossiers consultés par l'utilisateur
+            self.state_path = watch.path_to_state
+            os.makedirs(self.state_path, exist_ok=True)
+            # Les copies dans "Original" sont des copies d'un magasin adressé par contenu
+            self.snapshots = SnapshotStore(self.state_path)
+            # Fichiers documentés par contenu déposé : un fichier déjà traité est servi sans appel au modèle
+            self.results = ResultStore(self.state_path) if watch.deduplicate else None
+            # File d'attente bornée des fichiers déposés, état publié dans un fichier JSON
+            self.scheduler = Scheduler(watch.max_in_flight or self.file_concurrency, policy=watch.scheduling,
+                                       max_file_size=watch.max_file_size,
+                                       status_path=watch.status_file or os.path.join(self.state_path, "status.json"),
+                                       max_queued=watch.max_queued)
+            self.scheduler.write_status()
+            # Dernière activité par dossier déposé : le patch combiné est recréé au début de chaque dépôt
+            self._drops = {}
+            self._drops_lock = threading.Lock()
+            self.metrics.gauge("commentateur_queue_files", "Dropped files by state of the queue", ("state",),
+                               function=self._queue_metrics)
+            self.metrics.gauge("commentateur_queue_eta_seconds", "Estimated time to drain the queue",
+                               function=lambda: self.scheduler.status()["eta_seconds"])
+
+        if logs.metrics_port is not None:
+            self._print(f"Metrics on {MetricsServer(self.metrics, port=logs.metrics_port).start()}")
+
+    def _queue_metrics(self):
+        status = self.scheduler.status()
+        return {(state,): status[state] for state in ("queued", "in_flight", "deferred")}
 
     def process_folder(self):
-        while True:
-            for dir_path, dir_names, file_names in os.walk(self.push_code_here_path):
-                for dir_name in dir_names:
-                    orig_dir_path = os.path.join(dir_path, dir_name).replace(self.push_code_here_path,
-                                                                             self.original_path)
-                    mod_dir_path = os.path.join(dir_path, dir_name).replace(self.push_code_here_path,
-                                                                            self.modified_path)
-
-                    os.makedirs(orig_dir_path, exist_ok=True)
-                    os.makedirs(mod_dir_path, exist_ok=True)
-
-                    dir_util.copy_tree(os.path.join(dir_path, dir_name), orig_dir_path)
-
-                for filename in file_names:
-                    file_path = os.path.join(dir_path, filename)
-
-                    orig_path = file_path.replace(self.push_code_here_path, self.original_path)
-                    mod_path = file_path.replace(self.push_code_here_path, self.modified_path)
-
-                    os.makedirs(os.path.dirname(orig_path), exist_ok=True)
-                    os.makedirs(os.path.dirname(mod_path), exist_ok=True)
-
-                    shutil.copyfile(file_path, orig_path)
-
-                    self.compute_file(file_path, mod_path)
-
-                    os.remove(file_path)
-
-            for root, dirs, _ in os.walk(self.push_code_here_path, topdown=False):
-                for name in dirs:
-                    try:
-                        os.rmdir(os.path.join(root, name))
-                    except OSError:
-                        pass  # If the directory is not empty, an OSError is raised, in that case
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_in_flight) as executor:
+            while True:
+                for dir_path, dir_names, file_names in os.walk(self.push_code_here_path):
+                    for dir_name in dir_names:
+                        orig_dir_path = os.path.join(dir_path, dir_name).replace(self.push_code_here_path,
+                                                                                 self.original_path)
+                        mod_dir_path = os.path.join(dir_path, dir_name).replace(self.push_code_here_path,
+                                                                                self.modified_path)
+
+                        # Files are snapshotted one by one below, only the (possibly empty) folders are created here
+                        os.makedirs(orig_dir_path, exist_ok=True)
+                        os.makedirs(mod_dir_path, exist_ok=True)
+
+                    for filename in file_names:
+                        file_path = os.path.join(dir_path, filename)
+                        share = self._drop_name(file_path)
+                        if self.output == "combined":
+                            self._drop_seen(share)
+                        if file_path in self.scheduler:
+                            # Déjà en file d'attente ou en cours
+                            continue
+                        if self.scheduler.full():
+                            # File pleine : le fichier attend dans le dossier de dépôt, pris à un prochain passage
+                            break
+
+                        orig_path = file_path.replace(self.push_code_here_path, self.original_path)
+                        mod_path = file_path.replace(self.push_code_here_path, self.modified_path)
+
+                        os.makedirs(os.path.dirname(orig_path), exist_ok=True)
+                        os.makedirs(os.path.dirname(mod_path), exist_ok=True)
+
+                        digest = self.snapshots.snapshot(file_path, orig_path)
+                        relative = os.path.relpath(file_path, self.push_code_here_path)
+                        if self.scheduler.add(file_path, mod_path, os.path.getsize(file_path), share,
+                                              self._result_key(digest, file_path)):
+                            self._print(f"{relative} : same content as a queued file, documented once")
+
+                # Admission bornée : les fichiers non admis restent dans le dossier de dépôt
+                if self.budget.exhausted():
+                    if self.budget.first("paused"):
+                        self._print(f"{self.budget.describe()} : hard limit reached, no new file is admitted",
+                                    level="warning")
+                else:
+                    for job in self.scheduler.admit():
+                        executor.submit(self._process_dropped_group, job)
+
+                for root, dirs, _ in os.walk(self.push_code_here_path, topdown=False):
+                    for name in dirs:
+                        try:
+                            os.rmdir(os.path.join(root, name))
+                        except OSError:
+                            pass  # If the directory is not empty, an OSError is raised, in that case
+
+                time.sleep(1)
+
+    def _result_key(self, digest, file_path):
+        """Returns the key of the documented version of a dropped file (see results.py), None if not stored."""
+        if self.results is None or languages.name_for(file_path) is None:
+            # Simple copie : rien à dédupliquer
+            return None
+        options = {"compact_prompts": self.compact_prompts, "reuse_docstrings": self.docstring_index is not None,
+                   "tiering_enabled": self.tiering_enabled, "patch": self.output != "tree"}
+        return self.results.key(digest, os.path.splitext(file_path)[1], options)
+
+    def _patch_label(self, file_path):
+        """Path of a dropped file in the patches (relative to the push folder), None when writing full copies."""
+        if self.output == "tree":
+            return None
+        return os.path.relpath(file_path, self.push_code_here_path).replace(os.sep, "/")
+
+    def _output_path(self, mod_path):
+        return mod_path if self.output == "tree" else mod_path + ".patch"
+
+    def _drop_name(self, file_path):
+        """Dropped folder of a file (its first folder in the push folder), "" for the files dropped alone."""
+        relative = os.path.relpath(file_path, self.push_code_here_path)
+        return relative.split(os.sep)[0] if os.sep in relative else ""
+
+    def _combined_path(self, drop):
+        return os.path.join(self.modified_path, (drop or "drop") + ".patch")
+
+    def _drop_seen(self, drop):
+        """
+        Notes a file of a drop in the push folder. The patches of a drop are appended to its combined patch over as
+        many scans as its files take to arrive; a drop without any file for DROP_QUIET_SECONDS is over, and the next
+        file dropped in the same folder starts a new drop, which replaces the combined patch of the previous one.
+        """
+        now = time.monotonic()
+        with self._drops_lock:
+            last = self._drops.get(drop)
+            if last is None or now - last > self.DROP_QUIET_SECONDS:
+                if os.path.exists(self._combined_path(drop)):
+                    os.remove(self._combined_path(drop))
+                # Oublie les dépôts terminés
+                self._drops = {d: t for d, t in self._drops.items() if now - t <= self.DROP_QUIET_SECONDS}
+            self._drops[drop] = now
+
+    def _drop_finished(self, file_path):
+        # Le délai du dépôt court à partir de son dernier fichier traité
+        with self._drops_lock:
+            self._drops[self._drop_name(file_path)] = time.monotonic()
+
+    def _process_dropped_group(self, job):
+        key, members = job.result_key, job.members
+        file_path, mod_path = members[0]
+        output_path = self._output_path(mod_path)
+        complete = True
+        try:
+            if key is not None and self.results.get(key, output_path):
+                self._print(f"{os.path.basename(file_path)} already documented, served from the results store")
+                self.metrics.files.inc(outcome="from_store")
+                if self.output != "tree":
+                    patches.write_relabeled(output_path, output_path, self._patch_label(file_path))
+            else:
+                complete = self._process_dropped_file(file_path, mod_path)
+                if key is not None and complete and os.path.exists(output_path):
+                    self.results.put(key, output_path)
+            for other_file, other_path in members[1:]:
+                if self.output == "tree":
+                    shutil.copyfile(mod_path, other_path)
+                elif os.path.exists(output_path):
+                    patches.write_relabeled(output_path, self._output_path(other_path), self._patch_label(other_file))
+            if self.output == "combined":
+                # Un patch par dépôt : les patchs des fichiers sont concaténés par dossier déposé
+                for other_file, other_path in members:
+                    if os.path.exists(self._output_path(other_path)):
+                        patches.append(self._output_path(other_path),
+                                       self._combined_path(self._drop_name(other_file)))
+        except Exception as e:
+            complete = False
+            self._print(f"{file_path} : {e.__class__.__name__}: {e}", level="error")
+        finally:
+            if self.output == "combined":
+                for member_path, _ in members:
+                    self._drop_finished(member_path)
+            # Avant done : le fichier ne doit pas être repris par le prochain passage du dossier de dépôt
+            for member_path, _ in members:
+                self._release_dropped_file(member_path, complete)
+            self.scheduler.done(job, complete)
+
+    def _release_dropped_file(self, file_path, complete):
+        """Removes a documented file from the push folder, or moves it to the failed folder if it failed."""
+        try:
+            if complete:
+                os.remove(file_path)
+                return
+            failed_path = file_path.replace(self.push_code_here_path, self.failed_path)
+            os.makedirs(os.path.dirname(failed_path), exist_ok=True)
+            shutil.move(file_path, failed_path)
+            self._print(f"{os.path.relpath(file_path, self.push_code_here_path)} moved to {failed_path}, drop it "
+                        f"again to retry", level="warning")
+        except OSError as e:
+            self._print(f"{file_path} : {e.__class__.__name__}: {e}", level="error")
+
+    def _process_dropped_file(self, file_path, mod_path):
+        try:
+            return self.compute_file(file_path, mod_path, self._patch_label(file_path))
+        except Exception as e:
+            if self.output != "tree":
+                self._print(f"{file_path} could not be documented : {e.__class__.__name__}: {e}", level="error")
+                return False
+            # Un fichier invalide ne doit pas arrêter le watchdog : il est copié tel quel
+            self._print(f"{file_path} could not be documented, copied unchanged : {e.__class__.__name__}: {e}",
+                        level="error")
+            shutil.copyfile(file_path, mod_path)
+            return False
+
+    def compute_file(self, orig_filepath, dest_filepath, patch_label=None):
+        """
+        Documents a file with the plugin of its language, or copies it if no plugin handles it.
 
-            time.sleep(1)
+        In patch mode (patch_label given), the unified diff of the additions is written to dest_filepath.patch
+        instead, and nothing is written for unchanged files and the files that are not source files.
 
-    def compute_file(self, orig_filepath, dest_filepath):
+        Returns:
+            bool: False if some functions could not be documented.
+        """
         item = os.path.basename(orig_filepath)  # get the file name not the path
         item_path = orig_filepath
 
-        _, file_extension = os.path.splitext(item_path)
-
-        if file_extension == ".py":
+        # Le plugin du langage est chargé à la première utilisation (see languages.py)
+        language = languages.name_for(item_path)
+        if language is not None:
             self._print(f"Working on {item}")
-            with open(item_path, "r") as file:
-                code = file.read()
-            modified_code, short_resume = self.add_python_docstring(code)
-            modified_code = autopep8.fix_code(modified_code)
-
-            with open(dest_filepath, "w") as file:
-                file.write(modified_code)
-
-            self.comment_full_code(dest_filepath, short_resume)
-
-            self.correct_py_file(dest_filepath)
-        else:
+            if patch_label is not None:
+                dest_filepath += ".patch"
+            return self.document_file(item_path, dest_filepath, language, patch_label=patch_label)
+        if patch_label is None:
             shutil.copyfile(orig_filepath, dest_filepath)
+        return True
 
     def _TO_IMPLEMENT(self):
 
-        # C part  NOT IMPLEMENTED YET
-        if file_extension == ".c":
-            # Read the file
-            with open(item_path, "r") as file:
-                code = file.read()
-            modified_code = self.comment_c_function(code)
-            # Write the new code to the file
-            with open(os.path.join(path_modified, item), "w") as file:
-                file.write(modified_code)
-
-        elif file_extension == ".mat":
+        if file_extension == ".mat":
             print()
             # extract_matlab_function(item_path)
             # extract_matlab_method(item_path)
@@ -289,81 +514,405 @@ class commentateur:
 
     def arg_usage(self, path_file):
         dir, file = os.path.split(path_file)
-        _, file_extension = os.path.splitext(file)
+        language = languages.name_for(path_file)
+        if self.output != "tree":
+            # Le fichier n'est pas modifié : le patch est écrit à côté
+            if language is not None:
+                self.document_file(path_file, path_file + ".patch", language, patch_label=file)
+                self._print(f"Patch written to {path_file}.patch" if os.path.exists(path_file + ".patch")
+                            else f"Nothing to add to {file}")
+            return
 
-        shutil.copy(path_file, os.path.join(dir, '_' + file))
-        self._print("Original file copied with _ before.")
-        if file_extension == ".py":
-            # Read the file
+        backup_file = os.path.join(dir, '_' + file)
+        checkpoint_path = Checkpoint.path_for(path_file)
+        if os.path.exists(checkpoint_path) and os.path.exists(backup_file) \
+                and Checkpoint(checkpoint_path).matches(path_file):
+            # Reprise d'un lancement interrompu : le fichier est déjà partiellement modifié, on repart de l'original
+            path_original = backup_file
+            self._print("Checkpoint found, resuming from the original file copied with _ before.")
+        else:
+            if os.path.exists(checkpoint_path):
+                # Le fichier a été modifié depuis le lancement interrompu : le checkpoint et la copie sont périmés
+                self._print("Checkpoint discarded, the file changed since it was written.", level="warning")
+                Checkpoint(checkpoint_path).remove()
+            shutil.copy(path_file, backup_file)
+            path_original = path_file
+            self._print("Original file copied with _ before.")
+        if language is not None:
+            self.document_file(path_original, path_file, language)
+
+    def document_python_code(self, source_path, dest_filepath, only_functions=None, full_summary=True,
+                             minimal_edit=False, checkpoint_path=None):
+        """
+        Documents a python file and writes it to dest_filepath: docstrings of the functions, autopep8, summary of the
+        module at the top of the file and commenting of the lines that do not compile.
+
+        The local stages (see pipeline.py) run in the process pool, only the model calls run in this process.
+
+        Args:
+            source_path (str): The python file to document.
+            dest_filepath (str): File receiving the documented code (can be source_path).
+            only_functions (set): If given, only these functions are documented (see add_python_docstring).
+            full_summary (bool): Add the summary of the module at the top of the file (comment_full_code).
+            minimal_edit (bool): Only add the docstrings and the summary (see languages.finalize_file).
+            checkpoint_path (str): Checkpoint of the file, next to dest_filepath if None.
+        """
+        return self.document_file(source_path, dest_filepath, "python", only_functions, full_summary,
+                                  minimal_edit=minimal_edit, checkpoint_path=checkpoint_path)
+
+    def document_file(self, source_path, dest_filepath, language, only_functions=None, full_summary=True,
+                      patch_label=None, minimal_edit=False, checkpoint_path=None):
+        """
+        Documents a file with the plugin of its language (see languages.py) and writes it to dest_filepath. The
+        extraction, insertion and validation run in the process pool, the model calls in this process; the results
+        are cached, checkpointed and generated concurrently whatever the language.
+
+        Args:
+            source_path (str): The file to document.
+            dest_filepath (str): File receiving the documented code (can be source_path).
+            language (str): Name of the language plugin ("python", "c").
+            only_functions (set): If given, only these functions are documented (`def` lines, see
+                pipeline.plan_python_code). Such files are never streamed.
+            full_summary (bool): Add the summary of the module at the top of the file, for the languages that have one.
+            patch_label (str): If given, dest_filepath receives the unified diff of the additions for this path
+                instead of the documented file (see patches.py).
+            minimal_edit (bool): Files of the user edited in place: only the docstrings and the summary are added, the
+                summary replaces the one of a previous run only (see languages.finalize_file).
+            checkpoint_path (str): Checkpoint of the file, next to dest_filepath if None.
+
+        Returns:
+            bool: True if every function was documented, False if some failed (they are retried on the next run).
+
+        Raises:
+            ValueError: In minimal edit mode, if the documented code does not compile (the file is not written).
+        """
+        start = time.time()
+        token_report = {}
+        checkpoint = Checkpoint(checkpoint_path or Checkpoint.path_for(dest_filepath))
+        checkpoint.record_file(source_path)
+        if len(checkpoint):
+            self._print(f"Resuming {os.path.basename(source_path)} from its checkpoint "
+                        f"({len(checkpoint) - len(checkpoint.failures())} functions already documented)")
+        if language == "python" and patch_label is None and only_functions is None \
+                and self.stream_threshold is not None and os.path.getsize(source_path) > self.stream_threshold:
+            # Fichier très gros : documenté par fenêtres d'instructions, mémoire bornée
+            with self.budget.account(source_path):
+                self.document_stream(source_path, dest_filepath, checkpoint, token_report, full_summary)
+        else:
+            plan = self.local_stages.run(languages.plan_file, language, source_path,
+                                         **self._plan_options(only_functions, with_digest=full_summary))
+            with self.budget.account(source_path):
+                results = self.generate_for_jobs(plan["jobs"], checkpoint, token_report)
+                short_resume = self._short_resume(plan["jobs"], results)
+
+                # commente le code complet :
+                header = None
+                if plan["digest"] is not None:
+                    header = self.summary_header(plan["digest"], short_resume, os.path.basename(source_path))
+            self.local_stages.run(languages.finalize_file, language, source_path, dest_filepath,
+                                  pipeline.positions(plan["jobs"]), {i: r[0] for i, r in results.items()}, header,
+                                  patch_label, minimal_edit)
+        self._report_tokens(source_path, token_report)
+        if self.watchdog:
+            # Dépense du fichier à côté du fichier produit dans Modified
+            self.budget.write_usage(source_path, dest_filepath + ".usage.json")
+        else:
+            # -f, --git-diff : rien n'est écrit dans l'arbre de travail de l'utilisateur
+            usage = self.budget.pop_file(source_path)
+            if usage is not None:
+                self._print(f"{os.path.basename(source_path)} : {usage['calls']} model calls, "
+                            f"{usage['prompt_tokens'] + usage['completion_tokens']} tokens, ${usage['cost']:.2f}")
+        self._print(self.hedger.tracker.describe(), level="debug")
+
+        failures = checkpoint.failures()
+        self.metrics.file_seconds.observe(time.time() - start)
+        self.metrics.files.inc(outcome="incomplete" if failures else "complete")
+        if failures:
+            if os.path.exists(dest_filepath):
+                # Le fichier partiellement documenté reste repris depuis ce checkpoint tant qu'il n'est pas modifié
+                checkpoint.record_file(dest_filepath)
+            self._print(f"{len(failures)} functions of {os.path.basename(source_path)} could not be documented, "
+                        f"run again to retry them (checkpoint {checkpoint.path})", level="warning")
+            return False
+        checkpoint.remove()
+        return True
+
+    def document_stream(self, source_path, dest_filepath, checkpoint, token_report, full_summary=True):
+        """
+        Documents a large python file window by window (see streaming.py): every window of top-level statements is
+        planned, documented, formatted and validated, then written to a spool file before the next one is read. The
+        summary header, built from the signature table and the short docstrings gathered on the way, is written in
+        front of the spooled body. The peak memory is about one window plus the largest top-level statement.
+
+        Args:
+            source_path (str): The python file to document.
+            dest_filepath (str): File receiving the documented code (can be source_path, it is replaced at the end).
+            checkpoint (Checkpoint): Journal of the documented functions.
+            token_report (dict): Updated with the tokens sent, the reused docstrings and the tiers.
+            full_summary (bool): Add the summary of the module at the top of the file.
+        """
+        options = self._plan_options()
+        module = streaming.ModuleDigest()
+        short_resume = []
+        body_path = f"{dest_filepath}.{os.getpid()}.body.tmp"
+        out_path = f"{dest_filepath}.{os.getpid()}.tmp"
+        try:
+            with open(source_path, "r") as source, open(body_path, "w") as body:
+                for leading, code in streaming.windows(source.readline, self.stream_window):
+                    body.write(leading)
+                    if not code:
+                        continue
+                    plan = self.local_stages.run(streaming.plan_window, code, **options)
+                    results = self.generate_for_jobs(plan["jobs"], checkpoint, token_report)
+                    body.write(self.local_stages.run(streaming.finalize_window, code, pipeline.positions(plan["jobs"]),
+                                                     {i: r[0] for i, r in results.items()}))
+                    short_resume.append(self._short_resume(plan["jobs"], results))
+                    module.add(plan["table"])
+
+            header = None
+            if full_summary:
+                header = self.summary_header(module.format(), "".join(short_resume), os.path.basename(source_path))
+            with open(body_path, "r") as body, open(out_path, "w") as out:
+                if header is not None:
+                    out.write(header.strip() + "\n")
+                shutil.copyfileobj(body, out)
+            os.replace(out_path, dest_filepath)
+        finally:
+            for path in (body_path, out_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def git_diff_usage(self, rev_range, repo_path="."):
+        """
+        Documents only the python functions changed in a git revision range, in place in the working tree.
+
+        The changed hunks of every python file are mapped to the spans of its functions, and add_python_docstring
+        is run on the affected functions that have no docstring yet. The summary of the module (comment_full_code)
+        is regenerated only when its public signatures changed; it replaces the summary written by a previous run,
+        a docstring written by hand is kept. Only docstrings are added (no reformatting) and a file whose documented
+        code would not compile is left untouched, so runtime, API calls and edits scale with the size of the diff.
+        The checkpoints are kept in the git directory, out of the working tree.
+
+        Args:
+            rev_range (str): "A..B", "A...B" or "A" (compared to the working tree). The line numbers of the diff refer
+                to B, so a file whose working tree copy differs from B is skipped.
+            repo_path (str): Path inside the git repository.
+        """
+        root = git_diff.repository_root(repo_path)
+        base = git_diff.base_revision(rev_range, root)
+        target = git_diff.target_revision(rev_range)
+        changes = git_diff.changed_lines(rev_range, root)
+        checkpoints = os.path.join(git_diff.state_directory(root), "checkpoints")
+        self._print(f"{len(changes)} python files changed in {rev_range}")
+        for rel_path, lines in sorted(changes.items()):
+            path_file = os.path.join(root, rel_path)
+            if not os.path.isfile(path_file):
+                continue
             with open(path_file, "r") as file:
                 code = file.read()
-            # modified_code = comment_python_functions(code)
-            modified_code, short_resume = self.add_python_docstring(code)
-            modified_code = autopep8.fix_code(modified_code)
-            # Write the new code to the file
-            with open(path_file, "w") as file:
-                file.write(modified_code)
+            if target is not None and git_diff.file_at_revision(rel_path, target, root) != code:
+                self._print(f"{rel_path} skipped, the working tree differs from {target}", level="warning")
+                continue
+            try:
+                targets = git_diff.changed_functions(code, lines)
+            except SyntaxError as e:
+                self._print(f"{rel_path} skipped, it does not parse : {e}", level="warning")
+                continue
+            full_summary = git_diff.signatures_changed(code, git_diff.file_at_revision(rel_path, base, root))
+            if not targets and not full_summary:
+                continue
 
-            # commente le code complet :
-            self.comment_full_code(path_file, short_resume)
-            # Vérifie et commente d'eventuelle lignes non commentées
-            self.correct_py_file(path_file)
+            self._print(f"Working on {rel_path} : {len(targets)} changed functions")
+            checkpoint_path = os.path.join(checkpoints, rel_path + ".checkpoint")
+            os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+            try:
+                self.document_python_code(path_file, path_file, only_functions=targets, full_summary=full_summary,
+                                          minimal_edit=True, checkpoint_path=checkpoint_path)
+            except ValueError as e:
+                self._print(f"{rel_path} left unchanged : {e}", level="warning")
 
-    def add_python_docstring(self, code_str):
+    def add_python_docstring(self, code_str, token_report=None, only_functions=None, checkpoint=None):
         """This function adds detailed python docstrings to functions in a given code string.
 
         Parameters:
         - code_str (str): A string containing python code.
+        - token_report (dict): If given, filled with the tokens of the functions sent to the model
+          before ("original") and after ("compacted") compaction.
+        - only_functions (set): If given, only the functions whose `def` line (0 based) is in it are documented.
+        - checkpoint (Checkpoint): If given, the functions already documented in it are not sent again to the model
+          and every new result (or failure) is journaled in it as soon as it arrives.
 
         Returns:
         - new_code_str (str): A string containing the updated python code with docstrings.
         - resume_all_docstring (str): A string containing a summary of the docstrings added to the functions.
 
-        The function first extracts all the functions in the code string using the 'extract_functions' function.
-        It then retrieves the name of each function using the 'noms_fonctions_dans_code' function and compares it to the list of function names already present in the code string.
-        If the name of a function is not present, it is skipped. Otherwise, the function generates a docstring using GPT-3 and indents it properly before inserting it at the start of the function's code block.
+        The function first plans the functions to document (see pipeline.plan_python_code): functions extracted by
+        'extract_functions', whose name is found by 'noms_fonctions_dans_code' in the code string.
+        The docstrings are then generated by 'generate_for_jobs' and inserted after the signature of their function,
+        properly indented, in one pass over the code.
         The updated code string is returned along with a summary of the docstrings added to the functions."""
+        plan = pipeline.plan_python_code(code_str, **self._plan_options(only_functions, with_digest=False))
+        results = self.generate_for_jobs(plan["jobs"], checkpoint, token_report)
+        new_code_str = pipeline.splice_docstrings(code_str, pipeline.positions(plan["jobs"]),
+                                                  {i: r[0] for i, r in results.items()})
+        return new_code_str, self._short_resume(plan["jobs"], results)
+
+    def _plan_options(self, only_functions=None, with_digest=True):
+        return {"only_functions": only_functions, "compact_prompts": self.compact_prompts,
+                "reuse_docstrings": self.docstring_index is not None, "tiering_enabled": self.tiering_enabled,
+                "with_digest": with_digest}
+
+    @staticmethod
+    def _short_resume(jobs, results):
         resume_all_docstring = ""
-        new_code_str = code_str
-        functions = self.extract_functions(code_str)
-        functions_names = self.noms_fonctions_dans_code(code_str)
-        nb_func = len(functions)
-        for function_str, start_index in functions:
-            print("Function untraited : " + str(nb_func))
-            function_name = self.noms_fonctions_dans_code(function_str)
-            if function_name[0] not in functions_names:
-                nb_func -= 1
-                continue
-            else:
-                functions_names.remove(function_name[0])
+        for index, job in enumerate(jobs):
+            if index in results:
+                # Supprime les chevrons éventuels
+                short_docstring = results[index][1].replace(">>>", "")
+                resume_all_docstring += job["name"] + " : " + short_docstring + "\n"
+        return resume_all_docstring
+
+    def _count(self, token_report, name, value=1):
+        if token_report is not None:
+            with self._report_lock:
+                token_report[name] = token_report.get(name, 0) + value
+
+    def generate_for_jobs(self, jobs, checkpoint=None, token_report=None):
+        """
+        Generates the docstrings of planned functions (see pipeline.plan_python_code), model_concurrency at a time.
 
-            # Récupère le docstring
-            doc_string = self.GPT_choice("Turbo", "docstring google style python", function_str)
-            short_docstring = self.GPT_choice("Turbo", "short docstring", doc_string)
+        Structurally identical functions are processed one after the other in the same thread, so only the first one
+        of each class calls the model. A function that fails is journaled as failed and skipped.
 
-            # Supprime les chevrons éventuels
-            doc_string = "\n".join([ligne.replace(">>>", "") for ligne in doc_string.split("\n")])
-            short_docstring = "\n".join([ligne.replace(">>>", "") for ligne in short_docstring.split("\n")])
-            resume_all_docstring += function_name[0] + \
-                                    " : " + short_docstring + "\n"
-            doc_string = self.verify_triple_quotes(doc_string)
+        Args:
+            jobs (list): The planned functions.
+            checkpoint (Checkpoint): If given, the functions already documented in it are reused and the new results
+                are journaled in it.
+            token_report (dict): If given, updated with the tokens sent, the reused docstrings and the tiers.
 
-            # print(doc_string)
+        Returns:
+            dict: {index of the job: (doc_string, short_docstring)} for the documented functions.
+        """
+        results = {}
+        groups = OrderedDict()
+        for index, job in enumerate(jobs):
+            groups.setdefault(job["fingerprint"] or index, []).append(index)
+        remaining = [len(jobs)]
+        account = self.budget.current()
+
+        def run_group(indexes):
+            for index in indexes:
+                job = jobs[index]
+                with self.budget.account(account):
+                    docstrings = self._job_docstrings(job, checkpoint, token_report)
+                if docstrings is not None:
+                    results[index] = docstrings
+                with self._report_lock:
+                    remaining[0] -= 1
+                    self._print("Function untraited : " + str(remaining[0]), level="debug")
+
+        if self.model_concurrency > 1 and len(groups) > 1:
+            with ThreadPoolExecutor(max_workers=self.model_concurrency) as executor:
+                list(executor.map(run_group, groups.values()))
+        else:
+            for indexes in groups.values():
+                run_group(indexes)
+        return results
+
+    def _job_docstrings(self, job, checkpoint=None, token_report=None):
+        # Récupère le docstring, depuis le checkpoint si la fonction a déjà été traitée
+        record = checkpoint.get(job["key"]) if checkpoint is not None else None
+        if record is not None:
+            self.metrics.functions.inc(source="checkpoint")
+            return record["doc_string"], record["short_docstring"]
+        error = None
+        try:
+            doc_string, short_docstring = self.generate_docstrings(job, token_report)
+        except Exception as e:
+            doc_string, short_docstring, error = None, None, f"{e.__class__.__name__}: {e}"
+        if checkpoint is not None:
+            checkpoint.record(job["key"], job["name"], doc_string, short_docstring, error)
+        if doc_string is None or short_docstring is None:
+            # La fonction est ignorée, elle sera retentée au prochain lancement
+            self.metrics.functions.inc(source="failed")
+            self._print(f"No docstring for {job['name']}, function skipped{' : ' + error if error else ''}",
+                        level="warning")
+            return None
+        return doc_string, short_docstring
+
+    def generate_docstrings(self, job, token_report=None):
+        """
+        Returns the docstring and the short docstring of a planned function.
 
-            # Indente le docstring en utilisant la même indentation que la fonction d'origine
-            indentation = self.get_indentation(function_str)
-            doc_string = self.indent_code_str(doc_string, len(indentation) + 4)
+        If a structurally identical function (same code up to the names of its arguments, locals and attributes and
+        the values of its literals) was already documented, its docstrings are adapted to the names of this function
+        without calling the model. Otherwise the function goes to its tier (see tiering): trivial functions get a
+        docstring built from their signature, the others are sent compacted to the small or large model.
 
-            lines = function_str.split('\n')
-            if len(lines) > 1:
-                lines.insert(1, doc_string)
-                code_str = "\n".join(lines)
-            else:
-                code_str = function_str
-            new_code_str = new_code_str.replace(function_str, code_str)
-            nb_func -= 1
+        Args:
+            job (dict): The planned function (see pipeline.plan_python_code).
+            token_report (dict): If given, updated with the tokens sent, the number of reused docstrings and the
+                number of functions per tier.
 
-        return new_code_str, resume_all_docstring
+        Returns:
+            tuple: (doc_string, short_docstring), raw answers of the model.
+        """
+        if job["fingerprint"] is not None and self.docstring_index is not None:
+            reused = self.docstring_index.lookup(job["fingerprint"], job["identifiers"])
+            if reused is not None:
+                doc_string, short_docstring, original_name = reused
+                self._print(f"Docstring of {job['name']} adapted from {original_name}", level="debug")
+                self._count(token_report, "reused")
+                self.metrics.functions.inc(source="reused")
+                return doc_string, short_docstring
+
+        tier, template = job["tier"], job["template"]
+        degraded = self.budget.tier(tier)
+        if degraded != tier:
+            # Budget souple dépassé : un niveau moins cher, le modèle local si la fonction le permet
+            if self.budget.first("soft"):
+                self._print(f"{self.budget.describe()} : soft limit reached, functions routed to cheaper tiers",
+                            level="warning")
+            if degraded == "local":
+                template = tiering.template_docstring(job["prompt"])
+            if degraded != "local" or template is not None:
+                tier = degraded
+        self._count(token_report, tier)
+        self.metrics.functions.inc(source=tier)
+        if tier == "local":
+            return template
+
+        self._count(token_report, "original", job["tokens"][0])
+        self._count(token_report, "compacted", job["tokens"][1])
+        with self.tiers.slot(tier):
+            doc_string = self.GPT_choice("Turbo", job.get("langage", "docstring google style python"), job["prompt"],
+                                         model=self.tiers.model(tier))
+        if doc_string is None:
+            return None, None
+        if not job.get("summary", True):
+            # Pas de résumé du module (fichiers C) : le résumé en 10 mots est inutile
+            return doc_string, ""
+        # Le résumé en 10 mots ne demande jamais le grand modèle
+        with self.tiers.slot("small"):
+            short_docstring = self.GPT_choice("Turbo", "short docstring", doc_string, model=self.tiers.model("small"))
+        if job["fingerprint"] is not None and self.docstring_index is not None and short_docstring is not None:
+            self.docstring_index.add(job["fingerprint"], job["identifiers"], doc_string, short_docstring)
+        return doc_string, short_docstring
+
+    def _report_tokens(self, file_path, token_report):
+        if not token_report:
+            return
+        self.token_report[file_path] = token_report
+        original, compacted = token_report.get("original", 0), token_report.get("compacted", 0)
+        ratio = 100 * (original - compacted) / original if original else 0
+        message = (f"{os.path.basename(file_path)} : {original} prompt tokens, "
+                   f"{compacted} after compaction ({original - compacted} saved, {ratio:.0f}%)")
+        if token_report.get("reused"):
+            message += f", {token_report['reused']} docstrings reused from similar functions"
+        tiers = [f"{token_report[t]} {t}" for t in self.tiers.tiers if token_report.get(t)]
+        if tiers:
+            message += f", tiers : {', '.join(tiers)}"
+        self._print(message)
 
     @staticmethod
     def verify_triple_quotes(s):
@@ -384,7 +933,8 @@ class commentateur:
 
         return s
 
-    def noms_fonctions_dans_code(self, code_str):
+    @staticmethod
+    def noms_fonctions_dans_code(code_str):
         """
         noms_fonctions_dans_code(code_str)
 
@@ -399,9 +949,9 @@ class commentateur:
         - noms_fonctions (list) : Une liste contenant les noms des fonctions du code Python.
         """
         # déindente si necessaire
-        indent = len(self.get_indentation(code_str))
+        indent = len(commentateur.get_indentation(code_str))
         if indent > 0:
-            code_str = self.indent_code_str(code_str, -indent)
+            code_str = commentateur.indent_code_str(code_str, -indent)
         # Analyser le code source avec le module AST de Python
         arbre_syntaxe = ast.parse(code_str)
 
@@ -425,20 +975,7 @@ class commentateur:
 
         A module-level dependency is defined as a module or package that is imported in the code string. This function uses Python's built-in ast (Abstract Syntax Tree) module to parse the input code string and find all import statements. It iterates through each node in the tree and checks if it is an Import or ImportFrom node. If it is an Import node, it adds each module or package name to a set of dependencies. If it is an ImportFrom node, it checks the module name and adds it to the set if it is not empty. Finally, the set of dependencies is returned as a sorted list.
         """
-        dependencies = set()
-
-        tree = ast.parse(code_str)
-
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import):
-                for alias in node.names:
-                    dependencies.add(alias.name)
-            elif isinstance(node, ast.ImportFrom):
-                module_name = node.module
-                if module_name:
-                    dependencies.add(module_name)
-
-        return list(dependencies)
+        return list(digest.signature_table(code_str)["imports"])
 
     def comment_python_functions(self, code_str):
         """
@@ -457,7 +994,7 @@ class commentateur:
         nb_func = len(functions)
         for function_str, start_index in functions:
             # debug = function_str
-            print("Function untraited : " + str(nb_func))
+            self._print("Function untraited : " + str(nb_func), level="debug")
             # Récupère la fonction modifiée
             modified_function_str = self.GPT_choice("Turbo", "Add Python", function_str)
             # modified_function_str = debug
@@ -552,49 +1089,15 @@ class commentateur:
                 format_langage('docstring python')
                 {'langue': 'Python 3.7', 'com1': '#', 'com2': '"""', '
 
-        if langage.lower() == "docstring python":
-            formated = {"langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
-                        "prompt": "# Convert the above function respecting PEP 7 and PEP 257 convention:\n",
-                        "role": "You must write the detailed python docstring following PEP 257 of the function below as a python comment starting with \"\"\" and ending with \"\"\"",
-                        "stop": ["def"], "engine": "Turbo"}
-
-        elif langage.lower() == "short docstring":
-            formated = {"langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
-                        "prompt": "# Convert the above function respecting PEP 7 and Google style convention:\n",
-                        "role": "You must summary in 10 words the python docstring below", "stop": ["def"],
-                        "engine": "Turbo"}
-
-        elif langage.lower() == "add python":
-            formated = {"langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
-                        "prompt": "# Convert the above function respecting PEP 7 and google style convention:\n",
-                        "role": API_langage['en'], "stop": ["def"], "engine": "Turbo"}
-
-        elif langage.lower() == "c":
-            formated = {"langue": "c", "com1": "/* ", "com2": "*/", "start": "\"\"\"",
-                        "prompt": "# An elaborate, high quality docstring for the above c function:\n",
-                        "role": API_langage['en'], "stop": ["\"\"\"", "#"], "engine": "code-davinci-002"}
-
-        elif langage.lower() == "python full code":
-            formated = {"langue": "Python 3.7", "com1": "'''", "com2": "'''", "start": "\"\"\"",
-                        "prompt": "# An elaborate, high quality docstring for the above c function:\n",
-                        "role": "You are an expert in python programming, you must determine the usefulness of this program. your result must be a python comment",
-                        "stop": ["\"\"\"", "#"], "engine": "code-davinci-002"}
-
-        elif langage.lower() == "docstring google style python":
-            formated = {"langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
-                        "prompt": "# Convert the above function respecting PEP 7 and Google style convention:\n",
-                        "role": "You must write a python docstring following Google style python convention of the function below as a python comment starting with \"\"\" and ending with \"\"\"",
-                        "stop": ["def"], "engine": "Turbo"}
-        else:
-            raise ValueError("Langage non pris en charge")
-        return formated
+        return languages.prompt(langage)
 
-    def GPT_choice(self, engine: str = "Turbo", langage: str = "Python", function_or_method: str = ""):
+    def GPT_choice(self, engine: str = "Turbo", langage: str = "Python", function_or_method: str = "", model=None):
         """
         This function takes in three parameters:
         - engine (str): the GPT engine to use. Possible values are "Turbo", "text-davinci-003" and "code-davinci-002". Default is "Turbo".
         - langage (str): the programming language in which the function or method is written. Default is "Python".
         - function_or_method (str): the name of the function or method for which we want to generate the docstring. Default is an empty string.
+        - model (str): the chat model used by the "Turbo" engine (see tiering.TIERS). Default is gpt-3.5-turbo-0613.
 
         The function returns a Python string that is a detailed docstring for the specified function/method. It uses OpenAI's GPT-3 text generation API to generate the docstring.
 
@@ -602,16 +1105,66 @@ class commentateur:
 
         Note that the GPT_turbo and GPT_classic functions are not defined in this script and must be imported from elsewhere.
         """
-        function = None
-        if engine == "Turbo":
-            function = self.GPT_turbo(langage, function_or_method)
-        elif engine == "text-davinci-003":
-            function = self.GPT_classic(langage, function_or_method)
-        elif engine == "code-davinci-002":
-            function = self.GPT_classic(langage, function_or_method)
+        key = self.cache_key(engine if model is None else f"{engine}/{model}", langage, function_or_method)
+        function = self._cache_get(key)
+        if function is not None:
+            self.metrics.responses.inc(source="memory")
+            return function
+        if self.cassette is not None and self.cassette.mode == "replay":
+            # Hors ligne : la réponse enregistrée est servie, CassetteMiss si la requête est inconnue
+            function = self.cassette.play(key)
+            self._cache_put(key, function)
+            self.metrics.responses.inc(source="cassette")
+            return function
+
+        start = time.time()
+        if self.shared_cache is not None:
+            # Réponse déjà générée par une autre machine
+            function = self.shared_cache.get(key)
+            if function is not None:
+                self.metrics.responses.inc(source="shared")
+        if function is None:
+            if self.budget.exhausted():
+                # Limite dure : plus aucun appel, les fonctions seront retentées au prochain lancement
+                if self.budget.first("hard"):
+                    self._print(f"{self.budget.describe()} : hard limit reached, the model is not called any more",
+                                level="error")
+                return None
+            self.metrics.responses.inc(source="model")
+            if engine not in self.ENGINES:
+                raise ValueError(f"Unknown engine {engine}")
+            function = getattr(self, self.ENGINES[engine])(langage, function_or_method, model)
+            if function is not None and self.shared_cache is not None:
+                self.shared_cache.put(key, function)
+
+        if function is not None:
+            self._cache_put(key, function)
+            if self.cassette is not None:
+                self.cassette.record(key, {"engine": engine, "model": model, "langage": langage,
+                                           "content": function_or_method}, function, time.time() - start)
         return function
 
-    def GPT_classic(self, langage, function_or_method):
+    @staticmethod
+    def cache_key(engine, langage, function_or_method):
+        return hashlib.sha256(f"{engine}\0{langage.lower()}\0{function_or_method}".encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            value = self.response_cache.get(key)
+            if value is not None:
+                self.response_cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self.response_cache[key] = value
+            self.response_cache.move_to_end(key)
+            while len(self.response_cache) > self.cache_size:
+                self.response_cache.popitem(last=False)
+
+    def GPT_classic(self, langage, function_or_method, model=None):
         """
         GPT_classic - Uses OpenAI GPT to generate a python docstring for the given programming language and function/method name.
 
@@ -619,6 +1172,8 @@ class commentateur:
 
         @function_or_method: The name of the function/method for which the docstring is to be generated (string)
 
+        @model: Unused, the completion model is given by the format of the langage
+
         The function first formats the given language for OpenAI's GPT engine.
         It then generates a prompt for the GPT engine including the function/method name and the formatted language.
         The function then waits for user input.
@@ -634,27 +1189,30 @@ class commentateur:
         prompt = function_or_method + "\n" + f["prompt"] + "\n" + f["start"]
         print(prompt)
         input()
+        start = time.monotonic()
         response = openai.Completion.create(
             model=f["engine"],
             prompt=prompt,
             temperature=0.7,
-            max_tokens=3500,
+            max_tokens=self.classic_max_tokens,
             top_p=1,
             frequency_penalty=0,
             presence_penalty=0,
             stop=f["stop"]
         )
+        self._observe_call(f["engine"], time.monotonic() - start, response)
         docstring = f["com1"] + response.choices[0].text.strip() + f["com2"]
 
         return docstring
 
-    def GPT_turbo(self, langage, function_or_method):
+    def GPT_turbo(self, langage, function_or_method, model=None):
         """
         GPT_turbo is a function that takes in two parameters - langage and function_or_method. It uses OpenAI's GPT-3 natural language processing model to generate code based on the input provided.
 
         Parameters:
         langage (str): The programming language for which code is to be generated.
         function_or_method (str): The function or method name that needs to be generated.
+        model (str): The chat model to use, gpt-3.5-turbo-0613 by default.
 
         Returns:
         clean_function (str): The generated function or method as a string.
@@ -665,49 +1223,95 @@ class commentateur:
         """
 
         f = self.format_langage(langage)
+        model = model or "gpt-3.5-turbo-0613"
+        deadline_retries = 0
+        error_retries = 0
+        # Les requêtes tournent dans les threads du hedger : elles sont comptées au fichier de ce thread
+        account = self.budget.current()
+
+        def request(timeout):
+            start = time.monotonic()
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": f["role"]},
+                    {"role": "user", "content": function_or_method}
+                ],
+                request_timeout=timeout
+            )
+            # Chaque réponse reçue est facturée, même celle d'un doublon perdant ou d'un appel abandonné au délai
+            with self.budget.account(account):
+                self._observe_call(model, time.monotonic() - start, response)
+            return response
+
         while True:
             try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo-0613",
-                    messages=[
-                        {"role": "system", "content": f["role"]},
-                        {"role": "user", "content": function_or_method}
-                    ]
-                )
+                response = self.hedger.call(request, cost=lambda r: sum(self.response_tokens(r)))
                 function = response['choices'][0]['message']['content']
-                # Diviser la chaîne en plusieurs lignes
-                lignes = function.split('\n')
-
-                # Vérifier si la première ligne contient le symbole ```
-                if '```' in lignes[0]:
-                    # Si c'est le cas, supprimer la première ligne
-                    lignes = lignes[1:]
-                # Vérifier la dernière ligne
-                if '```' in lignes[-1]:
-                    # Si c'est le cas, supprimer la dernière ligne
-                    lignes = lignes[:-1]
-                # Joindre les lignes restantes
-                clean_function = '\n'.join(lignes)
-
-                return clean_function
+                # Supprime la première et la dernière ligne si elles contiennent le symbole ```
+                return normalize.strip_fences(function)
 
             except OpenAIError as error:
+                self._observe_error(model, error)
                 if error.__class__.__name__ == 'AuthenticationError':
-                    print("Erreur d'authentification: vérifiez votre clé API.")
+                    self._print("Erreur d'authentification: vérifiez votre clé API.", level="error")
                     break
                 elif error.__class__.__name__ == 'RateLimitError':
-                    print("Erreur de taux de requête: Attente de 5 minutes.")
-                    # Attendre 5 minutes (300 secondes) avant de réessayer
-                    time.sleep(300)
+                    # Compté avec les autres erreurs : la fonction finit en échec dans le checkpoint au lieu
+                    # d'attendre indéfiniment
+                    error_retries += 1
+                    if error_retries > self.max_error_retries:
+                        self._print("Erreur de taux de requête, abandon de la requête : {}".format(error),
+                                    level="error")
+                        break
+                    wait = min(self.rate_limit_wait * 2 ** (error_retries - 1), self.hedger.deadline)
+                    self._print(f"Erreur de taux de requête: attente de {wait:.0f} secondes.", level="warning")
+                    self.metrics.api_retries.inc(reason="rate_limit")
+                    time.sleep(wait)
                 elif error.__class__.__name__ == 'APIError':
-                    print("Erreur de l'API OpenAI: {}".format(error))
+                    self._print("Erreur de l'API OpenAI: {}".format(error), level="error")
                     break
                 else:
-                    print("Une erreur s'est produite: {}".format(error))
+                    error_retries += 1
+                    if error_retries > self.max_error_retries:
+                        self._print("Une erreur s'est produite, abandon de la requête : {}".format(error),
+                                    level="error")
+                        break
+                    self._print("Une erreur s'est produite: {}".format(error), level="warning")
+                    self.metrics.api_retries.inc(reason="error")
                     time.sleep(5)
+            except DeadlineExceeded as error:
+                self._observe_error(model, error)
+                deadline_retries += 1
+                if deadline_retries > self.max_deadline_retries:
+                    self._print(f"Délai dépassé, abandon de la requête : {error}", level="error")
+                    break
+                self._print(f"Délai dépassé, nouvel essai : {error}", level="warning")
+                self.metrics.api_retries.inc(reason="deadline")
 
         return None
 
+    @staticmethod
+    def response_tokens(response):
+        """Returns the (prompt, completion) tokens of a model response, from its usage field ((0, 0) if missing)."""
+        try:
+            usage = response["usage"]
+        except (KeyError, TypeError):
+            return 0, 0
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    def _observe_call(self, model, seconds, response):
+        prompt_tokens, completion_tokens = self.response_tokens(response)
+        self.metrics.api_requests.inc(model=model, outcome="ok")
+        self.metrics.api_latency.observe(seconds, model=model)
+        self.metrics.tokens.inc(prompt_tokens, model=model, kind="prompt")
+        self.metrics.tokens.inc(completion_tokens, model=model, kind="completion")
+        self.budget.record(model, prompt_tokens, completion_tokens)
+
+    def _observe_error(self, model, error):
+        self.metrics.api_requests.inc(model=model, outcome="error")
+        self.metrics.api_errors.inc(error=error.__class__.__name__)
+
     @staticmethod
     def extract_functions(code):
         """
@@ -725,35 +1329,53 @@ class commentateur:
          extract_functions(code)
         [("def foo():\n    print('Hello, world!')", 0), ("    def baz(self):\n        print('Goodbye, world!')", 4)]
         """
+        return [(function_str, indent_level)
+                for function_str, indent_level, _ in commentateur.extract_functions_with_lines(code)]
+
+    @staticmethod
+    def extract_functions_with_lines(code):
+        """
+        Same as extract_functions, each tuple also contains the index of the first line of the function in the code
+        (0 based), so the docstrings can be spliced in one pass.
+
+        Parameters:
+        code (str): A string of source code containing one or more functions.
+
+        Returns:
+        list: A list of tuples (source code of the function, indent level, index of its first line).
+        """
         functions = []
         current_function = None
         indent_level = 0
-        for line in code.split('\n'):
+        start_line = 0
+        for number, line in enumerate(code.split('\n')):
             actual_indent_line = len(line) - len(line.lstrip())
             if line.strip().startswith('def '):
                 if current_function:
-                    functions.append((current_function, indent_level))
+                    functions.append((current_function, indent_level, start_line))
                 current_function = line
+                start_line = number
                 indent_level = len(line) - len(line.lstrip())
             elif current_function is not None:
                 if line.isspace() or len(line.strip()) > 0:
                     if actual_indent_line > indent_level:
                         current_function += '\n' + line
                     else:
-                        functions.append((current_function, indent_level))
+                        functions.append((current_function, indent_level, start_line))
                         current_function = None
                         indent_level = 0
                 else:
                     current_function += '\n' + line
         if current_function:
-            functions.append((current_function, indent_level))
+            functions.append((current_function, indent_level, start_line))
 
         return functions
 
     @staticmethod
     def extract_C_functions(content):
         """
-        Extracts C functions from input code content string and returns a list of extracted functions.
+        Extracts C functions from input code content string and returns a list of extracted functions
+        (see c_source.extract_c_functions: comments, literals and preprocessor lines are skipped in one pass).
 
         Args:
             content (str): A string containing C code from which functions have to be extracted.
@@ -765,61 +1387,8 @@ class commentateur:
             None.
         """
 
-        pattern = r'\b(\w+)\s+(\w+)\s*\([^)]*\)\s*{'
-
-        functions = []
-        start_index = 0
-
-        for match in re.finditer(pattern, content):
-            # Exclude blocks of code containing a newline before the opening brace
-            if not '\n{' in content[match.start():match.end()]:
-                continue
-            # Find the start of the function body
-            start_index = match.end()
-
-            # Find the end of the function body
-            brace_count = 1
-            end_index = start_index
-            while brace_count > 0:
-                if content[end_index] == '{':
-                    brace_count += 1
-                elif content[end_index] == '}':
-                    brace_count -= 1
-                end_index += 1
-
-            # Add the function to the list
-            function = content[match.start():end_index]
-            functions.append(function)
-
-        return functions
-
-    def comment_c_function(self, code_str):
-        """
-        This function takes a C code as a string and adds a docstring to each function present in the code. It uses the function `extract_C_functions` to extract all the functions defined in the code. Then, it iterates over the list of functions, optimizes them using `optimize_token_c`, generates a docstring using `GPT_choice` (which takes an openAI GPT API key, language type and text as input), and adds the docstring to the second line of each function block by splitting and joining the function string. Finally, it replaces the old function string with the new modified string in the code string, and returns the modified code string with added docstrings.
-
-        Parameters:
-        - code_str: A string containing the C code to which docstrings need to be added.
-
-        Returns:
-        - new_code_str: A modified string containing the C code with added docstrings to each function present in the code.
-        """
-        new_code_str = code_str
-        functions = self.extract_C_functions(code_str)
-        nb_func = len(functions)
-        for function in functions:
-            print("Function untraited : " + str(nb_func))
-            # opt_function = optimize_token_c(function)
-            opt_function = function
-            docstring = self.GPT_choice("code-davinci-002", "C", opt_function)
-            # Diviser la chaîne en plusieurs lignes
-            lines = function.split('\n')
-            # Ajouter la nouvelle chaîne à la deuxième ligne
-            lines[1] += "/* " + docstring + "\n*/"
-            modified_function_str = '\n'.join(lines)
-
-            new_code_str = new_code_str.replace(function, modified_function_str)
-            nb_func -= 1
-        return new_code_str
+        from c_source import extract_c_functions
+        return [function["source"] for function in extract_c_functions(content)]
 
     @staticmethod
     def optimize_token_c(function):
@@ -972,7 +1541,8 @@ class commentateur:
         except SyntaxError as e:
             return e.lineno
 
-    def correct_py_file(self, file_name, code: str = ""):
+    @staticmethod
+    def correct_py_file(file_name, code: str = ""):
         '''
         This function corrects a python file by identifying and commenting out any syntax errors in the file.
 
@@ -989,9 +1559,9 @@ class commentateur:
         IMPORTANT NOTE: The `open_py_file()` and `compile_py_code()` functions used within this function are not defined within the code provided, so this function cannot be run as is. Those functions need to be provided or defined first.
         '''
         if file_name:
-            code = self.open_py_file(file_name)
+            code = commentateur.open_py_file(file_name)
         while True:
-            line_error = self.compile_py_code(code)
+            line_error = commentateur.compile_py_code(code)
             if line_error is None:
                 break
             code = code.split("\n")
@@ -1007,41 +1577,6 @@ class commentateur:
     # ______________________________________________________________________
     # Comment full program
 
-    def extract_return_var_names(self, child_node):
-        '''
-        Extracts return variable names from an Abstract Syntax Tree (AST) node of Python code.
-
-        Parameters:
-            child_node (ast.AST): An AST node of Python code.
-
-        Returns:
-            A list of strings representing the names of the return variables extracted from the child node.
-
-        Raises:
-            None
-
-        Example:
-            ast_node = ast.parse("def add(x, y):\n    return x+y")
-            return_vars = extract_return_var_names(ast_node.body[0])
-            print(return_vars) # Output: ['x', 'y']
-        '''
-        var_names = []
-        if isinstance(child_node, ast.Return):
-            # Si le nœud est de type "Return", extraire les noms des variables de retour
-            if isinstance(child_node.value, ast.Tuple):
-                for elt in child_node.value.elts:
-                    var_names += self.extract_return_var_names(elt)
-            elif isinstance(child_node.value, ast.Name):
-                var_names.append(child_node.value.id)
-        elif isinstance(child_node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-            # Si le nœud est de type "FunctionDef", "AsyncFunctionDef" ou "ClassDef", ne pas descendre dans l'arbre
-            return []
-        else:
-            # Sinon, descendre dans l'arbre et continuer à chercher les noms de variables de retour
-            for sub_node in ast.iter_child_nodes(child_node):
-                var_names += self.extract_return_var_names(sub_node)
-        return var_names
-
     def comment_full_code(self, file_path, short_resume):
         '''This function extracts each function or method of a given file_path in the format
         function_name(arg1, arg2) --> return None | val1 |val2, concatenates them into a string, generates a
@@ -1051,13 +1586,8 @@ class commentateur:
 
         The function does the following:
             - Reads the contents of file_path
-            - Extracts the functions, methods and classes from the file using Abstract Syntax Trees (AST)
-            - Extracts the name and arguments for each function/method and the name of the class if present
-            - Extracts the names of the variables returned by each function/method
-            - Builds a string representation of this information
-            - Extracts the package/module dependencies of the code using get_dependencies function
-            - Builds a string representation of the imports to add to the code
-            - Concatenates this information into one string
+            - Builds the digest of the file with code_digest : its imports, classes and functions/methods (qualified
+            name, arguments, returned names, raised exceptions) in one pass over its Abstract Syntax Tree (AST)
             - Calls the function GPT_choice with the parameters "Turbo", "Python full code", and
             the concatenated string as the argument to generate a comment using GPT model
             - Prepends this comment to the contents of the file_path and writes it back to the file
@@ -1067,42 +1597,9 @@ class commentateur:
         with open(file_path, "r") as f:
             file_contents = f.read()
 
-        parsed_tree = ast.parse(file_contents)
-
-        functions_and_methods = []
-        for node in ast.walk(parsed_tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                # Extraire le nom de la fonction ou de la méthode
-                name = node.name
-
-                # Extraire les arguments de la fonction ou de la méthode
-                args = []
-                for arg_node in node.args.args:
-                    args.append(arg_node.arg)
-
-                # Extraire les noms des variables de retour
-                var_names = []
-                for child_node in ast.iter_child_nodes(node):
-                    var_names += self.extract_return_var_names(child_node)
-
-                # Ajouter l'information dans la liste des fonctions et méthodes
-                info_str = f"{name}({', '.join(args)}) --> {', '.join(var_names)}"
-                functions_and_methods.append(info_str)
-
-            elif isinstance(node, ast.ClassDef):
-                # Extraire le nom de la classe
-                name = node.name
-
-                # Ajouter l'information dans la liste des classes
-                info_str = f"class {name}"
-                functions_and_methods.append(info_str)
-        dependence = self.get_dependencies(file_contents)
-        resume = '\n'.join(functions_and_methods)
-        resume_code = ""
-        for dep in dependence:
-            resume_code += "import " + dep + "\n"
-        resume_code += resume + "\n" + "Summary of function : \n" + short_resume
-        reponse = self.GPT_choice("Turbo", "Python full code", resume_code)
+        reponse = self.summary_header(self.code_digest(file_contents), short_resume, os.path.basename(file_path))
+        if reponse is None:
+            return None
 
         with open(file_path, 'r+') as f:
             content = f.read()
@@ -1110,6 +1607,41 @@ class commentateur:
             f.write(reponse.strip() + "\n" + content)
         return reponse
 
+    @staticmethod
+    def code_digest(file_contents):
+        """
+        Builds the digest of python code sent to the model to summarize it: its imports, then its classes and its
+        functions and methods in the format qualname(arg1, arg2=default) --> val1, val2 raises Error.
+
+        The signature table is built in one pass over the AST and cached by hash of the code (see digest.py), so the
+        docstring stage and the summary parse a file once.
+
+        Args:
+            file_contents (str): The python code.
+
+        Returns:
+            str: The digest. Raises SyntaxError if the code cannot be parsed.
+        """
+        return digest.code_digest(file_contents)
+
+    def summary_header(self, digest, short_resume, name=""):
+        """
+        Asks the model for the summary of a module placed at the top of its file.
+
+        Args:
+            digest (str): Digest of the module (see code_digest).
+            short_resume (str): Short docstrings of its functions.
+            name (str): Name of the file, for the log.
+
+        Returns:
+            str: The summary as python comments, None if the model gave no answer.
+        """
+        resume_code = digest + "\n" + "Summary of function : \n" + short_resume
+        reponse = self.GPT_choice("Turbo", "Python full code", resume_code)
+        if reponse is None:
+            self._print(f"No summary generated for {name}", level="warning")
+        return reponse
+
     def comment_unique_fonction(self, code):
         # modified_code = comment_python_functions(code)
         modified_code, short_resume = self.add_python_docstring(code)
@@ -1120,9 +1652,8 @@ class commentateur:
         code_with_docstring = self.correct_py_file("", modified_code)
         return code_with_docstring, short_resume
 
-    def _print(self, text, role: str = "system_print"):
-        print(text)
-        self.print.append({role: text})
+    def _print(self, text, role: str = "system_print", level: str = "info", **fields):
+        self.log.log(text, level=level, role=role, **fields)
 
 
 if __name__ == '__main__':
@@ -1132,15 +1663,135 @@ if __name__ == '__main__':
     parser.add_argument("-o", "--original", help="Path folder to copy original file before comment (for infinite loop)")
     parser.add_argument("-m", "--modified", help="Path folder to with commented file (for infinite loop)")
     parser.add_argument("-p", "--push", help="Path folder waiting a new file or folder to comment (for infinite loop)")
+    parser.add_argument("--no-compact", action="store_true",
+                        help="Send the functions verbatim to the model instead of a compacted version")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep a warm commentateur resident and serve requests on localhost (see daemon.py)")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the daemon (default 8765)")
+    parser.add_argument("--log-file", help="Rotating log file receiving every event")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info",
+                        help="Minimum level of the events printed on stdout (default info)")
+    parser.add_argument("--no-reuse", action="store_true",
+                        help="Ask the model for every function, even structurally identical ones")
+    parser.add_argument("--no-tiering", action="store_true",
+                        help="Send every function to gpt-3.5-turbo instead of routing them by complexity")
+    parser.add_argument("--large-model",
+                        help="Model of the complex functions (e.g. gpt-4-0613, about 20x the cost per token), "
+                             "gpt-3.5-turbo-0613 by default")
+    parser.add_argument("--deadline", type=float, default=120.0,
+                        help="Maximum duration of a model call in seconds before it is retried (default 120)")
+    parser.add_argument("--no-hedge", action="store_true",
+                        help="Never fire a duplicate request for slow model calls")
+    parser.add_argument("--processes", type=int,
+                        help="Worker processes for parsing, formatting and validation (default : number of CPUs in "
+                             "watchdog mode, 0 otherwise). As many files are documented concurrently")
+    parser.add_argument("--model-concurrency", type=int, default=8,
+                        help="Functions of a file documented concurrently (default 8)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Document every dropped file, even when the same content was already documented")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="Maximum number of dropped files documented at the same time (default : --processes)")
+    parser.add_argument("--scheduling", choices=["sjf", "fair"], default="sjf",
+                        help="Admission order of the dropped files : smallest first, or fair share between the "
+                             "subfolders of the push folder (default sjf)")
+    parser.add_argument("--max-file-size", type=int,
+                        help="Dropped files larger than this many bytes wait until nothing else is queued")
+    parser.add_argument("-s", "--state",
+                        help="Path folder of the internal state of the watchdog (default ./.commentateur_state)")
+    parser.add_argument("--failed",
+                        help="Path folder receiving the dropped files that could not be documented (default ./Failed)")
+    parser.add_argument("--max-queued", type=int, default=10000,
+                        help="Maximum number of dropped files held in the queue, the next ones wait in the push "
+                             "folder (default 10000)")
+    parser.add_argument("--status-file",
+                        help="JSON status file of the queue (default status.json in the state folder)")
+    parser.add_argument("--output", choices=["tree", "patch", "combined"], default="tree",
+                        help="tree : documented copy of every file (default), patch : one unified diff per documented "
+                             "file, combined : one patch per dropped folder. Patches skip unchanged and non-source "
+                             "files and do not apply autopep8")
+    parser.add_argument("--shared-cache", metavar="LOCATION",
+                        help="Cache of the model responses shared between machines : a folder on a shared filesystem "
+                             "or the URL of a cache service (python shared_cache.py)")
+    parser.add_argument("--cache-ttl", type=float,
+                        help="Maximum age in seconds of the shared cache entries (default : no expiry)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve live metrics (throughput, queue, API latency, errors, tokens) in the Prometheus "
+                             "text format on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--soft-tokens", type=int,
+                        help="Tokens of the run after which the functions are routed to cheaper tiers")
+    parser.add_argument("--hard-tokens", type=int,
+                        help="Tokens of the run after which the model is not called any more")
+    parser.add_argument("--soft-cost", type=float, help="Same as --soft-tokens, in dollars")
+    parser.add_argument("--hard-cost", type=float, help="Same as --hard-tokens, in dollars")
+    parser.add_argument("--stream-threshold", type=int, default=4 << 20,
+                        help="Python files larger than this many bytes are documented window by window with a "
+                             "bounded memory (default 4 MiB)")
+    parser.add_argument("--stream-window", type=int, default=1 << 20,
+                        help="Size in bytes of the windows of the streamed files (default 1 MiB)")
+    parser.add_argument("--record", metavar="ARCHIVE",
+                        help="Record every model request/response in a JSON lines archive")
+    parser.add_argument("--replay", metavar="ARCHIVE",
+                        help="Serve the model responses from a recorded archive instead of calling the model")
+    parser.add_argument("--replay-latency", choices=["recorded", "zero"], default="zero",
+                        help="With --replay, sleep the recorded latency of each response or not (default zero)")
+    parser.add_argument("--estimate", metavar="PATH",
+                        help="Estimate the tokens, cost and duration of documenting a file or a folder without "
+                             "calling the model")
+    parser.add_argument("--git-diff", metavar="RANGE",
+                        help="Document in place only the functions changed in a git revision range (A..B, A...B or A)")
+    parser.add_argument("--repo", default=".", help="Path of the git repository for --git-diff")
     args = parser.parse_args()
 
-    if get_openai_api_key() is not None:
-        if args.file:
-            comment = commentateur(watchdog=False)
+    # Options communes à tous les modes
+    options = {"model": ModelOptions(compact_prompts=not args.no_compact, reuse_docstrings=not args.no_reuse,
+                                     tiering_enabled=not args.no_tiering, large_model=args.large_model,
+                                     model_concurrency=args.model_concurrency, deadline=args.deadline,
+                                     hedge=not args.no_hedge),
+               "local": LocalOptions(processes=args.processes or 0, output=args.output,
+                                     stream_threshold=args.stream_threshold, stream_window=args.stream_window),
+               "logs": LogOptions(log_file=args.log_file, log_level=args.log_level, metrics_port=args.metrics_port)}
+    if args.record or args.replay:
+        options["cassette"] = Cassette(args.record or args.replay, mode="record" if args.record else "replay",
+                                       latency=args.replay_latency)
+    options["budget"] = BudgetLedger(soft_tokens=args.soft_tokens, hard_tokens=args.hard_tokens,
+                                     soft_cost=args.soft_cost, hard_cost=args.hard_cost)
+    if args.shared_cache:
+        try:
+            options["shared_cache"] = open_cache(args.shared_cache, ttl=args.cache_ttl)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.estimate:
+        # Aucun appel au modèle : la clé d'API n'est pas nécessaire. Concurrence du watchdog par défaut
+        from estimate import Estimate
+        if args.processes is None:
+            options["local"].processes = os.cpu_count() or 1
+        comment = commentateur(watchdog=False, **options)
+        # Un dossier est documenté par le watchdog : ses checkpoints sont à côté des fichiers de Modified
+        modified = None if os.path.isfile(args.estimate) else args.modified or WatchOptions().path_to_save
+        print(Estimate(comment).run(args.estimate, modified).describe())
+        comment.local_stages.shutdown()
+    # En mode replay le modèle n'est jamais appelé, la clé d'API n'est pas nécessaire
+    elif args.replay or get_openai_api_key() is not None:
+        if args.daemon:
+            from daemon import serve
+            serve(commentateur(watchdog=False, **options), port=args.port)
+        elif args.git_diff:
+            comment = commentateur(watchdog=False, **options)
+            comment.git_diff_usage(args.git_diff, args.repo)
+        elif args.file:
+            comment = commentateur(watchdog=False, **options)
             comment.arg_usage(args.file)
         else:
-            ptw = args.push if args.push else None
-            ptc = args.original if args.original else None
-            pts = args.modified if args.modified else None
-            comment = commentateur(path_to_watch=ptw, path_to_copy=ptc, path_to_save=pts, watchdog=True)
+            watch = WatchOptions(deduplicate=not args.no_dedup, max_in_flight=args.max_in_flight,
+                                 scheduling=args.scheduling, max_file_size=args.max_file_size,
+                                 max_queued=args.max_queued, status_file=args.status_file)
+            watch.path_to_watch = args.push or watch.path_to_watch
+            watch.path_to_copy = args.original or watch.path_to_copy
+            watch.path_to_save = args.modified or watch.path_to_save
+            watch.path_to_failed = args.failed or watch.path_to_failed
+            watch.path_to_state = args.state or watch.path_to_state
+            if args.processes is None:
+                options["local"].processes = os.cpu_count() or 1
+            comment = commentateur(watchdog=True, watch=watch, **options)
             comment.process_folder()
@@ -0,0 +1,300 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Token-minimizing compaction of python source before it is sent to the model.
+# The compacted code keeps the signature, the control flow, the returns and the raises of a function but drops
+# comments, blank lines, old docstrings, redundant whitespace, large constant literals and long runs of similar
+# statements, which are the bulk of the prompt tokens and bring nothing to the docstring.
+import ast
+import io
+import textwrap
+import tokenize
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings = {}
+
+# Statements that can be elided when they are repeated: they never change the control flow of the function
+_SIMPLE_STATEMENTS = (ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Expr, ast.Pass)
+_BODY_FIELDS = ("body", "orelse", "finalbody")
+
+
+def count_tokens(text, model="gpt-3.5-turbo"):
+    """
+    Counts the tokens of a text with tiktoken if it is installed, otherwise estimates it (about 4 characters per token).
+
+    Args:
+        text (str): The text to measure.
+        model (str): The model whose tokenizer must be used.
+
+    Returns:
+        int: The number of tokens of the text.
+    """
+    if not text:
+        return 0
+    if tiktoken is not None:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encodings[model] = encoding
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _source_between(lines, start, end):
+    """Returns the source text between two (row, col) tokenize positions."""
+    (start_row, start_col), (end_row, end_col) = start, end
+    if start_row == end_row:
+        return lines[start_row - 1][start_col:end_col]
+    text = [lines[start_row - 1][start_col:]]
+    text += lines[start_row:end_row - 1]
+    text.append(lines[end_row - 1][:end_col])
+    return "".join(text)
+
+
+def strip_tokens(code):
+    """
+    Rewrites python code token by token: comments and blank lines are removed, each logical line is written on
+    one physical line, whitespace between tokens is collapsed to one space and indentation to one space per level.
+
+    Args:
+        code (str): Python code, possibly indented (methods).
+
+    Returns:
+        str: The rewritten code. Raises tokenize.TokenError or IndentationError if the code cannot be tokenized.
+    """
+    code = textwrap.dedent(code)
+    lines = code.splitlines(keepends=True)
+    out = []
+    depth = 0
+    base_depth = None
+    line_start = True
+    prev_end = None
+    fstring_start = None
+    fstring_level = 0
+    for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+        tok_type, string, start, end = tok.type, tok.string, tok.start, tok.end
+        name = tokenize.tok_name.get(tok_type, "")
+        # Python >= 3.12 splits f-strings in several tokens, they are copied verbatim from the source
+        if name == "FSTRING_START":
+            if fstring_level == 0:
+                fstring_start = start
+            fstring_level += 1
+            continue
+        if fstring_level:
+            if name == "FSTRING_END":
+                fstring_level -= 1
+                if fstring_level == 0:
+                    tok_type, string, start = tokenize.STRING, _source_between(lines, fstring_start, end), fstring_start
+                else:
+                    continue
+            else:
+                continue
+        if tok_type == tokenize.INDENT:
+            depth += 1
+            continue
+        if tok_type == tokenize.DEDENT:
+            depth -= 1
+            continue
+        if tok_type in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER, tokenize.ENCODING):
+            continue
+        if tok_type == tokenize.NEWLINE:
+            if not line_start:
+                out.append("\n")
+            line_start = True
+            continue
+        if line_start:
+            if base_depth is None:
+                base_depth = depth
+            out.append(" " * max(depth - base_depth, 0))
+            line_start = False
+        elif prev_end is not None and (start[0] != prev_end[0] or start[1] > prev_end[1]):
+            out.append(" ")
+        out.append(string)
+        prev_end = end
+    if not line_start:
+        out.append("\n")
+    return "".join(out)
+
+
+class _Elider(ast.NodeVisitor):
+    """Collects the spans of the compacted code that can be replaced by a placeholder."""
+
+    def __init__(self, max_literal_items, max_string_len, max_repeated_statements):
+        self.max_literal_items = max_literal_items
+        self.max_string_len = max_string_len
+        self.max_repeated_statements = max_repeated_statements
+        # (node_start, node_end, replacement, whole_lines)
+        self.replacements = []
+
+    @staticmethod
+    def _shape(node):
+        return tuple(type(n).__name__ for n in ast.walk(node))
+
+    def _visit_statements(self, statements, owner_has_docstring=False):
+        index = 0
+        if owner_has_docstring and statements:
+            doc = statements[0]
+            if len(statements) == 1:
+                self.replacements.append((doc, doc, "...", True))
+            else:
+                self.replacements.append((doc, doc, "", True))
+            index = 1
+        while index < len(statements):
+            stmt = statements[index]
+            run_end = index + 1
+            if isinstance(stmt, _SIMPLE_STATEMENTS):
+                shape = self._shape(stmt)
+                while (run_end < len(statements) and isinstance(statements[run_end], _SIMPLE_STATEMENTS)
+                       and self._shape(statements[run_end]) == shape):
+                    run_end += 1
+            if run_end - index > self.max_repeated_statements:
+                for kept in statements[index:index + self.max_repeated_statements]:
+                    self.visit(kept)
+                first = statements[index + self.max_repeated_statements]
+                self.replacements.append((first, statements[run_end - 1], "...", True))
+            else:
+                for kept in statements[index:run_end]:
+                    self.visit(kept)
+            index = run_end
+
+    @staticmethod
+    def _has_docstring(node):
+        return (node.body and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant)
+                and isinstance(node.body[0].value.value, str))
+
+    def visit_FunctionDef(self, node):
+        # The signature (decorators, arguments, defaults, annotations) is never elided
+        self._visit_statements(node.body, self._has_docstring(node))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+    visit_ClassDef = visit_FunctionDef
+    visit_Module = visit_FunctionDef
+
+    def generic_visit(self, node):
+        for field, value in ast.iter_fields(node):
+            if field in _BODY_FIELDS and isinstance(value, list):
+                self._visit_statements(value)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    def _visit_collection(self, node, items, placeholder):
+        if len(items) > self.max_literal_items:
+            self.replacements.append((node, node, placeholder, False))
+        else:
+            self.generic_visit(node)
+
+    def visit_List(self, node):
+        self._visit_collection(node, node.elts, "[...]")
+
+    def visit_Tuple(self, node):
+        self._visit_collection(node, node.elts, "(...)")
+
+    def visit_Set(self, node):
+        self._visit_collection(node, node.elts, "{...}")
+
+    def visit_Dict(self, node):
+        self._visit_collection(node, node.keys, "{...}")
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, (str, bytes)) and len(node.value) > self.max_string_len:
+            self.replacements.append((node, node, "b'...'" if isinstance(node.value, bytes) else "'...'", False))
+
+    def visit_JoinedStr(self, node):
+        # An f-string keeps its expressions, only its constant parts are long
+        pass
+
+
+def _char_offset(line_starts, lines, lineno, col_offset):
+    # col_offset of the ast nodes is a utf-8 byte offset
+    line = lines[lineno - 1]
+    col = len(line.encode("utf-8")[:col_offset].decode("utf-8", errors="ignore"))
+    return line_starts[lineno - 1] + col
+
+
+def elide(code, max_literal_items=8, max_string_len=200, max_repeated_statements=3):
+    """
+    Replaces docstrings, large literals and long runs of similar statements of the code by placeholders.
+
+    Args:
+        code (str): Python code without indentation (see strip_tokens).
+        max_literal_items (int): Lists, tuples, sets and dicts with more items are replaced by [...] .
+        max_string_len (int): Longer string literals are replaced by '...'.
+        max_repeated_statements (int): Number of similar consecutive statements kept before eliding the run.
+
+    Returns:
+        str: The code with the placeholders, or the input code if it cannot be parsed.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code
+    if tree.body and not hasattr(tree.body[0], "end_lineno"):
+        # Python < 3.8 has no end position on the nodes
+        return code
+    elider = _Elider(max_literal_items, max_string_len, max_repeated_statements)
+    elider.visit(tree)
+    if not elider.replacements:
+        return code
+
+    lines = code.splitlines(keepends=True)
+    line_starts = [0]
+    for line in lines:
+        line_starts.append(line_starts[-1] + len(line))
+    spans = []
+    for first, last, text, whole_lines in elider.replacements:
+        start = _char_offset(line_starts, lines, first.lineno, first.col_offset)
+        end = _char_offset(line_starts, lines, last.end_lineno, last.end_col_offset)
+        if whole_lines and not code[line_starts[first.lineno - 1]:start].strip() \
+                and not code[end:line_starts[last.end_lineno]].strip():
+            indent = code[line_starts[first.lineno - 1]:start]
+            start, end = line_starts[first.lineno - 1], line_starts[last.end_lineno]
+            text = indent + text + "\n" if text else ""
+        elif not text:
+            # The docstring shares its line with other statements (def f(): "doc"; return 1): removing it
+            # would leave a dangling ";", an Ellipsis keeps the line valid
+            text = "..."
+        spans.append((start, end, text))
+
+    # Une seule passe de remplacement, les spans ne se chevauchent pas
+    spans.sort()
+    pieces = []
+    position = 0
+    for start, end, text in spans:
+        pieces.append(code[position:start])
+        pieces.append(text)
+        position = end
+    pieces.append(code[position:])
+    return "".join(pieces)
+
+
+def compact_python_source(code, max_literal_items=8, max_string_len=200, max_repeated_statements=3):
+    """
+    Compacts a python function (or any python code) to minimize the number of tokens sent to the model.
+
+    Comments, blank lines, docstrings and redundant whitespace are removed, large constant literals and long runs
+    of similar simple statements are elided. The signature, the control flow, the returns and the raises are kept.
+
+    Args:
+        code (str): Python code.
+        max_literal_items (int): Lists, tuples, sets and dicts with more items are elided.
+        max_string_len (int): Longer string literals are elided.
+        max_repeated_statements (int): Number of similar consecutive statements kept before eliding the run.
+
+    Returns:
+        str: The compacted code. If the code cannot be tokenized, only its blank lines are removed.
+    """
+    try:
+        compact = strip_tokens(code)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return "\n".join(line for line in code.split("\n") if line.strip())
+    return elide(compact, max_literal_items, max_string_len, max_repeated_statements)
@@ -0,0 +1,281 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Daemon mode for editor integration: a warm commentateur (model response cache, HTTP connection pool) stays
+# resident and serves comment_unique_fonction and whole-file documentation on localhost, one thread per request.
+# The same file is the thin client used by the editors: it only imports the standard library.
+#
+#   server : python comment_py_file.py --daemon [--port 8765]
+#   client : python daemon.py -f file.py            (documents the file in place)
+#            python daemon.py -f file.py -d out.py  (writes the documented file in out.py)
+#            python daemon.py --function code.py    (prints the documented code on stdout)
+#            python daemon.py --status
+#
+# Every request must carry the token of ~/.commentateur_daemon_token (created 0600 by the server), a Host
+# header naming localhost and, for POST, a JSON Content-Type: a web page visited by the user can neither
+# read the token nor send such a request, directly or through DNS rebinding.
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+TOKEN_PATH = os.path.join(os.path.expanduser("~"), ".commentateur_daemon_token")
+TOKEN_HEADER = "X-Commentateur-Token"
+ALLOWED_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def load_token(path=None, create=False):
+    """
+    Reads the token shared by the daemon and its clients, readable by the user only.
+
+    Args:
+        path (str): File holding the token, TOKEN_PATH if None.
+        create (bool): Create the file (mode 0600) with a random token if it does not exist.
+
+    Returns:
+        str: The token.
+
+    Raises:
+        RuntimeError: If the file does not exist and create is False, or if other users can read it.
+    """
+    path = path or TOKEN_PATH
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as file:
+                file.write(secrets.token_hex(32))
+    if not os.path.exists(path):
+        raise RuntimeError(f"Token file {path} not found, start the daemon first")
+    if os.name == "posix" and os.stat(path).st_mode & 0o077:
+        raise RuntimeError(f"Token file {path} is readable by other users, chmod 600 it")
+    with open(path, "r") as file:
+        return file.read().strip()
+
+
+def install_connection_pool(pool_size):
+    """
+    Makes the openai module reuse one HTTP session (keep-alive connections) for every request of the daemon.
+
+    Args:
+        pool_size (int): Maximum number of connections kept open to the API.
+    """
+    import openai
+    try:
+        import requests
+    except ImportError:
+        return
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    openai.requestssession = session
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "commentateur-daemon"
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _host_allowed(self):
+        host = self.headers.get("Host", "")
+        if host.startswith("["):
+            host = host[1:].split("]", 1)[0]
+        else:
+            host = host.rsplit(":", 1)[0]
+        return host in ALLOWED_HOSTS
+
+    def _authorized(self):
+        """
+        Checks the Host header and the token of the request, answers with an error if they are not valid.
+
+        Returns:
+            bool: True if the request can be served.
+        """
+        if not self._host_allowed():
+            self._send(403, {"error": "Invalid Host header"})
+            return False
+        token = self.headers.get(TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+            self._send(403, {"error": "Invalid or missing token"})
+            return False
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._send(200, self.server.status())
+        else:
+            self._send(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.headers.get("Content-Type", "").split(";", 1)[0].strip().lower() != "application/json":
+            self._send(415, {"error": "Content-Type must be application/json"})
+            return
+        try:
+            request = self._read_json()
+        except ValueError as e:
+            self._send(400, {"error": f"Invalid JSON : {e}"})
+            return
+        start = time.time()
+        try:
+            if self.path == "/function":
+                code, summary = self.server.comment.comment_unique_fonction(request["code"])
+                response = {"code": code, "summary": summary}
+            elif self.path == "/file":
+                path = os.path.abspath(request["path"])
+                dest = request.get("dest")
+                if dest:
+                    dest = os.path.abspath(dest)
+                    self.server.comment.compute_file(path, dest)
+                else:
+                    self.server.comment.arg_usage(path)
+                response = {"path": dest or path}
+            else:
+                self._send(404, {"error": f"Unknown endpoint {self.path}"})
+                return
+        except KeyError as e:
+            self._send(400, {"error": f"Missing field {e}"})
+            return
+        except Exception as e:
+            self._send(500, {"error": f"{e.__class__.__name__}: {e}"})
+            return
+        finally:
+            self.server.count_request()
+        response["elapsed"] = time.time() - start
+        self._send(200, response)
+
+    def log_message(self, format, *args):
+        self.server.comment._print(f"daemon {self.address_string()} {format % args}", role="daemon", level="debug")
+
+
+class DocstringDaemon(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, comment, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None):
+        """
+        HTTP server keeping a commentateur resident.
+
+        :param comment: The commentateur used to serve every request (its caches stay warm between requests)
+        :param host: Interface to listen on, localhost by default
+        :param port: Port to listen on
+        :param token: Token the requests must carry, read from (or created in) TOKEN_PATH if None
+        """
+        super().__init__((host, port), _Handler)
+        self.comment = comment
+        self.token = token if token is not None else load_token(create=True)
+        self.started = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def status(self):
+        return {"uptime": time.time() - self.started, "requests": self.requests,
+                "cache_entries": len(self.comment.response_cache),
+                "shared_cache": None if self.comment.shared_cache is None else self.comment.shared_cache.stats,
+                "api_latency": self.comment.hedger.tracker.summary(),
+                "recent_problems": self.comment.log.query(level="warning", limit=20)}
+
+
+def serve(comment, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=16):
+    """
+    Serves comment on host:port until interrupted.
+
+    Args:
+        comment (commentateur): The warm commentateur.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        pool_size (int): Size of the HTTP connection pool to the model API.
+    """
+    install_connection_pool(pool_size)
+    server = DocstringDaemon(comment, host, port)
+    comment._print(f"Daemon listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def call(endpoint, payload=None, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+    """
+    Sends a request to the daemon.
+
+    Args:
+        endpoint (str): "/function", "/file" or "/status".
+        payload (dict): JSON body of the request, None for a GET request.
+        host (str): Host of the daemon.
+        port (int): Port of the daemon.
+        timeout (float): Timeout of the request in seconds, None waits for the model.
+
+    Returns:
+        dict: The JSON response of the daemon.
+
+    Raises:
+        RuntimeError: If the daemon answers with an error or if the token file cannot be read.
+    """
+    url = f"http://{host}:{port}{endpoint}"
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json",
+                                                              TOKEN_HEADER: load_token()})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read()).get("error", str(e)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Client of the commentateur daemon")
+    parser.add_argument("-f", "--file", help="File to comment")
+    parser.add_argument("-d", "--dest", help="Write the commented file here instead of in place")
+    parser.add_argument("--function", help="File containing the code to comment, the result is printed")
+    parser.add_argument("--status", action="store_true", help="Print the status of the daemon")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            print(json.dumps(call("/status", host=args.host, port=args.port), indent=2))
+        elif args.function:
+            with open(args.function, "r") as file:
+                result = call("/function", {"code": file.read()}, host=args.host, port=args.port)
+            print(result["code"])
+        elif args.file:
+            result = call("/file", {"path": os.path.abspath(args.file),
+                                    "dest": os.path.abspath(args.dest) if args.dest else None},
+                          host=args.host, port=args.port)
+            print(f"{result['path']} commented in {result['elapsed']:.1f}s")
+        else:
+            parser.print_help()
+    except (RuntimeError, urllib.error.URLError) as e:
+        print(f"Daemon error : {e}")
+        sys.exit(1)
@@ -0,0 +1,213 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Signature table of a python module, built in one NodeVisitor pass: qualified name, arguments (defaults and
+# annotations), returned names and raised exceptions of every function, the classes and the imports. The table is
+# the digest sent to the model for the summary of a module (comment_full_code) and gives the function names to the
+# docstring stage; it is cached by hash of the code so both stages parse a file once.
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def _expr(node, source):
+    if node is None:
+        return None
+    if hasattr(ast, "unparse"):
+        return ast.unparse(node)
+    # Python < 3.9
+    segment = ast.get_source_segment(source, node) if hasattr(ast, "get_source_segment") else None
+    return segment or "..."
+
+
+class _SignatureVisitor(ast.NodeVisitor):
+    def __init__(self, source):
+        self.source = source
+        self.entries = []
+        self.imports = OrderedDict()
+        # Pile des définitions englobantes : (nom, entrée de la fonction ou None pour une classe)
+        self._scopes = []
+
+    def _qualname(self, name):
+        return ".".join([scope[0] for scope in self._scopes] + [name])
+
+    def _arguments(self, args):
+        arguments = []
+        positional = list(getattr(args, "posonlyargs", [])) + list(args.args)
+        # Les valeurs par défaut s'appliquent aux derniers arguments positionnels
+        defaults = [None] * (len(positional) - len(args.defaults)) + list(args.defaults)
+        for arg, default in zip(positional, defaults):
+            arguments.append(self._argument(arg, default))
+        if getattr(args, "posonlyargs", None):
+            arguments.insert(len(args.posonlyargs), "/")
+        if args.vararg is not None:
+            arguments.append("*" + self._argument(args.vararg))
+        elif args.kwonlyargs:
+            arguments.append("*")
+        for arg, default in zip(args.kwonlyargs, args.kw_defaults):
+            arguments.append(self._argument(arg, default))
+        if args.kwarg is not None:
+            arguments.append("**" + self._argument(args.kwarg))
+        return arguments
+
+    def _argument(self, arg, default=None):
+        text = arg.arg
+        annotation = _expr(arg.annotation, self.source)
+        if annotation is not None:
+            text += ": " + annotation
+        if default is not None:
+            text += (" = " if annotation is not None else "=") + _expr(default, self.source)
+        return text
+
+    def _function(self, node, kind):
+        entry = {"kind": kind, "name": node.name, "qualname": self._qualname(node.name), "line": node.lineno,
+                 "args": self._arguments(node.args), "annotation": _expr(node.returns, self.source),
+                 "returns": [], "raises": []}
+        self.entries.append(entry)
+        self._scopes.append((node.name, entry))
+        self.generic_visit(node)
+        self._scopes.pop()
+
+    def visit_FunctionDef(self, node):
+        self._function(node, "def")
+
+    def visit_AsyncFunctionDef(self, node):
+        self._function(node, "async def")
+
+    def visit_ClassDef(self, node):
+        self.entries.append({"kind": "class", "name": node.name, "qualname": self._qualname(node.name),
+                             "line": node.lineno,
+                             "bases": [_expr(base, self.source) for base in node.bases]})
+        self._scopes.append((node.name, None))
+        self.generic_visit(node)
+        self._scopes.pop()
+
+    def visit_Lambda(self, node):
+        # Les return d'un lambda n'appartiennent pas à la fonction englobante
+        self._scopes.append(("<lambda>", None))
+        self.generic_visit(node)
+        self._scopes.pop()
+
+    def _current(self):
+        return self._scopes[-1][1] if self._scopes else None
+
+    def visit_Return(self, node):
+        entry = self._current()
+        if entry is not None and node.value is not None:
+            values = node.value.elts if isinstance(node.value, ast.Tuple) else [node.value]
+            for value in values:
+                if isinstance(value, ast.Name) and value.id not in entry["returns"]:
+                    entry["returns"].append(value.id)
+        self.generic_visit(node)
+
+    def visit_Raise(self, node):
+        entry = self._current()
+        if entry is not None and node.exc is not None:
+            exc = node.exc.func if isinstance(node.exc, ast.Call) else node.exc
+            name = _expr(exc, self.source)
+            if name not in entry["raises"]:
+                entry["raises"].append(name)
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports[alias.name] = None
+
+    def visit_ImportFrom(self, node):
+        if node.module:
+            self.imports[node.module] = None
+
+
+def build_signature_table(code):
+    """
+    Builds the signature table of python code in one pass over its AST.
+
+    Args:
+        code (str): The python code.
+
+    Returns:
+        dict: "entries", one dict per class (kind, name, qualname, line, bases) and per function (kind, name,
+            qualname, line, args, annotation, returns, raises) in the order of the source, and "imports", the
+            imported modules in order of first import.
+
+    Raises:
+        SyntaxError: If the code cannot be parsed.
+    """
+    visitor = _SignatureVisitor(code)
+    visitor.visit(ast.parse(code))
+    return {"entries": visitor.entries, "imports": list(visitor.imports)}
+
+
+def format_signature_table(table):
+    """
+    Formats a signature table as the digest sent to the model: the imports, then one line per class and per function
+    in the format qualname(arg1, arg2=default) -> annotation --> val1, val2 raises Error.
+    """
+    lines = ["import " + module for module in table["imports"]]
+    for entry in table["entries"]:
+        if entry["kind"] == "class":
+            bases = f"({', '.join(entry['bases'])})" if entry["bases"] else ""
+            lines.append(f"class {entry['qualname']}{bases}")
+            continue
+        line = f"{entry['qualname']}({', '.join(entry['args'])})"
+        if entry["kind"] == "async def":
+            line = "async " + line
+        if entry["annotation"] is not None:
+            line += " -> " + entry["annotation"]
+        line += " --> " + ", ".join(entry["returns"])
+        if entry["raises"]:
+            line += " raises " + ", ".join(entry["raises"])
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class SignatureCache:
+    def __init__(self, max_size: int = 256):
+        """
+        Signature tables of the last modules, keyed by hash of their code.
+
+        :param max_size: Number of tables kept (least recently used evicted first)
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(code):
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+    def get(self, code):
+        """Returns the signature table of the code, built by build_signature_table on a miss."""
+        key = self.key(code)
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+        table = build_signature_table(code)
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.max_size:
+                self._tables.popitem(last=False)
+        return table
+
+
+# Cache du processus : chaque processus du pool des étapes locales a le sien
+_cache = SignatureCache()
+
+
+def signature_table(code):
+    """Returns the (cached) signature table of python code, see build_signature_table."""
+    return _cache.get(code)
+
+
+def function_names(code):
+    """Returns the names of the (non async) functions and methods of python code, nested ones included."""
+    return [entry["name"] for entry in signature_table(code)["entries"] if entry["kind"] == "def"]
+
+
+def code_digest(code):
+    """Returns the digest of python code sent to the model for the summary of the module (cached)."""
+    return format_signature_table(signature_table(code))
@@ -0,0 +1,224 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Dry run of the documentation of a file or a tree: the local stages (extraction of the functions, digest of the
+# modules, prompts) run as in a real run but the model is never called. The prompt tokens are counted, the output
+# tokens are predicted, and the wall-clock time and the cost are projected under the configured concurrency and
+# the rate limits of the models. The calls that the caches would eliminate are reported separately.
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import languages
+from checkpoint import Checkpoint
+from compaction import count_tokens
+from snapshot import hash_file
+
+# Latency (seconds before the first token), generation speed (tokens/s), rate limits (requests and tokens per
+# minute) and prices (dollars per 1000 tokens) of the models, to adjust to the account used
+MODEL_PROFILES = {
+    "gpt-3.5-turbo-0613": {"latency": 0.6, "tokens_per_second": 60, "rpm": 3500, "tpm": 90000,
+                           "prompt_price": 0.0015, "completion_price": 0.002},
+    "gpt-4-0613": {"latency": 1.5, "tokens_per_second": 20, "rpm": 200, "tpm": 40000,
+                   "prompt_price": 0.03, "completion_price": 0.06},
+}
+DEFAULT_MODEL = "gpt-3.5-turbo-0613"
+
+# Predicted answers : docstring = base + ratio * prompt tokens (at most max), fixed size for the others
+DOCSTRING_OUTPUT = (40, 0.45, 600)
+SHORT_DOCSTRING_OUTPUT = 20
+SUMMARY_OUTPUT = 150
+# Tokens added by the chat format to every message
+MESSAGE_OVERHEAD = 8
+
+
+def _files(path):
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names[:] = [d for d in dir_names if not d.startswith(".")]
+        found += [os.path.join(dir_path, name) for name in sorted(file_names)]
+    return found
+
+
+class Estimate:
+    def __init__(self, comment):
+        """
+        Estimation of a run of a commentateur, without model call.
+
+        :param comment: The commentateur whose options (compaction, reuse, tiering, concurrency) are estimated
+        """
+        self.comment = comment
+        self.files = {"documented": 0, "copied": 0, "duplicated": 0, "unreadable": 0}
+        self.functions = {"total": 0, "local": 0, "reused": 0, "cached": 0, "model": 0, "checkpointed": 0}
+        self.eliminated = {"duplicated files": 0, "identical prompts": 0, "structural reuse": 0}
+        # model : calls, prompt tokens, completion tokens
+        self.models = {}
+        self.local_seconds = 0.0
+        self._roles = {}
+        self._prompts = set()
+        self._fingerprints = set()
+
+    def _role_tokens(self, langage):
+        if langage not in self._roles:
+            self._roles[langage] = count_tokens(self.comment.format_langage(langage)["role"]) + 2 * MESSAGE_OVERHEAD
+        return self._roles[langage]
+
+    def _call(self, model, langage, prompt_tokens, completion_tokens):
+        usage = self.models.setdefault(model or DEFAULT_MODEL, {"calls": 0, "prompt": 0, "completion": 0})
+        usage["calls"] += 1
+        usage["prompt"] += self._role_tokens(langage) + prompt_tokens
+        usage["completion"] += completion_tokens
+
+    def run(self, path, modified_path=None):
+        """
+        Plans every file of path (a file or a folder) and accumulates the predicted calls.
+
+        Args:
+            path (str): File or folder to estimate.
+            modified_path (str): Folder receiving the documented files of the folder path, as in watchdog mode, None
+                for files documented in place (-f). The functions already in the checkpoints of the destinations
+                are not counted.
+        """
+        start = time.time()
+        seen_files = set()
+        todo = []
+        for file_path in _files(path):
+            language = languages.name_for(file_path)
+            if language is None:
+                self.files["copied"] += 1
+                continue
+            digest = hash_file(file_path)
+            if digest in seen_files:
+                # Servi par la déduplication des fichiers déposés (see results.py)
+                self.files["duplicated"] += 1
+                continue
+            seen_files.add(digest)
+            todo.append((file_path, language))
+
+        options = self.comment._plan_options()
+
+        def plan(item):
+            file_path, language = item
+            try:
+                return item, self.comment.local_stages.run(languages.plan_file, language, file_path, **options)
+            except (SyntaxError, UnicodeDecodeError, ValueError):
+                return item, None
+
+        workers = max(1, self.comment.local_stages.processes)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            plans = list(executor.map(plan, todo))
+        self.local_seconds = time.time() - start
+
+        for (file_path, language), file_plan in plans:
+            if file_plan is None:
+                self.files["unreadable"] += 1
+                continue
+            self.files["documented"] += 1
+            destination = file_path
+            if modified_path is not None:
+                destination = os.path.join(modified_path, os.path.relpath(file_path, path))
+            # Checkpoint à côté du fichier produit, comme document_file
+            self._add_file(self.comment._output_path(destination), file_plan)
+        # Les fichiers dupliqués auraient demandé autant d'appels qu'un fichier moyen
+        if self.files["documented"]:
+            per_file = sum(u["calls"] for u in self.models.values()) / self.files["documented"]
+            self.eliminated["duplicated files"] = round(per_file * self.files["duplicated"])
+        return self
+
+    def _add_file(self, dest_path, file_plan):
+        checkpoint = Checkpoint(Checkpoint.path_for(dest_path))
+        prompts, fingerprints = self._prompts, self._fingerprints
+        short_resume = 0
+        for job in file_plan["jobs"]:
+            self.functions["total"] += 1
+            if checkpoint.get(job["key"]) is not None:
+                self.functions["checkpointed"] += 1
+                continue
+            if job["tier"] == "local":
+                self.functions["local"] += 1
+                short_resume += SHORT_DOCSTRING_OUTPUT
+                continue
+            langage = job.get("langage", "docstring google style python")
+            calls = 2 if job.get("summary", True) else 1
+            if job["fingerprint"] is not None and self.comment.docstring_index is not None:
+                if job["fingerprint"] in fingerprints:
+                    self.functions["reused"] += 1
+                    self.eliminated["structural reuse"] += calls
+                    short_resume += SHORT_DOCSTRING_OUTPUT
+                    continue
+                fingerprints.add(job["fingerprint"])
+            if (langage, job["prompt"]) in prompts:
+                self.functions["cached"] += 1
+                self.eliminated["identical prompts"] += calls
+                short_resume += SHORT_DOCSTRING_OUTPUT
+                continue
+            prompts.add((langage, job["prompt"]))
+
+            self.functions["model"] += 1
+            base, ratio, maximum = DOCSTRING_OUTPUT
+            doc_tokens = int(min(maximum, base + ratio * job["tokens"][1]))
+            self._call(self.comment.tiers.model(job["tier"]), langage, job["tokens"][1], doc_tokens)
+            if job.get("summary", True):
+                self._call(self.comment.tiers.model("small"), "short docstring", doc_tokens, SHORT_DOCSTRING_OUTPUT)
+                short_resume += SHORT_DOCSTRING_OUTPUT
+        if file_plan["digest"] is not None:
+            self._call(None, "python full code", count_tokens(file_plan["digest"]) + short_resume, SUMMARY_OUTPUT)
+
+    def projection(self):
+        """
+        Projects the wall-clock time and the cost of the model calls.
+
+        Every model is limited by the slowest of: its calls run `concurrency` at a time (tier limit, model
+        concurrency per file times the files documented concurrently), its requests per minute and its tokens per
+        minute. The models run in parallel, the local stages are added (measured during the estimation).
+
+        Returns:
+            dict: {model: {calls, prompt, completion, seconds, bound, cost}}, "seconds" and "cost" of the run.
+        """
+        result = {"models": {}, "seconds": 0.0, "cost": 0.0}
+        concurrency = self.comment.model_concurrency * self.comment.file_concurrency
+        for model, usage in self.models.items():
+            profile = MODEL_PROFILES.get(model, MODEL_PROFILES[DEFAULT_MODEL])
+            # A model shared by several tiers gets the slots of all of them
+            slots = [tier["max_concurrency"] for tier in self.comment.tiers.tiers.values() if tier["model"] == model]
+            limit = concurrency if not slots or None in slots else min(concurrency, sum(slots))
+            mean_latency = (profile["latency"]
+                            + usage["completion"] / max(1, usage["calls"]) / profile["tokens_per_second"])
+            bounds = {"latency": usage["calls"] * mean_latency / max(1, limit),
+                      "requests per minute": usage["calls"] * 60.0 / profile["rpm"],
+                      "tokens per minute": (usage["prompt"] + usage["completion"]) * 60.0 / profile["tpm"]}
+            bound = max(bounds, key=bounds.get)
+            cost = (usage["prompt"] * profile["prompt_price"] + usage["completion"] * profile["completion_price"]) / 1000
+            result["models"][model] = dict(usage, seconds=bounds[bound], bound=bound, concurrency=limit, cost=cost)
+            result["seconds"] = max(result["seconds"], bounds[bound])
+            result["cost"] += cost
+        result["seconds"] += self.local_seconds
+        return result
+
+    def describe(self):
+        projection = self.projection()
+        f, fn = self.files, self.functions
+        lines = [f"Files : {f['documented']} to document, {f['duplicated']} duplicated, {f['copied']} copied, "
+                 f"{f['unreadable']} unreadable",
+                 f"Functions : {fn['total']} ({fn['model']} sent to the model, {fn['local']} local templates, "
+                 f"{fn['reused']} structurally reused, {fn['cached']} identical, {fn['checkpointed']} checkpointed)"]
+        for model, usage in projection["models"].items():
+            lines.append(f"{model} : {usage['calls']} calls, {usage['prompt']} prompt tokens, "
+                         f"~{usage['completion']} completion tokens, ~${usage['cost']:.2f}, "
+                         f"~{_duration(usage['seconds'])} ({usage['concurrency']} concurrent calls, "
+                         f"bound by {usage['bound']})")
+        eliminated = sum(self.eliminated.values())
+        lines.append(f"Calls eliminated by caching : {eliminated} ("
+                     + ", ".join(f"{count} {name}" for name, count in self.eliminated.items()) + ")")
+        lines.append(f"Projected : ~${projection['cost']:.2f}, ~{_duration(projection['seconds'])} "
+                     f"(local stages {_duration(self.local_seconds)})")
+        return "\n".join(lines)
+
+
+def _duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}min"
+    return f"{seconds / 3600:.1f}h"
@@ -0,0 +1,96 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Bounded, structured event log of the commentateur. The last events are kept in a fixed-size ring buffer so the
+# memory stays flat in watchdog mode, and they can optionally be written to a rotating log file.
+import logging
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+
+class EventLog:
+    def __init__(self, capacity: int = 1000, log_file=None, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3,
+                 echo: bool = True, echo_level: str = "info"):
+        """
+        Ring buffer of the last events.
+
+        :param capacity: Number of events kept in memory
+        :param log_file: If given, every event is also written in this file, rotated when it exceeds max_bytes
+        :param max_bytes: Size of the log file before rotation
+        :param backup_count: Number of rotated log files kept
+        :param echo: Print the messages on stdout
+        :param echo_level: Minimum level of the messages printed on stdout (every event is still recorded)
+        """
+        if echo_level not in LEVELS:
+            raise ValueError(f"Unknown level {echo_level}")
+        self.events = deque(maxlen=capacity)
+        self.echo = echo
+        self.echo_level = LEVELS[echo_level]
+        self._lock = threading.Lock()
+        self._logger = None
+        if log_file:
+            self._logger = logging.getLogger(f"commentateur.{id(self)}")
+            self._logger.setLevel(logging.DEBUG)
+            self._logger.propagate = False
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(role)s] %(message)s"))
+            self._logger.addHandler(handler)
+
+    def log(self, message, level: str = "info", role: str = "system_print", **fields):
+        """
+        Records an event.
+
+        Args:
+            message (str): The message of the event.
+            level (str): "debug", "info", "warning" or "error".
+            role (str): Origin of the event.
+            **fields: Structured data attached to the event (file, function, duration...). They cannot
+                replace the time, level, role and message of the event.
+
+        Returns:
+            dict: The recorded event.
+        """
+        if level not in LEVELS:
+            raise ValueError(f"Unknown level {level}")
+        event = dict(fields)
+        event.update(time=time.time(), level=level, role=role, message=str(message))
+        with self._lock:
+            self.events.append(event)
+        if self.echo and LEVELS[level] >= self.echo_level:
+            print(message)
+        if self._logger is not None:
+            self._logger.log(LEVELS[level], event["message"], extra={"role": role})
+        return event
+
+    def query(self, level: str = None, role: str = None, since: float = None, contains: str = None,
+              limit: int = None):
+        """
+        Returns the recent events matching every given criterion, oldest first.
+
+        Args:
+            level (str): Minimum level of the events.
+            role (str): Origin of the events.
+            since (float): Timestamp, only the events recorded after it are returned.
+            contains (str): Substring of the message.
+            limit (int): Only the last `limit` matching events are returned.
+
+        Returns:
+            list: The matching events (dicts with time, level, role, message and the structured fields).
+        """
+        min_level = LEVELS[level] if level else logging.DEBUG
+        with self._lock:
+            events = list(self.events)
+        result = [e for e in events
+                  if LEVELS[e["level"]] >= min_level
+                  and (role is None or e["role"] == role)
+                  and (since is None or e["time"] > since)
+                  and (contains is None or contains in e["message"])]
+        if limit is not None:
+            result = result[-limit:] if limit > 0 else []
+        return result
+
+    def __len__(self):
+        return len(self.events)
@@ -0,0 +1,202 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Structural fingerprints of python functions. Two functions that differ only by the names of their arguments,
+# local variables and attributes, or by the value of their literals (property getters, per-field validators,
+# generated code...) have the same fingerprint, so one docstring can be generated per equivalence class and adapted
+# to the names and literals of the other members (a docstring written for role == "admin" talks about "guest" once
+# reused for role == "guest").
+import ast
+import hashlib
+import re
+import textwrap
+import threading
+from collections import OrderedDict
+
+# Single letters that are also english words are never renamed in a docstring
+_UNSAFE_WORDS = {"a", "A", "I"}
+
+
+class _Canonicalizer(ast.NodeTransformer):
+    """
+    Renames the local identifiers of a function to placeholders in order of first appearance, and replaces its string
+    and number literals by their type (their values are kept in order of appearance).
+    """
+
+    def __init__(self, local_names):
+        self.local_names = local_names
+        self.identifiers = []
+        self.literals = []
+        self._mapping = {}
+
+    def _canon(self, name):
+        if name not in self._mapping:
+            self._mapping[name] = f"_v{len(self._mapping)}"
+            self.identifiers.append(name)
+        return self._mapping[name]
+
+    def visit_FunctionDef(self, node):
+        node.name = self._canon(node.name)
+        # Les docstrings existants ne font pas partie de la structure
+        if (node.body and isinstance(node.body[0], ast.Expr) and isinstance(node.body[0].value, ast.Constant)
+                and isinstance(node.body[0].value.value, str)):
+            node.body = node.body[1:] or [ast.Pass()]
+        return self.generic_visit(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arg(self, node):
+        node.arg = self._canon(node.arg)
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id in self.local_names:
+            node.id = self._canon(node.id)
+        return node
+
+    def visit_Call(self, node):
+        # The name of a called method is kept: self.save() and self.delete() do not do the same thing
+        if isinstance(node.func, ast.Attribute):
+            node.func.value = self.visit(node.func.value)
+            node.args = [self.visit(a) for a in node.args]
+            node.keywords = [self.visit(k) for k in node.keywords]
+            return node
+        return self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        node.attr = self._canon(node.attr)
+        return self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        if node.value is None or isinstance(node.value, bool):
+            return node
+        if isinstance(node.value, (str, int, float)):
+            # Valeur rendue dans les docstrings réutilisés (see adapt_text)
+            self.literals.append(repr(node.value))
+        return ast.Constant(value=f"<{type(node.value).__name__}>")
+
+
+def function_fingerprint(function_str):
+    """
+    Computes the structural fingerprint of a function.
+
+    Args:
+        function_str (str): Source of the function, possibly indented (method).
+
+    Returns:
+        tuple: (fingerprint, identifiers) where identifiers are the original names of the function, its arguments,
+            locals and attributes in order of first appearance, followed by the reprs of its string and number
+            literals in order of appearance, or None if the code is not a single parsable function.
+    """
+    try:
+        tree = ast.parse(textwrap.dedent(function_str))
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return None
+    function = tree.body[0]
+    local_names = {a.arg for a in ast.walk(function.args) if isinstance(a, ast.arg)}
+    local_names.update(n.id for n in ast.walk(function) if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store))
+    canonicalizer = _Canonicalizer(local_names)
+    function = canonicalizer.visit(function)
+    digest = hashlib.sha1(ast.dump(function, annotate_fields=False).encode("utf-8")).hexdigest()
+    return digest, canonicalizer.identifiers + canonicalizer.literals
+
+
+def _literal_text(identifier):
+    """Returns the text of a literal as written in a docstring ("admin", 42), None for a name."""
+    if identifier[:1].isalpha() or identifier[:1] == "_":
+        return None
+    return str(ast.literal_eval(identifier))
+
+
+def _renames(old_identifiers, new_identifiers):
+    renames = {}
+    for old, new in zip(old_identifiers, new_identifiers):
+        if old == new:
+            continue
+        old_text = _literal_text(old)
+        if old_text is not None:
+            # Littéral : "admin" -> "guest", 42 -> 7 (les noms passent avant)
+            if old_text.strip() and old_text not in _UNSAFE_WORDS:
+                renames.setdefault(old_text, _literal_text(new))
+            continue
+        if old in _UNSAFE_WORDS:
+            continue
+        renames[old] = new
+        # get_name -> get_age : the docstring also talks about the "name"
+        old_parts, new_parts = old.split("_"), new.split("_")
+        prefix = _common_length(old_parts, new_parts)
+        suffix = _common_length(old_parts[prefix:][::-1], new_parts[prefix:][::-1])
+        old_core = "_".join(old_parts[prefix:len(old_parts) - suffix])
+        new_core = "_".join(new_parts[prefix:len(new_parts) - suffix])
+        if old_core and new_core and old_core not in _UNSAFE_WORDS and old_core not in renames:
+            renames[old_core] = new_core
+    return renames
+
+
+def _common_length(a, b):
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def adapt_text(text, old_identifiers, new_identifiers):
+    """
+    Replaces in a text (a docstring) the identifiers and literals of a function by the ones of a structurally identical
+    function.
+
+    Args:
+        text (str): Text written for the first function.
+        old_identifiers (list): Identifiers of the first function (see function_fingerprint).
+        new_identifiers (list): Identifiers of the second function, in the same order.
+
+    Returns:
+        str: The adapted text.
+    """
+    renames = _renames(old_identifiers, new_identifiers)
+    if not renames:
+        return text
+    # Les littéraux ne sont pas forcément des mots : bornes explicites plutôt que \b
+    pattern = re.compile(r"(?<!\w)(" + "|".join(re.escape(k) for k in sorted(renames, key=len, reverse=True))
+                         + r")(?!\w)")
+    return pattern.sub(lambda m: renames[m.group(1)], text)
+
+
+class DocstringIndex:
+    def __init__(self, max_size: int = 10000):
+        """
+        Index of the docstrings generated per structural equivalence class of functions.
+
+        :param max_size: Number of equivalence classes kept (least recently used are dropped)
+        """
+        self.max_size = max_size
+        self._classes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, fingerprint, identifiers):
+        """
+        Returns the docstrings of the equivalence class adapted to the given identifiers.
+
+        Args:
+            fingerprint (str): Fingerprint of the function.
+            identifiers (list): Identifiers of the function.
+
+        Returns:
+            tuple: (doc_string, short_docstring, name of the function they were generated for) or None.
+        """
+        with self._lock:
+            entry = self._classes.get(fingerprint)
+            if entry is None:
+                return None
+            self._classes.move_to_end(fingerprint)
+        old_identifiers, doc_string, short_docstring = entry
+        return (adapt_text(doc_string, old_identifiers, identifiers),
+                adapt_text(short_docstring, old_identifiers, identifiers), old_identifiers[0])
+
+    def add(self, fingerprint, identifiers, doc_string, short_docstring):
+        with self._lock:
+            self._classes[fingerprint] = (identifiers, doc_string, short_docstring)
+            self._classes.move_to_end(fingerprint)
+            while len(self._classes) > self.max_size:
+                self._classes.popitem(last=False)
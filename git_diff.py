@@ -0,0 +1,179 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Git helpers for the diff-driven mode: only the python functions touched by a revision range are documented, and
+# the summary of a module is regenerated only when its public signatures changed.
+import ast
+import os
+import re
+import subprocess
+
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def _git(args, cwd):
+    result = subprocess.run(["git"] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed : {result.stderr.strip()}")
+    return result.stdout
+
+
+def repository_root(path="."):
+    return _git(["rev-parse", "--show-toplevel"], path).strip()
+
+
+def state_directory(cwd):
+    """Returns the directory of the internal state of the diff-driven mode, inside the git directory (never committed)."""
+    return os.path.join(_git(["rev-parse", "--absolute-git-dir"], cwd).strip(), "commentateur")
+
+
+def base_revision(rev_range, cwd):
+    """
+    Returns the revision the working tree is compared to.
+
+    Args:
+        rev_range (str): "A..B", "A...B" (compared to the merge base of A and B) or "A" (compared to the working tree).
+        cwd (str): Path inside the repository.
+
+    Returns:
+        str: The base revision.
+    """
+    if "..." in rev_range:
+        left, right = rev_range.split("...", 1)
+        return _git(["merge-base", left or "HEAD", right or "HEAD"], cwd).strip()
+    if ".." in rev_range:
+        return rev_range.split("..", 1)[0] or "HEAD"
+    return rev_range
+
+
+def target_revision(rev_range):
+    """
+    Returns the revision whose content the changed lines refer to.
+
+    Args:
+        rev_range (str): "A..B", "A...B" or "A" (see base_revision).
+
+    Returns:
+        str: B (HEAD if omitted), None for "A" where the working tree itself is compared.
+    """
+    for separator in ("...", ".."):
+        if separator in rev_range:
+            return rev_range.split(separator, 1)[1] or "HEAD"
+    return None
+
+
+def changed_lines(rev_range, cwd):
+    """
+    Lists the lines added or modified in the python files of a revision range.
+
+    Args:
+        rev_range (str): Revision range given to git diff (see base_revision).
+        cwd (str): Path inside the repository.
+
+    Returns:
+        dict: {path relative to the repository root: set of line numbers in the new version}. A pure deletion
+            marks the lines around it so the enclosing function is still considered changed.
+    """
+    diff = _git(["diff", "--unified=0", "--no-color", "--no-ext-diff", "--diff-filter=AMR", rev_range, "--",
+                 "*.py"], cwd)
+    changes = {}
+    current = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            path = line[4:]
+            current = changes.setdefault(path[2:], set()) if path.startswith("b/") else None
+        elif current is not None and line.startswith("@@"):
+            match = _HUNK.match(line)
+            if match is None:
+                continue
+            start = int(match.group(1))
+            count = int(match.group(2)) if match.group(2) is not None else 1
+            if count == 0:
+                current.update((start, start + 1))
+            else:
+                current.update(range(start, start + count))
+    return changes
+
+
+def file_at_revision(rel_path, revision, cwd):
+    """Returns the content of rel_path at revision, or None if the file does not exist there."""
+    try:
+        return _git(["show", f"{revision}:{rel_path}"], cwd)
+    except RuntimeError:
+        return None
+
+
+def function_spans(code):
+    """
+    Returns the line spans of every function of the code.
+
+    Args:
+        code (str): Python code.
+
+    Returns:
+        list: (node, first line including the decorators, last line) for every function or method.
+    """
+    spans = []
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            end = getattr(node, "end_lineno", None)
+            if end is None:
+                # Python < 3.8
+                end = max(getattr(n, "lineno", node.lineno) for n in ast.walk(node))
+            spans.append((node, start, end))
+    return spans
+
+
+def changed_functions(code, lines):
+    """
+    Returns the functions of the code containing one of the given line numbers and not documented yet.
+
+    Args:
+        code (str): Python code.
+        lines (set): Changed line numbers (1 based).
+
+    Returns:
+        set: Index (0 based) of the `def` line of every such function, the key used by pipeline.plan_python_code:
+            methods of the same name in other classes are not selected with them.
+    """
+    return {node.lineno - 1 for node, start, end in function_spans(code)
+            if ast.get_docstring(node) is None and any(start <= line <= end for line in lines)}
+
+
+def public_signatures(code):
+    """
+    Returns the public API of a module: the signatures of its public classes, functions and methods.
+
+    Args:
+        code (str): Python code.
+
+    Returns:
+        set: (qualified name, dump of the arguments, dump of the return annotation) for every public definition.
+    """
+    signatures = set()
+
+    def visit(nodes, prefix):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if node.name.startswith("_") and not node.name.startswith("__"):
+                    continue
+                name = prefix + node.name
+                if isinstance(node, ast.ClassDef):
+                    signatures.add((name, ast.dump(ast.Tuple(elts=node.bases, ctx=ast.Load())), ""))
+                    visit(node.body, name + ".")
+                else:
+                    signatures.add((name, ast.dump(node.args), ast.dump(node.returns) if node.returns else ""))
+
+    visit(ast.parse(code).body, "")
+    return signatures
+
+
+def signatures_changed(code, old_code):
+    """Returns True if the public signatures differ between old_code (None for a new file) and code."""
+    if old_code is None:
+        return True
+    try:
+        return public_signatures(code) != public_signatures(old_code)
+    except SyntaxError:
+        return True
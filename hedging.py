@@ -0,0 +1,171 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Per-call deadlines and hedged requests for the model calls. When a call is slower than a percentile of the
+# recent latencies, a duplicate request is fired and the first answer wins; the number of duplicates is capped by
+# a budget (fraction of the calls and of the tokens). A duplicate only gets the time left before the deadline of
+# the call, an attempt not started yet when the other one answers is never sent, and the tokens of the losing
+# attempts are charged to the hedge budget. The latencies are tracked to report the tail latency.
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 1000):
+        """
+        Latencies of the last calls.
+
+        :param window: Number of latencies kept to compute the percentiles
+        """
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        # Tokens of the answers used, and of the answers of the losing attempts (cost of hedging)
+        self.tokens = 0
+        self.hedge_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def percentile(self, p, min_samples: int = 20):
+        """Returns the p-th percentile of the recent latencies, None while there are less than min_samples."""
+        with self._lock:
+            values = sorted(self.latencies)
+        if len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def summary(self):
+        """Returns the number of calls, hedges, timeouts and tokens and the p50, p90, p99 and max latencies."""
+        result = {"calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                  "timeouts": self.timeouts, "tokens": self.tokens, "hedge_tokens": self.hedge_tokens}
+        for p in (50, 90, 99):
+            result[f"p{p}"] = self.percentile(p, min_samples=1)
+        with self._lock:
+            result["max"] = max(self.latencies) if self.latencies else None
+        return result
+
+    def describe(self):
+        s = self.summary()
+        if s["p50"] is None:
+            return "API latency : no call"
+        return (f"API latency : p50 {s['p50']:.1f}s, p90 {s['p90']:.1f}s, p99 {s['p99']:.1f}s, max {s['max']:.1f}s "
+                f"({s['calls']} calls, {s['hedges']} hedged, {s['hedge_wins']} won by the hedge, "
+                f"{s['timeouts']} timeouts, {s['hedge_tokens']} tokens spent on losing attempts)")
+
+
+class HedgedCaller:
+    def __init__(self, deadline: float = 120.0, hedge: bool = True, hedge_percentile: float = 95,
+                 hedge_min_delay: float = 2.0, hedge_budget: float = 0.05, max_workers: int = 32):
+        """
+        Runs the model calls with a deadline and optional hedging.
+
+        :param deadline: Maximum duration of a call in seconds, DeadlineExceeded is raised after it
+        :param hedge: Fire a duplicate request when a call is slower than the hedge_percentile of the latencies
+        :param hedge_percentile: Percentile of the recent latencies after which the duplicate is fired
+        :param hedge_min_delay: Minimum delay before hedging (also used until enough latencies are known)
+        :param hedge_budget: Maximum fraction of the calls that can be hedged, and of the tokens spent on the losing
+            attempts
+        :param max_workers: Maximum number of requests in flight
+        """
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.tracker = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+
+    def hedge_delay(self):
+        percentile = self.tracker.percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, percentile or 0)
+
+    def _may_hedge(self):
+        # Le premier doublon est toujours autorisé, ensuite au plus hedge_budget des appels et des tokens
+        t = self.tracker
+        return (self.hedge and t.hedges + 1 <= max(1.0, self.hedge_budget * t.calls)
+                and (t.hedges == 0 or t.hedge_tokens <= self.hedge_budget * t.tokens))
+
+    @staticmethod
+    def _attempt(fn, timeout, cancelled):
+        # Doublon encore en file quand l'autre tentative a répondu : la requête n'est pas envoyée
+        if cancelled.is_set():
+            raise CancelledError()
+        return fn(timeout)
+
+    def _abandon(self, futures, cancelled, cost):
+        """Stops the attempts that lost: never sent if not started, their tokens charged to the hedge budget."""
+        cancelled.set()
+
+        def charge(future):
+            if cost is not None and not future.cancelled() and future.exception() is None:
+                self.tracker.count("hedge_tokens", cost(future.result()))
+
+        for future in futures:
+            future.cancel()
+            # Appelé tout de suite si la tentative est déjà finie, à sa fin sinon
+            future.add_done_callback(charge)
+
+    def call(self, fn, cost=None):
+        """
+        Calls fn(timeout) and returns its result, hedging it if it is too slow.
+
+        Args:
+            fn (callable): The request, called with the number of seconds it may last (the duplicate only gets the
+                time left before the deadline of the call), possibly twice concurrently.
+            cost (callable): cost(result) -> tokens of a result, the tokens of the losing attempts are charged to the
+                hedge budget.
+
+        Returns:
+            The result of the first successful call.
+
+        Raises:
+            DeadlineExceeded: If no call answered before the deadline.
+            Exception: The exception of the call if every call failed.
+        """
+        start = time.monotonic()
+        self.tracker.count("calls")
+        cancelled = threading.Event()
+        pending = {self._executor.submit(self._attempt, fn, self.deadline, cancelled)}
+        hedge_future = None
+        error = None
+        timeout = min(self.hedge_delay(), self.deadline) if self.hedge else self.deadline
+        while True:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._abandon(pending | (done - {future}), cancelled, cost)
+                    elapsed = time.monotonic() - start
+                    self.tracker.record(elapsed)
+                    if future is hedge_future:
+                        self.tracker.count("hedge_wins")
+                    if cost is not None:
+                        self.tracker.count("tokens", cost(future.result()))
+                    return future.result()
+                error = error or future.exception()
+            remaining = self.deadline - (time.monotonic() - start)
+            if hedge_future is None and remaining > 0 and self._may_hedge() and (pending or error is None):
+                # La requête est trop lente : on lance un doublon, le premier qui répond gagne
+                self.tracker.count("hedges")
+                hedge_future = self._executor.submit(self._attempt, fn, remaining, cancelled)
+                pending.add(hedge_future)
+            if not pending:
+                raise error
+            if remaining <= 0:
+                self._abandon(pending, cancelled, cost)
+                self.tracker.count("timeouts")
+                raise DeadlineExceeded(f"No answer after {self.deadline:g}s")
+            timeout = remaining
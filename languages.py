@@ -0,0 +1,121 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Registry of the language plugins, keyed by file extension. A plugin is a module exposing LANGUAGE, a dict with
+#   extract  : extract(code, **options) -> plan, the functions to document (see pipeline.plan_python_code)
+#   insert   : insert(code, job_positions, docstrings, header, reformat, replace_header) -> documented code (one
+#              pass), reformat is False in patch mode, replace_header replaces the summary of a previous run
+#   validate : validate(code) -> code that still compiles (or the best effort of the language)
+#   check    : check(code) -> code unchanged, ValueError if it does not compile (minimal edits, see finalize_file)
+#   prompts  : {langage: prompt format} used by commentateur.format_langage
+# Plugins are imported on first use, so a run only loads the languages of the files it sees. The generic stages
+# plan_file and finalize_file take the name of the language and run in the process pool (see pipeline.py).
+import importlib
+import os
+import threading
+
+import patches
+
+# name : (module, extensions, prompts)
+_REGISTRY = {}
+_loaded = {}
+_lock = threading.Lock()
+
+
+def register(name, module, extensions, prompts=()):
+    """
+    Registers a language plugin without importing it.
+
+    Args:
+        name (str): Name of the language.
+        module (str): Module of the plugin, exposing LANGUAGE.
+        extensions (tuple): File extensions of the language (with the dot).
+        prompts (tuple): Names of the prompt formats of the plugin (see commentateur.format_langage).
+    """
+    _REGISTRY[name] = (module, tuple(e.lower() for e in extensions), tuple(p.lower() for p in prompts))
+
+
+register("python", "pipeline", (".py",),
+         ("docstring python", "short docstring", "add python", "python full code", "docstring google style python"))
+register("c", "c_source", (".c", ".h"), ("docstring c",))
+
+
+def get(name):
+    """Returns the LANGUAGE of a registered plugin, importing it on first use."""
+    language = _loaded.get(name)
+    if language is None:
+        with _lock:
+            if name not in _loaded:
+                _loaded[name] = importlib.import_module(_REGISTRY[name][0]).LANGUAGE
+            language = _loaded[name]
+    return language
+
+
+def name_for(path):
+    """Returns the name of the language of a file from its extension, None if no plugin handles it."""
+    extension = os.path.splitext(path)[1].lower()
+    for name, (_, extensions, _) in _REGISTRY.items():
+        if extension in extensions:
+            return name
+    return None
+
+
+def prompt(langage):
+    """
+    Returns the prompt format of a langage.
+
+    Raises:
+        ValueError: If no registered plugin provides it.
+    """
+    langage = langage.lower()
+    for name, (_, _, prompts) in _REGISTRY.items():
+        if langage in prompts:
+            return dict(get(name)["prompts"][langage])
+    raise ValueError("Langage non pris en charge")
+
+
+def plan_file(name, path, **options):
+    """Reads a file and returns the plan of its language plugin (see pipeline.plan_python_code)."""
+    with open(path, "r") as file:
+        return get(name)["extract"](file.read(), **options)
+
+
+def finalize_file(name, source_path, dest_path, job_positions, docstrings, header=None, patch_label=None,
+                  minimal_edit=False):
+    """
+    Writes the documented file: docstrings inserted by the plugin in one pass, then validated. In patch mode the
+    unified diff of the additions is written instead (see patches.py), nothing if the file is unchanged. In minimal
+    edit mode (files of the user edited in place) only the docstrings and the summary are added: no reformatting,
+    no commenting of the invalid lines, and the file is left untouched if the result does not compile.
+
+    Args:
+        name (str): Name of the language.
+        source_path (str): The original file.
+        dest_path (str): The documented file to write (can be source_path).
+        job_positions (list): (line, indent, insert) of every job (see pipeline.positions).
+        docstrings (dict): {index of the job: docstring answered by the model}.
+        header (str): Summary of the module written at the top of the file, None for no summary.
+        patch_label (str): Path of the file in the patch, None to write the documented file.
+        minimal_edit (bool): Add the docstrings only, the header replaces the summary of a previous run.
+
+    Returns:
+        bool: True if something was written.
+
+    Raises:
+        ValueError: In minimal edit mode, if the documented code does not compile.
+    """
+    language = get(name)
+    with open(source_path, "r") as file:
+        code = file.read()
+    modified_code = language["insert"](code, job_positions, docstrings, header,
+                                       reformat=patch_label is None and not minimal_edit, replace_header=minimal_edit)
+    # Raises ValueError in minimal edit mode: the file is not written
+    modified_code = language["check" if minimal_edit else "validate"](modified_code)
+    if patch_label is not None:
+        modified_code = patches.unified_patch(code, modified_code, patch_label)
+        if not modified_code:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            return False
+    with open(dest_path, "w") as file:
+        file.write(modified_code)
+    return True
@@ -0,0 +1,215 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Live metrics of the commentateur in the Prometheus text format (version 0.0.4), served on localhost by
+# MetricsServer (GET /metrics). Counters and histograms are updated by the pipeline stages, a dict update under a
+# lock per metric; the gauges (queue depth, cache sizes...) are callbacks read only when the endpoint is scraped.
+#
+#   python comment_py_file.py --metrics-port 9464    then    curl http://127.0.0.1:9464/metrics
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 9464
+# Seconds, from a cached answer to a slow gpt-4 call
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+FILE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """
+        :param name: Name of the metric
+        :param help: Description of the metric
+        :param labels: Names of the labels, their values are given as keyword arguments
+        :param function: Callback computing the value at scrape time instead of updating it: a number, or a dict
+                         {tuple of label values: number}
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def _samples(self):
+        if self.function is None:
+            with self._lock:
+                return list(self._values.items())
+        value = self.function()
+        if isinstance(value, dict):
+            return list(value.items())
+        return [((), value)] if value is not None else []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._samples()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Compte par intervalle, les cumuls ne sont calculés qu'à la lecture
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in samples:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """Metrics of a commentateur, in the order of their registration."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        return self._add(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._add(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class PipelineMetrics(Registry):
+    def __init__(self):
+        """Registry with the metrics updated by the stages of the commentateur."""
+        super().__init__()
+        self.files = self.counter("commentateur_files_total", "Documented files by outcome (complete, incomplete, "
+                                                              "from_store)", ("outcome",))
+        self.file_seconds = self.histogram("commentateur_file_seconds", "Duration of the documentation of a file",
+                                           buckets=FILE_BUCKETS)
+        self.functions = self.counter("commentateur_functions_total", "Documented functions by origin (tier, reused, "
+                                                                      "checkpoint, failed)", ("source",))
+        self.responses = self.counter("commentateur_responses_total", "Answers of GPT_choice by source (memory, "
+                                                                      "shared, cassette, model)", ("source",))
+        self.api_requests = self.counter("commentateur_api_requests_total", "Model requests by model and outcome",
+                                         ("model", "outcome"))
+        self.api_latency = self.histogram("commentateur_api_latency_seconds",
+                                          "Latency of the successful model requests, hedging included", ("model",))
+        self.api_errors = self.counter("commentateur_api_errors_total", "Failed model requests by error type",
+                                       ("error",))
+        self.api_retries = self.counter("commentateur_api_retries_total", "Model requests retried by reason",
+                                        ("reason",))
+        self.tokens = self.counter("commentateur_tokens_total", "Tokens of the model requests (usage field)",
+                                   ("model", "kind"))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "commentateur-metrics"
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, registry, host="127.0.0.1", port=DEFAULT_PORT):
+        """
+        HTTP endpoint of the metrics.
+
+        :param registry: The Registry rendered at every scrape
+        :param host: Interface to listen on, localhost by default
+        :param port: Port to listen on
+        """
+        super().__init__((host, port), _Handler)
+        self.registry = registry
+
+    def start(self):
+        """Serves in a background thread, returns the URL of the endpoint."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/metrics"
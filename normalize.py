@@ -0,0 +1,131 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Normalization of the model answers. strip_fences removes the markdown fence lines around an answer by slicing
+# between the first and the last newline, without splitting the answer into lines. docstring cleans a docstring
+# answer (doctest markers, balanced triple quotes) and indents it for its function, with one C-level pass per
+# transformation and no per-line python loop. Both give the same results as the line-by-line cleanup they replace
+# (GPT_turbo, verify_triple_quotes, indent_code_str), which tests/test_normalize.py checks on random answers.
+#
+#   python normalize.py [--bench N]    microbenchmark against the former cleanup
+FENCE = "```"
+QUOTES = '"""'
+# ASCII line boundaries of str.splitlines other than \n (the others are not ASCII)
+_OTHER_LINE_BREAKS = ("\r", "\x0b", "\x0c", "\x1c", "\x1d", "\x1e")
+
+
+def strip_fences(text):
+    """
+    Removes the first line of an answer if it contains a markdown fence, then its last line if it contains one.
+
+    Args:
+        text (str): The answer of the model.
+
+    Returns:
+        str: The answer without its fence lines ("" if only a fence line is left).
+    """
+    start, end = 0, len(text)
+    newline = text.find("\n")
+    if text.find(FENCE, 0, newline if newline >= 0 else end) >= 0:
+        if newline < 0:
+            return ""
+        start = newline + 1
+    last = text.rfind("\n", start)
+    last_start = start if last < 0 else last + 1
+    if text.find(FENCE, last_start) >= 0:
+        # La dernière ligne est supprimée avec le retour à la ligne qui la précède
+        end = start if last < 0 else last
+    if start == 0 and end == len(text):
+        return text
+    return text[start:end]
+
+
+def docstring(text, indentation=4):
+    """
+    Cleans a docstring answered by the model and indents it.
+
+    The doctest markers (>>>) are removed, the docstring is opened and closed by triple quotes and the triple quotes
+    inside it become ''' so the docstring stays one string literal, then every line is indented.
+
+    Args:
+        text (str): The docstring answered by the model (see strip_fences).
+        indentation (int): Number of spaces added in front of every line.
+
+    Returns:
+        str: The docstring ready to be spliced in the code.
+    """
+    if ">>>" in text:
+        text = text.replace(">>>", "")
+    if not text.startswith(QUOTES):
+        text = QUOTES + text
+    # Équivalent de text.strip().endswith('"""') sans copie de la chaîne
+    end = len(text)
+    while end and text[end - 1].isspace():
+        end -= 1
+    if not text.endswith(QUOTES, 0, end):
+        text = text + QUOTES
+    last = text.rfind(QUOTES)
+    if text.find(QUOTES, 3, last) >= 0 or last < 3:
+        # Guillemets triples intérieurs : remplacés comme dans verify_triple_quotes
+        text = text[:3] + text[3:last].replace(QUOTES, "'''") + text[last:]
+    prefix = " " * indentation
+    if not text.isascii() or any(separator in text for separator in _OTHER_LINE_BREAKS):
+        # Séparateurs de splitlines autres que \n (rares) : découpage explicite
+        return prefix + ("\n" + prefix).join(text.splitlines()) if text else ""
+    if text.endswith("\n"):
+        # splitlines ignore le dernier retour à la ligne
+        text = text[:-1]
+    return prefix + text.replace("\n", "\n" + prefix)
+
+
+def _legacy_strip_fences(text):
+    # Nettoyage ligne par ligne de GPT_turbo avant normalize.py
+    lignes = text.split('\n')
+    if '```' in lignes[0]:
+        lignes = lignes[1:]
+    if '```' in lignes[-1]:
+        lignes = lignes[:-1]
+    return '\n'.join(lignes)
+
+
+def _legacy_docstring(text, indentation):
+    # Nettoyage de pipeline.format_docstring avant normalize.py
+    from comment_py_file import commentateur as C
+    text = "\n".join([ligne.replace(">>>", "") for ligne in text.split("\n")])
+    text = C.verify_triple_quotes(text)
+    return C.indent_code_str(text, indentation)
+
+
+def bench(iterations=20000):
+    """Times and measures the allocations of the former and the new cleanup of a typical answer."""
+    import timeit
+    import tracemalloc
+    answer = ("```python\n" + QUOTES + "Computes the mean of the values.\n\n    Args:\n"
+              + "".join(f"        value_{i} (float): The value {i} of the series, in meters.\n" for i in range(12))
+              + "\n    Returns:\n        float: The mean.\n\n    Examples:\n        >>> mean(1, 2)\n        1.5\n"
+              + QUOTES + "\n```")
+
+    def legacy():
+        return _legacy_docstring(_legacy_strip_fences(answer), 8)
+
+    def new():
+        return docstring(strip_fences(answer), 8)
+
+    assert legacy() == new()
+    results = {}
+    for name, function in (("former", legacy), ("normalize", new)):
+        seconds = min(timeit.repeat(function, number=iterations, repeat=3)) / iterations
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = (seconds, peak)
+        print(f"{name:>10} : {seconds * 1e6:.1f} us per answer, peak allocation {peak} bytes")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Microbenchmark of the answer normalization")
+    parser.add_argument("--bench", type=int, default=20000, help="Iterations of the benchmark (default 20000)")
+    args = parser.parse_args()
+    bench(args.bench)
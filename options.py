@@ -0,0 +1,111 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Options of the commentateur, grouped by subsystem. Each group has the defaults of the command line, so a caller
+# only builds the groups it changes: commentateur(model=ModelOptions(deadline=60), watch=WatchOptions(...)).
+from dataclasses import dataclass
+
+OUTPUTS = ("tree", "patch", "combined")
+
+
+@dataclass
+class ModelOptions:
+    """
+    Requests sent to the model.
+
+    :param compact_prompts: Compact the functions (comments, old docstrings, big literals...) before sending them
+    :param reuse_docstrings: Generate one docstring per class of structurally identical functions and adapt it
+    :param tiering_enabled: Route each function by complexity to a local template, the small or the large model
+    :param large_model: Model of the large tier (complex functions), gpt-3.5-turbo like the small tier by default.
+                        "gpt-4-0613" costs about 20 times more per token
+    :param cache_size: Number of model responses kept in memory (0 disables the cache)
+    :param model_concurrency: Functions of a file documented concurrently (model calls)
+    :param deadline: Maximum duration of a model call in seconds before it is retried
+    :param hedge: Fire a duplicate request when a call is slower than the 95th percentile of the recent calls
+    :param hedge_budget: Maximum fraction of the calls (and of their tokens) that can be hedged
+    """
+    compact_prompts: bool = True
+    reuse_docstrings: bool = True
+    tiering_enabled: bool = True
+    large_model: str = None
+    cache_size: int = 4096
+    model_concurrency: int = 8
+    deadline: float = 120.0
+    hedge: bool = True
+    hedge_budget: float = 0.05
+
+
+@dataclass
+class LocalOptions:
+    """
+    Local stages (parsing, formatting, validation) and files written.
+
+    :param processes: Worker processes running the local stages, 0 runs them in this process. In watchdog mode, as
+                      many files are documented concurrently.
+    :param output: "tree" writes a documented copy of every file, "patch" one unified diff per documented file
+                   (file.py.patch), "combined" one patch per dropped folder (Modified/folder.patch). In patch modes
+                   unchanged and non-source files are skipped and autopep8 is not applied
+    :param stream_threshold: Python files larger than this (bytes) are documented window by window with a bounded
+                             memory (see streaming.py), None to always load the whole file
+    :param stream_window: Size in bytes of the windows of top-level statements of the streamed files
+    """
+    processes: int = 0
+    output: str = "tree"
+    stream_threshold: int = 4 << 20
+    stream_window: int = 1 << 20
+
+    def __post_init__(self):
+        if self.output not in OUTPUTS:
+            raise ValueError(f"Unknown output mode {self.output}")
+
+
+@dataclass
+class LogOptions:
+    """
+    Events and metrics.
+
+    :param log_capacity: Number of recent events kept in memory (see commentateur.log.query)
+    :param log_file: Optional rotating log file receiving every event
+    :param log_level: Minimum level of the events printed on stdout ("debug", "info", "warning" or "error")
+    :param metrics_port: Serve the metrics in the Prometheus text format on http://127.0.0.1:port/metrics (see
+                         metrics.py), None for no endpoint
+    """
+    log_capacity: int = 1000
+    log_file: str = None
+    log_level: str = "info"
+    metrics_port: int = None
+
+
+@dataclass
+class WatchOptions:
+    """
+    Folders and queue of the watchdog mode.
+
+    :param path_to_watch: Waiting a new file
+    :param path_to_save: Retrieve your commented py file
+    :param path_to_copy: Make a copy of an original file
+    :param path_to_failed: Dropped files that could not be documented, moved there out of the push folder (drop them
+                           again to retry, the functions already documented are resumed from their checkpoint)
+    :param path_to_state: Internal state (content-addressed store of the snapshots and results, status of the queue),
+                          kept out of the folders users browse
+    :param deduplicate: Serve files already documented (same content, same pipeline version) from the results
+                        store, and document identical files of a drop once
+    :param max_in_flight: Maximum number of dropped files documented at the same time (0 : one per process), the
+                          others wait in the push folder
+    :param scheduling: Order of admission of the dropped files, "sjf" (smallest first) or "fair" (fair share between
+                       the subfolders of the push folder)
+    :param max_file_size: Dropped files larger than this (bytes) wait until nothing else is queued
+    :param max_queued: Maximum number of dropped files held in the queue, the next ones wait in the push folder
+    :param status_file: JSON file receiving the depth of the queue and its ETA (default status.json in the state
+                        folder)
+    """
+    path_to_watch: str = "./Push_code_here"
+    path_to_save: str = "./Modified"
+    path_to_copy: str = "./Original"
+    path_to_failed: str = "./Failed"
+    path_to_state: str = "./.commentateur_state"
+    deduplicate: bool = True
+    max_in_flight: int = 0
+    scheduling: str = "sjf"
+    max_file_size: int = None
+    max_queued: int = 10000
+    status_file: str = None
@@ -0,0 +1,58 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Patch output mode: instead of a full documented copy of every file, only a unified diff of the inserted
+# docstrings and headers is written, one per file or one combined patch per drop (apply with patch -p1 or git apply).
+import difflib
+import os
+import threading
+
+_append_lock = threading.Lock()
+
+
+def _lines(text):
+    lines = text.splitlines(True)
+    if lines and not lines[-1].endswith("\n"):
+        # Marqueur de diff pour une dernière ligne sans retour à la ligne
+        lines[-1] += "\n\\ No newline at end of file\n"
+    return lines
+
+
+def unified_patch(old, new, label):
+    """
+    Returns the unified diff between two versions of a file, "" if they are identical.
+
+    Args:
+        old (str): The original code.
+        new (str): The documented code.
+        label (str): Path of the file relative to the root of the patch (a/label, b/label).
+    """
+    if old == new:
+        return ""
+    return "".join(difflib.unified_diff(_lines(old), _lines(new), f"a/{label}", f"b/{label}"))
+
+
+def relabel(patch, label):
+    """Returns a single-file patch with its file header pointing to another path."""
+    lines = patch.split("\n", 2)
+    if len(lines) < 3 or not lines[0].startswith("--- ") or not lines[1].startswith("+++ "):
+        return patch
+    return f"--- a/{label}\n+++ b/{label}\n{lines[2]}"
+
+
+def write_relabeled(src_path, dest_path, label):
+    """Writes the patch src_path to dest_path for the file label."""
+    with open(src_path, "r") as f:
+        patch = f.read()
+    with open(dest_path, "w") as f:
+        f.write(relabel(patch, label))
+
+
+def append(patch_path, combined_path):
+    """Appends a single-file patch to a combined patch and removes it."""
+    with open(patch_path, "r") as f:
+        patch = f.read()
+    with _append_lock:
+        os.makedirs(os.path.dirname(combined_path) or ".", exist_ok=True)
+        with open(combined_path, "a") as f:
+            f.write(patch)
+    os.remove(patch_path)
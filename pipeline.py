@@ -0,0 +1,267 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Python language plugin (see languages.py) and local (CPU-bound) stages of the documentation, run in a process
+# pool on large trees:
+#   plan     : parse, extract the functions, fingerprint, tier and compact them, digest of the module
+#   finalize : one-pass splicing of the docstrings, autopep8, summary header, commenting of the invalid lines
+# Only lightweight descriptors cross the process boundary: the paths of the files, the prompts of the functions
+# and the generated docstrings. The model calls stay in the parent process (see commentateur.generate_for_jobs).
+import ast
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import autopep8
+
+import digest
+import normalize
+import tiering
+from checkpoint import Checkpoint
+from compaction import compact_python_source, count_tokens
+from fingerprint import function_fingerprint
+
+API_langage = {"en": "You are able to write doc-strings respecting PEP 7 and google style convention by adding them to the "
+               "python function provided as input. the response should not be in a comment block, "
+               "should only contain the function and the docstring without any other comments. "
+               "You then need to delete the first and last line of the response.",
+               "fr": "Vous êtes capable d’écrire des doc-string en respectant la PEP 7 et google style convention en les "
+               "ajoutant à la fonction python fournie en entrée. la réponse ne doit pas être dans un "
+               "bloc de commentaire, ne doit contenir que la fonction et le docstring sans aucun "
+               "autre commentaire. Vous devez ensuite supprimer la première et dernière ligne de la réponse."}
+
+# Prompt formats of the python langages (see commentateur.format_langage)
+PROMPTS = {
+    "docstring python": {
+        "langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
+        "prompt": "# Convert the above function respecting PEP 7 and PEP 257 convention:\n",
+        "role": "You must write the detailed python docstring following PEP 257 of the function below as a python comment starting with \"\"\" and ending with \"\"\"",
+        "stop": ["def"], "engine": "Turbo"},
+    "short docstring": {
+        "langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
+        "prompt": "# Convert the above function respecting PEP 7 and Google style convention:\n",
+        "role": "You must summary in 10 words the python docstring below", "stop": ["def"],
+        "engine": "Turbo"},
+    "add python": {
+        "langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
+        "prompt": "# Convert the above function respecting PEP 7 and google style convention:\n",
+        "role": API_langage['en'], "stop": ["def"], "engine": "Turbo"},
+    "python full code": {
+        "langue": "Python 3.7", "com1": "'''", "com2": "'''", "start": "\"\"\"",
+        "prompt": "# An elaborate, high quality docstring for the above c function:\n",
+        "role": "You are an expert in python programming, you must determine the usefulness of this program. your result must be a python comment",
+        "stop": ["\"\"\"", "#"], "engine": "code-davinci-002"},
+    "docstring google style python": {
+        "langue": "Python 3.7", "com1": "#", "com2": "\"\"\"", "start": "def ",
+        "prompt": "# Convert the above function respecting PEP 7 and Google style convention:\n",
+        "role": "You must write a python docstring following Google style python convention of the function below as a python comment starting with \"\"\" and ending with \"\"\"",
+        "stop": ["def"], "engine": "Turbo"}
+}
+
+
+def _commentateur():
+    # Import tardif : comment_py_file importe ce module
+    from comment_py_file import commentateur
+    return commentateur
+
+
+def plan_python_code(code, only_functions=None, compact_prompts=True, reuse_docstrings=True, tiering_enabled=True,
+                     with_digest=True):
+    """
+    Prepares the documentation of python code without calling the model.
+
+    Args:
+        code (str): The python code.
+        only_functions (set): If given, only the functions whose `def` line (index, 0 based) is in it are planned.
+        compact_prompts (bool): Compact the functions sent to the model (see compaction.py).
+        reuse_docstrings (bool): Compute the structural fingerprints of the functions (see fingerprint.py).
+        tiering_enabled (bool): Route the functions by complexity (see tiering.py), "small" tier otherwise.
+        with_digest (bool): Compute the digest of the module used by the summary header.
+
+    Returns:
+        dict: "jobs", one dict per function to document (name, line of its signature, indentation, checkpoint key,
+            fingerprint, identifiers, tier, prompt and its tokens or the local template), and "digest".
+    """
+    C = _commentateur()
+    # Même table de signatures (en cache) que le résumé du module
+    functions_names = digest.function_names(code)
+    jobs = []
+    for function_str, indent_level, line in C.extract_functions_with_lines(code):
+        try:
+            function_name = C.noms_fonctions_dans_code(function_str)
+        except SyntaxError:
+            # Fonction tronquée par une fonction imbriquée : elle ne peut pas être documentée seule
+            continue
+        if not function_name or function_name[0] not in functions_names:
+            continue
+        functions_names.remove(function_name[0])
+        if only_functions is not None and line not in only_functions:
+            continue
+
+        job = {"name": function_name[0], "line": line, "indent": C.get_indentation(function_str),
+               "insert": len(function_str.split('\n')) > 1, "key": Checkpoint.key(function_str),
+               "fingerprint": None, "identifiers": None, "prompt": None, "tokens": None, "template": None}
+        fingerprint = function_fingerprint(function_str) if reuse_docstrings else None
+        if fingerprint is not None:
+            job["fingerprint"], job["identifiers"] = fingerprint
+        job["tier"] = tiering.choose_tier(function_str) if tiering_enabled else "small"
+        if job["tier"] == "local":
+            job["template"] = tiering.template_docstring(function_str)
+        else:
+            prompt = compact_python_source(function_str) if compact_prompts else function_str
+            job["prompt"] = prompt
+            job["tokens"] = (count_tokens(function_str), count_tokens(prompt))
+        jobs.append(job)
+
+    module_digest = None
+    if with_digest:
+        try:
+            module_digest = digest.code_digest(code)
+        except SyntaxError:
+            pass
+    return {"jobs": jobs, "digest": module_digest}
+
+
+def positions(jobs):
+    """Returns the lightweight descriptors of the jobs needed to splice their docstrings: (line, indent, insert)."""
+    return [(job["line"], job["indent"], job["insert"]) for job in jobs]
+
+
+def format_docstring(doc_string, indentation):
+    """Cleans a docstring answered by the model and indents it for a function indented by `indentation`."""
+    # Chevrons, guillemets triples et indentation de la fonction d'origine (see normalize.py)
+    return normalize.docstring(doc_string, len(indentation) + 4)
+
+
+def splice_docstrings(code, job_positions, docstrings):
+    """
+    Inserts the docstrings after the signature line of their function, in one pass over the lines of the code.
+
+    Args:
+        code (str): The python code.
+        job_positions (list): (line, indent, insert) of every job (see positions).
+        docstrings (dict): {index of the job: docstring answered by the model}.
+
+    Returns:
+        str: The code with the docstrings.
+    """
+    inserts = {}
+    for index, doc_string in docstrings.items():
+        line, indent, insert = job_positions[index]
+        if insert:
+            inserts[line + 1] = format_docstring(doc_string, indent)
+    out = []
+    for number, line in enumerate(code.split('\n')):
+        if number in inserts:
+            out.append(inserts[number])
+        out.append(line)
+    return '\n'.join(out)
+
+
+def _is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def as_docstring(header):
+    """Returns the summary header as a module docstring: kept if it is a string literal, built from its lines if not."""
+    header = header.strip()
+    try:
+        body = ast.parse(header).body
+        if len(body) == 1 and _is_docstring(body[0]):
+            return header
+    except SyntaxError:
+        pass
+    text = "\n".join(line.strip().lstrip("#").strip() for line in header.split("\n"))
+    return '"""\n' + text.replace('"""', "'''") + '\n"""'
+
+
+# Comment line written above the summaries of --git-diff, only a summary under it is ever replaced
+GENERATED_HEADER = "# Summary generated by comment_py_file.py"
+
+
+def replace_module_docstring(code, header):
+    """
+    Writes the summary header in place of the summary generated by a previous run (the docstring of the module under
+    GENERATED_HEADER), so documenting a file again does not stack a second summary on top of the first. A docstring
+    written by hand is never replaced: the summary is then put above it (after the shebang line, if any).
+
+    Args:
+        code (str): The python code.
+        header (str): The summary of the module (see as_docstring).
+
+    Returns:
+        str: The code with its new summary.
+    """
+    header = GENERATED_HEADER + "\n" + as_docstring(header)
+    lines = code.split("\n")
+    try:
+        body = ast.parse(code).body
+    except SyntaxError:
+        body = []
+    if body and _is_docstring(body[0]) and hasattr(body[0], "end_lineno") and body[0].lineno >= 2 \
+            and lines[body[0].lineno - 2].strip() == GENERATED_HEADER:
+        return "\n".join(lines[:body[0].lineno - 2] + [header] + lines[body[0].end_lineno:])
+    top = 1 if lines and lines[0].startswith("#!") else 0
+    return "\n".join(lines[:top] + [header] + lines[top:])
+
+
+def insert_python_docstrings(code, job_positions, docstrings, header=None, reformat=True, replace_header=False):
+    """
+    Splices the docstrings in one pass, applies autopep8 (if reformat, it is skipped in patch mode so the patch only
+    holds the additions) and writes the summary header at the top of the code, in place of the summary of a previous
+    run if replace_header (see replace_module_docstring).
+    """
+    modified_code = splice_docstrings(code, job_positions, docstrings)
+    if reformat:
+        modified_code = autopep8.fix_code(modified_code)
+    if header is not None:
+        if replace_header:
+            modified_code = replace_module_docstring(modified_code, header)
+        else:
+            modified_code = header.strip() + "\n" + modified_code
+    return modified_code
+
+
+def validate_python(code):
+    """Comments the lines that do not compile (see commentateur.correct_py_file)."""
+    return _commentateur().correct_py_file("", code)
+
+
+def check_python(code):
+    """
+    Checks that the documented code still compiles, without changing it.
+
+    Raises:
+        ValueError: If the code does not compile.
+    """
+    try:
+        compile(code, "<documented>", "exec")
+    except SyntaxError as e:
+        raise ValueError(f"The documented code does not compile : {e}")
+    return code
+
+
+LANGUAGE = {"name": "python", "extract": plan_python_code, "insert": insert_python_docstrings,
+            "validate": validate_python, "check": check_python, "prompts": PROMPTS}
+
+
+class LocalStagePool:
+    def __init__(self, processes: int = 0):
+        """
+        Runs the local stages in worker processes.
+
+        :param processes: Number of worker processes, 0 runs the stages in the calling process
+        """
+        self.processes = processes
+        self._executor = None
+        if processes > 0:
+            # spawn : the parent already runs threads (model calls, daemon), forking them is not safe
+            self._executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+    def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in a worker process (fn must be a module level function) and returns its result."""
+        if self._executor is None:
+            return fn(*args, **kwargs)
+        return self._executor.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
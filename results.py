@@ -0,0 +1,80 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Store of the documented files, keyed by the hash of the dropped content and the version of the pipeline. A file
+# dropped again (vendored modules, copies of a whole project...) is served from the store at disk-copy speed
+# without any model call. The outputs are kept in a content-addressed SnapshotStore, the index maps each key to the
+# digest of its output.
+import hashlib
+import json
+import os
+import threading
+
+from snapshot import SnapshotStore
+
+# To increment when a change of the pipeline changes the documented files, older results are then ignored
+PIPELINE_VERSION = "1"
+
+
+class ResultStore:
+    def __init__(self, root, version: str = PIPELINE_VERSION):
+        """
+        Store of the documented files.
+
+        :param root: Folder of the store (the state folder of the watchdog): outputs in root/objects, shared with the
+                     snapshots of Original (see snapshot.py), index in root/results
+        :param version: Version of the pipeline, part of every key
+        """
+        self.version = version
+        # Les fichiers servis dans Modified sont des copies : ils restent modifiables sans toucher au stockage
+        self.objects = SnapshotStore(root)
+        self.index_path = os.path.join(root, "results", version)
+        self.stats = {"hits": 0, "stored": 0}
+        self._stats_lock = threading.Lock()
+
+    def key(self, content_digest, extension, options=None):
+        """
+        Returns the key of the result of a dropped file.
+
+        Args:
+            content_digest (str): sha256 of the dropped content (see snapshot.hash_file).
+            extension (str): Extension of the file, it selects the language plugin.
+            options (dict): Options of the run changing the output (compaction, tiering...).
+        """
+        payload = json.dumps([self.version, content_digest, extension.lower(), options or {}], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.index_path, key[:2], key)
+
+    def get(self, key, dest_path):
+        """
+        Writes the stored result of a key to dest_path.
+
+        Returns:
+            bool: False if there is no result for the key.
+        """
+        try:
+            with open(self._entry(key), "r") as f:
+                obj_path = self.objects.object_path(f.read().strip())
+        except OSError:
+            return False
+        if not os.path.exists(obj_path):
+            return False
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        self.objects._copy(obj_path, dest_path)
+        with self._stats_lock:
+            self.stats["hits"] += 1
+        return True
+
+    def put(self, key, output_path):
+        """Stores output_path as the result of a key (the index entry is published atomically)."""
+        digest = self.objects.store(output_path)
+        entry = self._entry(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(digest)
+        os.replace(tmp_path, entry)
+        with self._stats_lock:
+            self.stats["stored"] += 1
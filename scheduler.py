@@ -0,0 +1,191 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Admission control of the watch folder. The dropped files wait in a queue (they stay in the push folder, which is
+# the backpressure seen upstream) and at most max_in_flight of them are documented at a time, shortest first or in
+# fair share between the subfolders of the drop. Oversized files are deferred until the queue is otherwise empty.
+# The queue itself is bounded: past max_queued files, the new drops are left in the push folder until it drains.
+# The depth of the queue and the estimated time to drain it are published in a JSON status file.
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class _Job:
+    def __init__(self, key, result_key, size, share, order, deferred):
+        self.key = key
+        self.result_key = result_key
+        self.members = []
+        self.size = size
+        self.share = share
+        self.order = order
+        self.deferred = deferred
+        self.started = None
+
+    def __lt__(self, other):
+        return (self.size, self.order) < (other.size, other.order)
+
+
+class Scheduler:
+    def __init__(self, max_in_flight: int = 1, policy: str = "sjf", max_file_size: int = None,
+                 status_path: str = None, max_queued: int = 10000):
+        """
+        Queue of the dropped files.
+
+        :param max_in_flight: Maximum number of files documented at the same time
+        :param policy: "sjf" admits the smallest file first, "fair" shares the slots between the subfolders of the
+                       drop (smallest first in each of them)
+        :param max_file_size: Files larger than this (in bytes) are deferred until nothing else is queued, None for
+                              no limit
+        :param status_path: JSON status file rewritten at every change, None for no status file
+        :param max_queued: Maximum number of files waiting in the queue (see full)
+        """
+        if policy not in ("sjf", "fair"):
+            raise ValueError(f"Unknown scheduling policy {policy}")
+        self.max_in_flight = max(1, max_in_flight)
+        self.policy = policy
+        self.max_file_size = max_file_size
+        self.status_path = status_path
+        self.max_queued = max(1, max_queued)
+        self._queued = 0
+        self.stats = {"completed": 0, "failed": 0, "coalesced": 0}
+        self._pending = {}  # share : heap of jobs
+        self._by_key = {}  # key : pending job
+        self._in_flight = {}  # key : job
+        self._paths = set()
+        self._served = {}  # share : number of admissions, for the fair share
+        self._order = itertools.count()
+        # Secondes par octet documenté (moyenne glissante), pour l'ETA
+        self._seconds_per_byte = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, file_path):
+        with self._lock:
+            return file_path in self._paths
+
+    def full(self):
+        """Returns True when max_queued files wait in the queue: the next dropped files must not be added yet."""
+        with self._lock:
+            return self._queued >= self.max_queued
+
+    def add(self, file_path, mod_path, size, share="", result_key=None):
+        """
+        Queues a dropped file.
+
+        Args:
+            file_path (str): The dropped file.
+            mod_path (str): Where its documented version is written.
+            size (int): Size of the file in bytes.
+            share (str): Subfolder of the drop, for the fair share.
+            result_key (str): Key of its result (see results.py), files with the same key are documented once.
+
+        Returns:
+            bool: True if the file joined a queued file with the same content.
+        """
+        key = result_key or file_path
+        with self._lock:
+            self._paths.add(file_path)
+            self._queued += 1
+            job = self._by_key.get(key)
+            if job is not None:
+                job.members.append((file_path, mod_path))
+                self.stats["coalesced"] += 1
+                return True
+            deferred = self.max_file_size is not None and size > self.max_file_size
+            job = _Job(key, result_key, size, share if self.policy == "fair" else "", next(self._order), deferred)
+            job.members.append((file_path, mod_path))
+            self._by_key[key] = job
+            heapq.heappush(self._pending.setdefault(job.share, []), job)
+        self.write_status()
+        return False
+
+    def _candidates(self):
+        # Parts les moins servies en premier (fair share), puis le plus petit fichier
+        shares = [s for s, heap in self._pending.items() if heap]
+        in_flight = {}
+        for job in self._in_flight.values():
+            in_flight[job.share] = in_flight.get(job.share, 0) + 1
+        shares.sort(key=lambda s: (in_flight.get(s, 0), self._served.get(s, 0), self._pending[s][0]))
+        return shares
+
+    def admit(self):
+        """Returns the queued jobs to start now (their members are [(file_path, mod_path), ...])."""
+        admitted = []
+        with self._lock:
+            while len(self._in_flight) < self.max_in_flight:
+                job = self._next()
+                if job is None:
+                    break
+                job.started = time.time()
+                self._in_flight[job.key] = job
+                self._served[job.share] = self._served.get(job.share, 0) + 1
+                admitted.append(job)
+        if admitted:
+            self.write_status()
+        return admitted
+
+    def _next(self):
+        deferred_running = any(job.deferred for job in self._in_flight.values())
+        regular_pending = any(not job.deferred for job in self._by_key.values())
+        for share in self._candidates():
+            heap = self._pending[share]
+            skipped = []
+            job = None
+            while heap:
+                candidate = heapq.heappop(heap)
+                if candidate.key in self._in_flight or (candidate.deferred and (regular_pending or deferred_running)):
+                    # Même contenu en cours (il sera servi par le magasin de résultats) ou fichier trop gros différé
+                    skipped.append(candidate)
+                    continue
+                job = candidate
+                break
+            for candidate in skipped:
+                heapq.heappush(heap, candidate)
+            if job is not None:
+                del self._by_key[job.key]
+                self._queued -= len(job.members)
+                return job
+        return None
+
+    def done(self, job, success=True):
+        """Marks a started job as finished."""
+        with self._lock:
+            self._in_flight.pop(job.key, None)
+            for file_path, _ in job.members:
+                self._paths.discard(file_path)
+            self.stats["completed" if success else "failed"] += 1
+            if job.size > 0:
+                rate = (time.time() - job.started) / job.size
+                self._seconds_per_byte = rate if self._seconds_per_byte is None \
+                    else 0.8 * self._seconds_per_byte + 0.2 * rate
+        self.write_status()
+
+    def status(self):
+        """Returns the queue depth, the files in flight, the deferred files, the counters and the ETA in seconds."""
+        with self._lock:
+            pending = list(self._by_key.values())
+            in_flight = list(self._in_flight.values())
+            status = {"time": time.time(), "queued": sum(len(job.members) for job in pending),
+                      "queued_bytes": sum(job.size for job in pending),
+                      "deferred": sum(len(job.members) for job in pending if job.deferred),
+                      "in_flight": len(in_flight), "max_in_flight": self.max_in_flight, "max_queued": self.max_queued,
+                      "policy": self.policy}
+            status.update(self.stats)
+            eta = None
+            if self._seconds_per_byte is not None:
+                now = time.time()
+                remaining = sum(max(0.0, job.size * self._seconds_per_byte - (now - job.started)) for job in in_flight)
+                eta = (status["queued_bytes"] * self._seconds_per_byte + remaining) / self.max_in_flight
+            status["eta_seconds"] = eta
+        return status
+
+    def write_status(self):
+        if self.status_path is None:
+            return
+        tmp_path = f"{self.status_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.status(), f)
+        # Remplacement atomique : un lecteur voit toujours un fichier complet
+        os.replace(tmp_path, self.status_path)
@@ -0,0 +1,438 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Team-wide cache of the model responses, for the machines documenting overlapping code bases: the docstrings and
+# summaries generated by one node are reused by all. The entries are keyed like the in-memory cache of GPT_choice
+# (hash of the engine, the model, the langage and the prompt), the local LRU stays in front. Two backends:
+#   DirectoryCache : a folder on a shared filesystem, every entry is written to a temporary file then published
+#                    with an atomic os.replace (no lock: concurrent writers of a key publish equivalent answers)
+#   HttpCache      : a small HTTP cache service, GET/PUT /<version>/<key>, served by CacheServer below
+# Entries older than the TTL or written by another CACHE_VERSION are ignored.
+# The service and its clients share a secret (COMMENTATEUR_CACHE_SECRET): every request and every answer carries
+# an HMAC of its method, path, timestamp and body, so a host of the network without the secret can neither read nor
+# poison the entries that GPT_choice splices into the documented files. Requests older than MAX_CLOCK_SKEW or already
+# seen are refused, and an answer is signed with the timestamp of its request, so none of them can be replayed.
+#
+#   server : COMMENTATEUR_CACHE_SECRET=... python shared_cache.py [--host 0.0.0.0] [--port 8766] [--root folder]
+#   client : COMMENTATEUR_CACHE_SECRET=... python comment_py_file.py --shared-cache http://host:8766
+#            (or --shared-cache /mnt/team/cache)
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# To increment when a change of the prompts makes the shared answers obsolete
+CACHE_VERSION = "1"
+DEFAULT_PORT = 8766
+SECRET_ENV = "COMMENTATEUR_CACHE_SECRET"
+SIGNATURE_HEADER = "X-Cache-Signature"
+TIMESTAMP_HEADER = "X-Cache-Timestamp"
+# Maximum difference in seconds between the timestamp of a request and the clock of the service
+MAX_CLOCK_SKEW = 300
+# Limits of the service : size of an entry and number of entries kept (in memory or in its folder)
+MAX_ENTRY_BYTES = 1 << 20
+MAX_ENTRIES = 100000
+
+
+def sign(secret, method, path, body=b"", timestamp=""):
+    """
+    Returns the HMAC-SHA256 of a request or an answer of the cache service.
+
+    Args:
+        secret (str): Secret shared by the service and its clients.
+        method (str): "GET" or "PUT" for the requests, "ANSWER" for the answers.
+        path (str): Path of the entry (/<version>/<key>).
+        body (bytes): Body of the message.
+        timestamp (str): Time of the request (seconds since the epoch), also used for its answer.
+
+    Returns:
+        str: The hexadecimal signature.
+    """
+    message = (method.encode("utf-8") + b"\0" + path.encode("utf-8") + b"\0" + str(timestamp).encode("utf-8")
+               + b"\0" + body)
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+class SharedCache(ABC):
+    def __init__(self, ttl: float = None, version: str = CACHE_VERSION):
+        """
+        Base of the shared backends.
+
+        :param ttl: Maximum age of an entry in seconds, None for no expiry
+        :param version: Version of the cache, entries of other versions are ignored
+        """
+        self.ttl = ttl
+        self.version = version
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "published": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """Returns the shared answer of a key, None if it is unknown, expired or the backend is unreachable."""
+        entry = self._load(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        if self.ttl is not None and time.time() - entry.get("time", 0) > self.ttl:
+            self._count("expired")
+            return None
+        self._count("hits")
+        return entry.get("value")
+
+    def put(self, key, value):
+        """Publishes the answer of a key for the other nodes."""
+        if self._store(key, {"time": time.time(), "value": value}):
+            self._count("published")
+
+    @abstractmethod
+    def _load(self, key):
+        """Returns the entry of a key ({"time", "value"}), None if it is unknown or the backend failed."""
+
+    @abstractmethod
+    def _store(self, key, entry):
+        """Publishes the entry of a key, returns False if the backend failed."""
+
+
+class DirectoryCache(SharedCache):
+    def __init__(self, root, ttl: float = None, version: str = CACHE_VERSION):
+        """
+        Shared cache in a folder (NFS, SMB...).
+
+        :param root: Folder of the cache, entries in root/<version>/<key[:2]>/<key>.json
+        """
+        super().__init__(ttl, version)
+        self.root = root
+
+    def _entry(self, key):
+        return os.path.join(self.root, self.version, key[:2], key + ".json")
+
+    def _load(self, key):
+        try:
+            with open(self._entry(key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self._count("errors")
+            return None
+
+    def _store(self, key, entry):
+        path = self._entry(key)
+        # Nom temporaire unique par machine, processus et thread : la publication reste atomique
+        tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            return True
+        except OSError:
+            self._count("errors")
+            return False
+
+
+class HttpCache(SharedCache):
+    def __init__(self, url, ttl: float = None, version: str = CACHE_VERSION, timeout: float = 2.0,
+                 retry_after: float = 30.0, secret: str = None):
+        """
+        Client of a shared cache service.
+
+        :param url: Base URL of the service (http://host:port)
+        :param timeout: Timeout of a request in seconds
+        :param retry_after: After a network error the service is skipped for this many seconds, so an unreachable
+                            cache never slows the documentation down
+        :param secret: Secret shared with the service, the environment variable COMMENTATEUR_CACHE_SECRET by default
+        """
+        super().__init__(ttl, version)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.secret = secret if secret is not None else os.environ.get(SECRET_ENV)
+        if not self.secret:
+            raise ValueError(f"The shared cache service needs a secret, set {SECRET_ENV}")
+        self._down_until = 0.0
+
+    def _request(self, method, key, data=None):
+        if time.time() < self._down_until:
+            return None
+        path = f"/{self.version}/{key}"
+        timestamp = f"{time.time():.6f}"
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json", TIMESTAMP_HEADER: timestamp,
+                                                  SIGNATURE_HEADER: sign(self.secret, method, path, data or b"",
+                                                                         timestamp)})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                # Réponse d'un service qui ne connaît pas le secret, ou rejouée d'une autre requête : ignorée
+                if not hmac.compare_digest(response.headers.get(SIGNATURE_HEADER, "").encode("utf-8"),
+                                           sign(self.secret, "ANSWER", path, body, timestamp).encode("utf-8")):
+                    self._count("errors")
+                    return None
+                return body
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                self._count("errors")
+            return None
+        except (OSError, ValueError):
+            self._count("errors")
+            self._down_until = time.time() + self.retry_after
+            return None
+
+    def _load(self, key):
+        body = self._request("GET", key)
+        if body is None:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            self._count("errors")
+            return None
+
+    def _store(self, key, entry):
+        return self._request("PUT", key, json.dumps(entry).encode("utf-8")) is not None
+
+
+def open_cache(location, ttl=None, version=CACHE_VERSION, secret=None):
+    """
+    Returns the shared cache of a location.
+
+    Args:
+        location (str): http(s)://host:port for a cache service, a folder otherwise.
+        ttl (float): Maximum age of an entry in seconds, None for no expiry.
+        version (str): Version of the cache.
+        secret (str): Secret of the cache service, COMMENTATEUR_CACHE_SECRET by default.
+
+    Raises:
+        ValueError: If the location is a cache service and no secret is given.
+    """
+    if location.startswith(("http://", "https://")):
+        return HttpCache(location, ttl, version, secret=secret)
+    return DirectoryCache(location, ttl, version)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "commentateur-cache"
+
+    def _key(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 2 or not all(part.isalnum() for part in parts):
+            self.send_error(404)
+            return None
+        return tuple(parts)
+
+    def _authorized(self, body=b""):
+        """
+        Checks the signature and the timestamp of the request, answers 403 if it is not signed with the secret of
+        the service, too old or already seen (replayed).
+        """
+        timestamp = self.headers.get(TIMESTAMP_HEADER, "")
+        signature = self.headers.get(SIGNATURE_HEADER, "")
+        try:
+            fresh = abs(time.time() - float(timestamp)) <= self.server.max_clock_skew
+        except ValueError:
+            fresh = False
+        if fresh and hmac.compare_digest(signature.encode("utf-8"),
+                                         sign(self.server.secret, self.command, self.path, body,
+                                              timestamp).encode("utf-8")) \
+                and self.server.first_use(signature):
+            return True
+        self.send_error(403)
+        return False
+
+    def _answer_signature(self, body=b""):
+        return sign(self.server.secret, "ANSWER", self.path, body, self.headers.get(TIMESTAMP_HEADER, ""))
+
+    def do_GET(self):
+        key = self._key()
+        if key is None or not self._authorized():
+            return
+        entry = self.server.load(key)
+        if entry is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(entry)))
+        self.send_header(SIGNATURE_HEADER, self._answer_signature(entry))
+        self.end_headers()
+        self.wfile.write(entry)
+
+    def do_PUT(self):
+        key = self._key()
+        if key is None:
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.send_error(400)
+            return
+        if length < 0:
+            self.send_error(400)
+            return
+        if length > self.server.max_entry_bytes:
+            self.send_error(413)
+            return
+        entry = self.rfile.read(length)
+        if not self._authorized(entry):
+            return
+        try:
+            json.loads(entry)
+        except ValueError:
+            self.send_error(400)
+            return
+        self.server.store(key, entry)
+        self.send_response(204)
+        self.send_header(SIGNATURE_HEADER, self._answer_signature())
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, root=None, secret=None,
+                 max_entry_bytes: int = MAX_ENTRY_BYTES, max_entries: int = MAX_ENTRIES,
+                 max_clock_skew: float = MAX_CLOCK_SKEW):
+        """
+        Shared cache service. It also serves as the local stand-in of the service in the tests (port 0 picks a free
+        port, see server_address).
+
+        :param host: Interface to listen on
+        :param port: Port to listen on
+        :param root: Folder keeping the entries (atomic publishes as DirectoryCache), None keeps them in memory
+        :param secret: Secret of the requests (see sign), the environment variable COMMENTATEUR_CACHE_SECRET by default
+        :param max_entry_bytes: Larger entries are refused (413)
+        :param max_entries: Number of entries kept (in memory or in root), the least recently used ones are dropped
+                            beyond
+        :param max_clock_skew: Requests whose timestamp is further than this from the clock of the service (seconds)
+                               are refused
+        """
+        secret = secret if secret is not None else os.environ.get(SECRET_ENV)
+        if not secret:
+            raise ValueError(f"The shared cache service needs a secret, set {SECRET_ENV}")
+        super().__init__((host, port), _Handler)
+        self.root = root
+        self.secret = secret
+        self.max_entry_bytes = max_entry_bytes
+        self.max_entries = max_entries
+        self.max_clock_skew = max_clock_skew
+        # LRU des entrées : leur contenu en mémoire, None pour celles du dossier root
+        self._entries = OrderedDict()
+        # Signatures des requêtes encore dans la fenêtre de max_clock_skew, contre le rejeu
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        if root is not None:
+            self._index_root()
+
+    def _path(self, key):
+        version, name = key
+        return os.path.join(self.root, version, name[:2], name + ".json")
+
+    def _index_root(self):
+        # Entrées déjà dans le dossier, les plus anciennes d'abord
+        found = []
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    path = os.path.join(dir_path, file_name)
+                    version = os.path.basename(os.path.dirname(dir_path))
+                    found.append((os.path.getmtime(path), (version, file_name[:-len(".json")])))
+        for _, key in sorted(found):
+            self._entries[key] = None
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            if self.root is not None:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def first_use(self, signature):
+        """Returns False if a request with this signature was already served within the clock skew window."""
+        now = time.time()
+        with self._lock:
+            while self._seen and next(iter(self._seen.values())) < now - 2 * self.max_clock_skew:
+                self._seen.popitem(last=False)
+            if signature in self._seen:
+                return False
+            self._seen[signature] = now
+            return True
+
+    def load(self, key):
+        if self.root is None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                return entry
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry
+
+    def store(self, key, entry):
+        if self.root is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(entry)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._entries[key] = entry if self.root is None else None
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def start(self):
+        """Serves in a background thread (local stand-in), returns the base URL of the service."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Shared cache service of the commentateur model responses")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interface to listen on (default 127.0.0.1, 0.0.0.0 to serve the other machines)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--root", help="Folder keeping the entries (default : in memory)")
+    parser.add_argument("--max-entry-bytes", type=int, default=MAX_ENTRY_BYTES,
+                        help=f"Larger entries are refused (default {MAX_ENTRY_BYTES})")
+    parser.add_argument("--max-entries", type=int, default=MAX_ENTRIES,
+                        help=f"Entries kept, in memory or in --root (default {MAX_ENTRIES})")
+    args = parser.parse_args()
+
+    try:
+        server = CacheServer(args.host, args.port, args.root, max_entry_bytes=args.max_entry_bytes,
+                             max_entries=args.max_entries)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Shared cache listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
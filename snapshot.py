@@ -0,0 +1,172 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Content-addressed snapshot store used to keep a copy of every dropped file in the Original folder.
+# Each distinct content is stored once under <root>/objects (root is the state folder of the watchdog, never a
+# folder users browse) and the mirrored path is a writable reflink (or a copy
+# where reflinks are not supported) of that object: the snapshots in Original are ordinary files users can edit or
+# delete, and no hardlink ever ties a file of the user to a shared object.
+# Objects are private copies (reflink or plain copy) of the dropped files, never links to them: the dropped
+# file stays writable and a producer still writing it cannot change an object after it has been hashed.
+import hashlib
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl request number of FICLONE on Linux (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Computes the sha256 hexdigest of a file by reading it in chunks.
+
+    Args:
+        path (str): Path of the file to hash.
+        chunk_size (int): Size of the chunks read from the file.
+
+    Returns:
+        str: The sha256 hexdigest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src, dst):
+    """
+    Creates dst as a copy-on-write clone of src (FICLONE ioctl).
+
+    Args:
+        src (str): Source file.
+        dst (str): Destination file, must not exist.
+
+    Returns:
+        bool: True if the clone succeeded, False if the filesystem or the platform does not support it.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(src, "rb") as s, open(dst, "xb") as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return True
+            except OSError:
+                pass
+    except OSError:
+        return False
+    # Le clone a échoué, on supprime le fichier vide créé
+    os.remove(dst)
+    return False
+
+
+class SnapshotStore:
+    def __init__(self, root):
+        """
+        Content-addressed store of snapshots.
+
+        :param root: Folder of the store (the state folder of the watchdog), objects are stored in root/objects
+        """
+        self.root = root
+        self.objects_path = os.path.join(root, "objects")
+        os.makedirs(self.objects_path, exist_ok=True)
+        self.stats = {"reflinked": 0, "copied": 0, "deduplicated": 0}
+        self._stats_lock = threading.Lock()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def _count(self, name):
+        # Appelé depuis les threads du watchdog
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def _copy(src, dst):
+        """
+        Creates dst as a private copy of src: a reflink if the filesystem supports it, a plain copy otherwise.
+        Never a hardlink, dst must not share its inode with src.
+
+        Args:
+            src (str): Existing file.
+            dst (str): File to create, must not exist.
+
+        Returns:
+            str: The method used, "reflinked" or "copied".
+        """
+        if reflink(src, dst):
+            return "reflinked"
+        shutil.copyfile(src, dst)
+        return "copied"
+
+    def store(self, src_path, digest=None):
+        """
+        Adds the content of src_path to the store if it is not already present.
+        The object is a private copy of src_path, hashed again once copied: if the file changed in between
+        (still being written), the object is stored under the digest of what was actually copied.
+
+        Args:
+            src_path (str): File to store.
+            digest (str): sha256 of the file if already known.
+
+        Returns:
+            str: The digest identifying the stored content.
+        """
+        if digest is None:
+            digest = hash_file(src_path)
+        obj_path = self.object_path(digest)
+        if os.path.exists(obj_path):
+            self._count("deduplicated")
+            return digest
+
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        # Publication atomique : on copie dans un fichier temporaire puis on renomme
+        tmp_path = f"{obj_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        method = self._copy(src_path, tmp_path)
+        copied_digest = hash_file(tmp_path)
+        if copied_digest != digest:
+            # Le fichier a changé pendant la copie : l'objet est adressé par ce qui a réellement été copié
+            digest = copied_digest
+            obj_path = self.object_path(digest)
+            if os.path.exists(obj_path):
+                os.remove(tmp_path)
+                self._count("deduplicated")
+                return digest
+            os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        # Objects are shared by every snapshot of the same content, they must never be edited in place.
+        # tmp_path is a private copy, so this never touches the dropped file
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, obj_path)
+        self._count(method)
+        return digest
+
+    def snapshot(self, src_path, dest_path):
+        """
+        Snapshots src_path to dest_path: the content is stored once in the object store and dest_path is a
+        writable copy of the object (a reflink where the filesystem supports it, so it costs no disk space).
+
+        Args:
+            src_path (str): File to snapshot.
+            dest_path (str): Path of the snapshot in the Original folder.
+
+        Returns:
+            str: The digest of the snapshotted content.
+        """
+        digest = self.store(src_path)
+        obj_path = self.object_path(digest)
+
+        if os.path.lexists(dest_path):
+            if os.path.isfile(dest_path) and hash_file(dest_path) == digest:
+                return digest
+            os.remove(dest_path)
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        self._copy(obj_path, dest_path)
+        return digest
@@ -0,0 +1,132 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Bounded-memory documentation of very large python files (generated modules...). The file is read line by line
+# and cut into its top-level statements, where the code read since the previous cut compiles on its own; consecutive
+# statements are grouped in windows of about window_size bytes, and every window is planned, documented, formatted
+# and written to the output before the next one is read. Only one window, the signature table of the module and the
+# short docstrings are held in memory; the summary header, known at the end, is written in front of the body
+# spooled to a temporary file. See commentateur.document_file.
+import re
+
+import digest
+import pipeline
+
+# Clauses continuing a top-level compound statement at column 0 (if/else, try/except...)
+_CONTINUATION = re.compile(r"(else|elif|except|finally)\b")
+
+
+def _is_code(line):
+    stripped = line.lstrip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def _split(lines):
+    # (lignes avant la première ligne de code, instruction, lignes après la dernière), None sans ligne de code
+    first = next((i for i, line in enumerate(lines) if _is_code(line)), None)
+    if first is None:
+        return None
+    last = len(lines) - 1
+    while not _is_code(lines[last]):
+        last -= 1
+    return "".join(lines[:first]), "".join(lines[first:last + 1]), lines[last + 1:]
+
+
+def top_level_blocks(readline):
+    """
+    Splits python code into its top-level statements, reading it line by line.
+
+    A statement ends before a line starting at column 0 (other than a closing bracket, a comment or an else/except
+    clause) if the code read since the previous cut compiles on its own, so strings, brackets and decorators spanning
+    lines are never cut. After a failed check the next one waits for the pending code to double, so code which never
+    compiles (or columns of data at column 0) costs a linear number of compiled bytes; the statements are then only
+    grouped, never cut wrongly, and a file with a syntax error ends up in one block.
+
+    Args:
+        readline (callable): Returns the next line of the code, "" at the end (file.readline).
+
+    Yields:
+        tuple: (leading, statement), the blank and comment lines before a statement and the statement itself
+            (decorators and else/except clauses included). The last statement is followed by ("trailing lines", "").
+    """
+    lines = []  # lignes lues depuis la dernière découpe
+    size = 0
+    retry = 0  # taille à atteindre avant un nouvel essai après un échec
+    while True:
+        line = readline()
+        if line and lines and size >= retry and line[0] not in " \t\r\n\f#)]}" and not _CONTINUATION.match(line):
+            parts = _split(lines)
+            if parts is not None:
+                try:
+                    compile(parts[1], "<stream>", "exec", dont_inherit=True)
+                except (SyntaxError, ValueError):
+                    retry = 2 * size
+                else:
+                    yield parts[0], parts[1]
+                    lines = parts[2]
+                    size, retry = sum(map(len, lines)), 0
+        if not line:
+            break
+        lines.append(line)
+        size += len(line)
+    parts = _split(lines)
+    if parts is None:
+        yield "".join(lines), ""
+    else:
+        yield parts[0], parts[1]
+        yield "".join(parts[2]), ""
+
+
+def windows(readline, window_size=1 << 20):
+    """
+    Groups the top-level statements of python code in windows of about window_size bytes.
+
+    Yields:
+        tuple: (leading, code), the blank and comment lines before the first statement of the window (written
+            unchanged) and the code of the window, from its first statement to the end of its last one.
+    """
+    leading, parts, size = None, [], 0
+    for block_leading, statement in top_level_blocks(readline):
+        if leading is None:
+            leading = block_leading
+        else:
+            parts.append(block_leading)
+        parts.append(statement)
+        size += len(block_leading) + len(statement)
+        if size >= window_size:
+            yield leading, "".join(parts)
+            leading, parts, size = None, [], 0
+    if leading is not None:
+        yield leading, "".join(parts)
+
+
+def plan_window(code, **options):
+    """Plans a window (see pipeline.plan_python_code) and adds its signature table, None if it does not parse."""
+    plan = pipeline.plan_python_code(code, **dict(options, with_digest=False))
+    try:
+        # Table déjà construite (en cache) par plan_python_code
+        plan["table"] = digest.signature_table(code)
+    except SyntaxError:
+        plan["table"] = None
+    return plan
+
+
+def finalize_window(code, job_positions, docstrings):
+    """Splices the docstrings of a window, applies autopep8 and comments its lines that do not compile."""
+    return pipeline.validate_python(pipeline.insert_python_docstrings(code, job_positions, docstrings))
+
+
+class ModuleDigest:
+    def __init__(self):
+        """Signature table of a module built window by window (see digest.format_signature_table)."""
+        self.entries = []
+        self.imports = {}
+
+    def add(self, table):
+        if table is None:
+            return
+        self.entries += table["entries"]
+        for module in table["imports"]:
+            self.imports.setdefault(module, None)
+
+    def format(self):
+        return digest.format_signature_table({"entries": self.entries, "imports": list(self.imports)})
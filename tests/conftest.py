@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+# Les modules du dépôt sont au premier niveau, pas dans un paquet
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class FakeModel:
+    """Stand-in of openai.ChatCompletion: deterministic answers, no network, every request kept."""
+
+    def __init__(self):
+        self.requests = []
+        # Requests whose content contains one of these strings fail with an APIError
+        self.failing = set()
+        # Once offline, any request fails the test: the answers must come from elsewhere (cassette, shared cache...)
+        self.offline = False
+
+    def create(self, model, messages, **kwargs):
+        from openai.error import APIError
+        from openai.openai_object import OpenAIObject
+        assert not self.offline, "the model was called"
+        role, content = messages[0]["content"], messages[1]["content"]
+        self.requests.append({"model": model, "role": role, "content": content})
+        if any(marker in content for marker in self.failing):
+            raise APIError("model unavailable")
+        if "summary in 10 words" in role:
+            answer = "Short summary."
+        elif "usefulness of this program" in role:
+            answer = "Module summary."
+        elif "C function" in role or "C comment" in role:
+            answer = "/* Documented C function. */"
+        else:
+            answer = '"""Documented function."""'
+        return OpenAIObject.construct_from({"choices": [{"message": {"role": "assistant", "content": answer}}],
+                                            "usage": {"prompt_tokens": 10, "completion_tokens": 5,
+                                                      "total_tokens": 15}})
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    import openai
+    model = FakeModel()
+    monkeypatch.setattr(openai.ChatCompletion, "create", model.create)
+    return model
+
+
+@pytest.fixture
+def make_comment():
+    """
+    Builds commentateurs documenting files on demand, as separate runs would (no memory cache between them): every
+    function goes to the (fake) model, hedging off and one call at a time so the runs are deterministic.
+    """
+    from comment_py_file import commentateur
+    from options import LogOptions, ModelOptions
+    instances = []
+
+    def make(**options):
+        instance = commentateur(model=ModelOptions(tiering_enabled=False, hedge=False, model_concurrency=1),
+                                logs=LogOptions(log_level="error"), **options)
+        instances.append(instance)
+        return instance
+    yield make
+    for instance in instances:
+        instance.local_stages.shutdown()
+
+
+@pytest.fixture
+def comment(make_comment):
+    return make_comment()
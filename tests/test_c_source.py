@@ -0,0 +1,83 @@
+import pytest
+
+import c_source
+from pipeline import positions
+
+CODE = r'''#include <stdio.h>
+#define SQUARE(x) \
+    ((x) * (x))
+
+/* int commented(void) { return 0; } */
+static const char *text = "int quoted(void) { return 1; }";
+struct point { int x, y; };
+int table[] = {1, 2, 3};
+
+static int
+add(int a,
+    int b)
+{
+    return a + b;
+}
+
+int old_style(a, b)
+    int a;
+    char *b;
+{
+    if (a) { return '{'; }
+    return 0;
+}
+
+void (*handler(int sig))(int)
+{
+    return 0;
+}
+
+extern "C" {
+int inside(void) { return 2; }
+}
+'''
+
+
+def _line(code, text):
+    return next(i for i, line in enumerate(code.split("\n")) if line.startswith(text))
+
+
+def test_tokens_skip_comments_strings_and_preprocessor():
+    kinds = {text: kind for kind, text, _, _ in c_source.tokenize_c(CODE)}
+    assert kinds["#define SQUARE(x) \\\n    ((x) * (x))"] == "pp"
+    assert kinds["/* int commented(void) { return 0; } */"] == "comment"
+    assert kinds['"int quoted(void) { return 1; }"'] == "string"
+    assert kinds["'{'"] == "string"
+
+
+def test_function_definitions():
+    functions = c_source.extract_c_functions(CODE)
+    assert [function["name"] for function in functions] == ["add", "old_style", "handler", "inside"]
+    by_name = {function["name"]: function for function in functions}
+    # Signature sur plusieurs lignes : le bloc commence au type de retour
+    assert by_name["add"]["line"] == _line(CODE, "static int")
+    assert by_name["add"]["source"].endswith("return a + b;\n}")
+    # Déclarations K&R entre les paramètres et le corps, accolade dans un caractère
+    assert "char *b;" in by_name["old_style"]["source"]
+    assert by_name["old_style"]["source"].endswith("return 0;\n}")
+    assert by_name["inside"]["line"] == _line(CODE, "int inside")
+
+
+def test_truncated_body_stops_the_extraction():
+    assert c_source.extract_c_functions("int f(void) {\n    return 0;\n") == []
+
+
+def test_comments_are_placed_before_the_signature():
+    plan = c_source.plan_c_code(CODE)
+    comments = {index: "Documented." for index in range(len(plan["jobs"]))}
+    documented = c_source.insert_c_comments(CODE, positions(plan["jobs"]), comments)
+    lines = documented.split("\n")
+    start = _line(documented, "static int")
+    assert lines[start - 3:start] == ["/**", " * Documented.", " */"]
+    assert c_source.validate_c(documented) == documented
+    assert c_source.extract_c_functions(documented)[0]["name"] == "add"
+
+
+def test_unterminated_comment_is_rejected():
+    with pytest.raises(ValueError):
+        c_source.validate_c("/* never closed\nint f(void) { return 0; }\n")
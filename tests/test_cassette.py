@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from cassette import Cassette, CassetteMiss
+
+SOURCE = '''import math
+
+
+def area(radius):
+    return math.pi * radius ** 2
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def increment(self, step=1):
+        self.count += step
+        return self.count
+'''
+
+
+def test_full_run_replays_offline(tmp_path, fake_model, make_comment):
+    source = tmp_path / "shapes.py"
+    source.write_text(SOURCE)
+    path = str(tmp_path / "run.cassette")
+
+    recorded = str(tmp_path / "recorded.py")
+    cassette = Cassette(path, "record")
+    assert make_comment(cassette=cassette).document_python_code(str(source), recorded)
+    cassette.close()
+    calls = len(fake_model.requests)
+    assert calls > 0
+
+    # Rejeu : aucun appel au modèle, le fichier produit est identique
+    fake_model.offline = True
+    replayed = str(tmp_path / "replayed.py")
+    cassette = Cassette(path, "replay")
+    assert len(cassette) == calls
+    assert make_comment(cassette=cassette).document_python_code(str(source), replayed)
+    assert cassette.hits == calls
+    with open(recorded) as first, open(replayed) as second:
+        assert first.read() == second.read()
+
+
+def test_unknown_request_is_a_miss(tmp_path):
+    path = str(tmp_path / "empty.cassette")
+    Cassette(path, "record").close()
+    with pytest.raises(CassetteMiss):
+        Cassette(path, "replay").play("unknown")
+
+
+def test_torn_last_line_is_overwritten(tmp_path):
+    path = tmp_path / "torn.cassette"
+    cassette = Cassette(str(path), "record")
+    cassette.record("k1", {"content": "a"}, "first", 0.5)
+    cassette.close()
+    with open(path, "a") as file:
+        file.write('{"key": "k2", "resp')
+    # Un nouvel enregistrement remplace la ligne tronquée par le crash
+    cassette = Cassette(str(path), "record")
+    assert len(cassette) == 1
+    cassette.record("k2", {"content": "b"}, "second", 0.1)
+    cassette.record("k1", {"content": "a"}, "ignored", 0.1)
+    cassette.close()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(line["key"], line["response"]) for line in lines] == [("k1", "first"), ("k2", "second")]
+    replay = Cassette(str(path), "replay")
+    assert replay.play("k2") == "second"
@@ -0,0 +1,75 @@
+import ast
+import json
+
+from checkpoint import Checkpoint
+
+SOURCE = '''def alpha(a):
+    return a + 1
+
+
+def beta(b):
+    return b * 2
+
+
+def gamma(c):
+    return c - 3
+'''
+
+
+def _docstrings(path):
+    with open(path) as file:
+        tree = ast.parse(file.read())
+    return {node.name: ast.get_docstring(node) for node in tree.body if isinstance(node, ast.FunctionDef)}
+
+
+def test_journal_survives_a_truncated_line(tmp_path):
+    path = str(tmp_path / ".module.py.checkpoint")
+    checkpoint = Checkpoint(path)
+    checkpoint.record("k1", "alpha", '"""Alpha."""', "Alpha.")
+    checkpoint.record("k2", "beta", error="APIError: model unavailable")
+    with open(path, "a") as file:
+        file.write('{"key": "k3", "name": "gam')
+    reloaded = Checkpoint(path)
+    assert len(reloaded) == 2
+    assert reloaded.get("k1")["doc_string"] == '"""Alpha."""'
+    # Une fonction en échec est recalculée
+    assert reloaded.get("k2") is None
+    assert [record["name"] for record in reloaded.failures()] == ["beta"]
+    reloaded.remove()
+    assert not (tmp_path / ".module.py.checkpoint").exists()
+
+
+def test_matches_the_recorded_files(tmp_path):
+    source = tmp_path / "module.py"
+    source.write_text(SOURCE)
+    checkpoint = Checkpoint(Checkpoint.path_for(str(source)))
+    assert checkpoint.path == str(tmp_path / ".module.py.checkpoint")
+    checkpoint.record_file(str(source))
+    assert Checkpoint(checkpoint.path).matches(str(source))
+    source.write_text(SOURCE + "\n# edited\n")
+    assert not Checkpoint(checkpoint.path).matches(str(source))
+
+
+def test_resume_only_asks_for_the_failed_functions(tmp_path, fake_model, make_comment):
+    source = tmp_path / "module.py"
+    source.write_text(SOURCE)
+    dest = str(tmp_path / "documented.py")
+    checkpoint_path = Checkpoint.path_for(dest)
+
+    fake_model.failing = {"def beta"}
+    assert make_comment().document_python_code(str(source), dest) is False
+    # Le fichier est écrit sans la fonction en échec, le checkpoint est gardé pour la reprise
+    assert _docstrings(dest) == {"alpha": "Documented function.", "beta": None, "gamma": "Documented function."}
+    with open(checkpoint_path) as file:
+        records = [json.loads(line) for line in file]
+    assert {record["name"]: record["status"] for record in records if "key" in record} == \
+        {"alpha": "ok", "beta": "failed", "gamma": "ok"}
+
+    # Nouveau lancement, sans le cache mémoire du premier : seule beta est redemandée au modèle
+    fake_model.failing = set()
+    fake_model.requests = []
+    assert make_comment().document_python_code(str(source), dest) is True
+    asked = [request["content"] for request in fake_model.requests if "def " in request["content"]]
+    assert asked and all("def beta" in content and "def alpha" not in content for content in asked)
+    assert _docstrings(dest) == {name: "Documented function." for name in ("alpha", "beta", "gamma")}
+    assert not (tmp_path / ".documented.py.checkpoint").exists()
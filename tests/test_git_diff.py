@@ -0,0 +1,146 @@
+import ast
+import os
+import subprocess
+
+import pytest
+
+import git_diff
+import pipeline
+
+BEFORE = '''import os
+
+
+def untouched(a):
+    return a
+
+
+def changed(a, b):
+    return a + b
+
+
+class Box:
+    def method(self):
+        return 1
+
+    def documented(self):
+        """Already documented."""
+        return 2
+'''
+
+AFTER = '''import os
+
+
+def untouched(a):
+    return a
+
+
+def changed(a, b):
+    total = a + b
+    return total
+
+
+class Box:
+    def method(self):
+        return 2
+
+    def documented(self):
+        """Already documented."""
+        return 3
+
+
+def added(x):
+    return x
+'''
+
+
+def _git(repo, *args):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=repo,
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    _git(tmp_path, "init", "-q")
+    (tmp_path / "module.py").write_text(BEFORE)
+    _git(tmp_path, "add", "module.py")
+    _git(tmp_path, "commit", "-q", "-m", "before")
+    (tmp_path / "module.py").write_text(AFTER)
+    _git(tmp_path, "commit", "-q", "-am", "after")
+    return str(tmp_path)
+
+
+def _def_line(code, name):
+    return next(i for i, line in enumerate(code.split("\n")) if line.lstrip().startswith(f"def {name}("))
+
+
+def test_changed_lines_of_a_range(repo):
+    changes = git_diff.changed_lines("HEAD~1..HEAD", repo)
+    assert list(changes) == ["module.py"]
+    # Lignes (0 based) du fichier à HEAD
+    assert _def_line(AFTER, "added") in changes["module.py"]
+
+
+def test_hunks_map_to_the_undocumented_changed_functions(repo):
+    lines = git_diff.changed_lines("HEAD~1..HEAD", repo)["module.py"]
+    targets = git_diff.changed_functions(AFTER, lines)
+    assert targets == {_def_line(AFTER, name) for name in ("changed", "method", "added")}
+
+
+def test_plan_keeps_only_the_targeted_functions(repo):
+    lines = git_diff.changed_lines("HEAD~1..HEAD", repo)["module.py"]
+    plan = pipeline.plan_python_code(AFTER, only_functions=git_diff.changed_functions(AFTER, lines),
+                                     with_digest=False)
+    assert sorted(job["name"] for job in plan["jobs"]) == ["added", "changed", "method"]
+
+
+def test_signatures_changed():
+    assert git_diff.signatures_changed(AFTER, BEFORE)
+    assert not git_diff.signatures_changed(AFTER.replace("return 3", "return 4"), AFTER)
+
+
+def test_target_revision():
+    assert git_diff.target_revision("main..topic") == "topic"
+    assert git_diff.target_revision("main...") == "HEAD"
+    assert git_diff.target_revision("main") is None
+
+
+def test_state_directory_is_inside_the_git_directory(repo):
+    assert git_diff.state_directory(repo) == os.path.join(repo, ".git", "commentateur")
+
+
+def test_git_diff_mode_only_adds_docstrings(repo, fake_model, comment):
+    path = os.path.join(repo, "module.py")
+    code = AFTER.replace("return 2\n", "return  2   # kept as written\n")
+    with open(path, "w") as file:
+        file.write(code)
+    _git(repo, "commit", "-q", "-am", "formatting")
+    comment.git_diff_usage("HEAD~2..HEAD", repo)
+    with open(path) as file:
+        documented = file.read()
+    # Docstrings ajoutés aux seules fonctions modifiées non documentées
+    docstrings = {node.name: ast.get_docstring(node) for node in ast.walk(ast.parse(documented))
+                  if isinstance(node, ast.FunctionDef)}
+    assert docstrings["changed"] == docstrings["method"] == docstrings["added"] == "Documented function."
+    assert docstrings["untouched"] is None and docstrings["documented"] == "Already documented."
+    assert documented.startswith(pipeline.GENERATED_HEADER + '\n"""\nModule summary.\n"""\n')
+    # Le reste du fichier est inchangé, ligne à ligne (pas d'autopep8)
+    remaining = iter(documented.split("\n"))
+    assert all(any(line == other for other in remaining) for line in code.split("\n"))
+    # Aucun checkpoint ni fichier d'usage dans l'arbre de travail
+    assert sorted(os.listdir(repo)) == [".git", "module.py"]
+
+
+def test_generated_header_replaces_only_its_own_summary():
+    code = '"""Written by hand."""\nimport os\n'
+    once = pipeline.replace_module_docstring(code, "First summary")
+    assert once.startswith(pipeline.GENERATED_HEADER + "\n")
+    assert '"""Written by hand."""' in once
+    twice = pipeline.replace_module_docstring(once, "Second summary")
+    assert "First summary" not in twice and "Second summary" in twice
+    assert twice.count(pipeline.GENERATED_HEADER) == 1
+    assert '"""Written by hand."""' in twice
+
+
+def test_shebang_stays_first():
+    documented = pipeline.replace_module_docstring("#!/usr/bin/env python\nimport os\n", "Summary")
+    assert documented.startswith("#!/usr/bin/env python\n" + pipeline.GENERATED_HEADER)
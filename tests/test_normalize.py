@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+import normalize
+
+PIECES = ['"""', "'''", '"', "```", "```python", ">>>", ">>", ">", "\n", "\r\n", "\r", "\x0b", "\u2028", " ", "\t",
+          "a", "\u00e9", "\u2028", "\x85", "Args:", "Returns:", "    x (int): value.", "def f():"]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_same_as_former_cleanup_on_random_answers(seed):
+    rng = random.Random(seed)
+    for _ in range(2500):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 30)))
+        indentation = rng.choice((4, 8, 12))
+        try:
+            expected = normalize._legacy_strip_fences(text)
+        except IndexError:
+            # Ancien comportement : une réponse d'une seule ligne de clôture levait IndexError
+            expected = None
+        if expected is not None:
+            assert normalize.strip_fences(text) == expected, text
+        assert normalize.docstring(text, indentation) == normalize._legacy_docstring(text, indentation), text
+
+
+def test_strip_fences():
+    assert normalize.strip_fences('```python\n"""Doc."""\n```') == '"""Doc."""'
+    assert normalize.strip_fences('"""Doc."""') == '"""Doc."""'
+
+
+def test_docstring_indents_and_drops_doctest_markers():
+    text = normalize.docstring('"""Mean.\n\n>>> mean(1, 2)\n1.5\n"""', 8)
+    assert ">>>" not in text
+    assert all(line.startswith(" " * 8) for line in text.split("\n") if line.strip())
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from scheduler import Scheduler
+
+
+def _names(jobs):
+    return [file_path for job in jobs for file_path, _ in job.members]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Scheduler(policy="lifo")
+
+
+def test_shortest_first_and_max_in_flight():
+    scheduler = Scheduler(max_in_flight=2)
+    for name, size in (("big", 300), ("small", 10), ("medium", 100)):
+        scheduler.add(name, f"out/{name}", size)
+    first = scheduler.admit()
+    assert _names(first) == ["small", "medium"]
+    # Les deux créneaux sont pris
+    assert scheduler.admit() == []
+    scheduler.done(first[0])
+    assert _names(scheduler.admit()) == ["big"]
+    assert "small" not in scheduler and "big" in scheduler
+
+
+def test_fair_share_between_subfolders():
+    scheduler = Scheduler(policy="fair")
+    for index in range(3):
+        scheduler.add(f"a/{index}", f"out/a/{index}", 1, share="a")
+    scheduler.add("b/0", "out/b/0", 100, share="b")
+    order = []
+    while True:
+        jobs = scheduler.admit()
+        if not jobs:
+            break
+        order += _names(jobs)
+        scheduler.done(jobs[0])
+    # Le gros fichier de b passe avant les petits de a, qui ont déjà été servis
+    assert order == ["a/0", "b/0", "a/1", "a/2"]
+
+
+def test_same_content_is_coalesced():
+    scheduler = Scheduler()
+    assert not scheduler.add("one.py", "out/one.py", 10, result_key="k")
+    assert scheduler.add("two.py", "out/two.py", 10, result_key="k")
+    jobs = scheduler.admit()
+    assert len(jobs) == 1 and _names(jobs) == ["one.py", "two.py"]
+    assert scheduler.stats["coalesced"] == 1
+    scheduler.done(jobs[0])
+    assert "one.py" not in scheduler and "two.py" not in scheduler
+
+
+def test_oversized_files_are_deferred_one_at_a_time():
+    scheduler = Scheduler(max_in_flight=3, max_file_size=100)
+    scheduler.add("huge.py", "out/huge.py", 1000)
+    scheduler.add("larger.py", "out/larger.py", 2000)
+    scheduler.add("small.py", "out/small.py", 10)
+    assert scheduler.status()["deferred"] == 2
+    # Les fichiers trop gros passent après les autres, un seul à la fois
+    jobs = scheduler.admit()
+    assert _names(jobs) == ["small.py", "huge.py"]
+    assert scheduler.admit() == []
+    scheduler.done(jobs[1])
+    assert _names(scheduler.admit()) == ["larger.py"]
+
+
+def test_queue_is_bounded():
+    scheduler = Scheduler(max_queued=2)
+    scheduler.add("one.py", "out/one.py", 1)
+    assert not scheduler.full()
+    scheduler.add("two.py", "out/two.py", 1)
+    assert scheduler.full()
+    scheduler.admit()
+    assert not scheduler.full()
+
+
+def test_status_file(tmp_path):
+    path = tmp_path / "status.json"
+    scheduler = Scheduler(status_path=str(path), max_queued=5)
+    scheduler.add("one.py", "out/one.py", 10)
+    scheduler.add("two.py", "out/two.py", 20)
+    status = json.loads(path.read_text())
+    assert status["queued"] == 2 and status["queued_bytes"] == 30 and status["max_queued"] == 5
+    assert status["eta_seconds"] is None
+    job = scheduler.admit()[0]
+    scheduler.done(job, success=False)
+    status = json.loads(path.read_text())
+    assert status["queued"] == 1 and status["in_flight"] == 0 and status["failed"] == 1
+    # Une fois un fichier documenté, l'ETA est estimée à partir de son débit
+    assert status["eta_seconds"] is not None
+    assert list(tmp_path.iterdir()) == [path]
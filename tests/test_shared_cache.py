@@ -0,0 +1,108 @@
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import shared_cache
+from shared_cache import CacheServer, DirectoryCache, HttpCache, SharedCache
+
+SECRET = "test secret"
+
+SOURCE = '''def double(value):
+    return value * 2
+'''
+
+
+@pytest.fixture
+def server():
+    service = CacheServer(port=0, secret=SECRET)
+    url = service.start()
+    yield service, url
+    service.shutdown()
+    service.server_close()
+
+
+def _signed_get(url, key, timestamp):
+    path = f"/{shared_cache.CACHE_VERSION}/{key}"
+    request = urllib.request.Request(url + path, headers={
+        shared_cache.TIMESTAMP_HEADER: timestamp,
+        shared_cache.SIGNATURE_HEADER: shared_cache.sign(SECRET, "GET", path, b"", timestamp)})
+    try:
+        with urllib.request.urlopen(request, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_backends_are_abstract():
+    with pytest.raises(TypeError):
+        SharedCache()
+
+
+def test_round_trip_through_the_service(server):
+    _, url = server
+    writer, reader = HttpCache(url, secret=SECRET), HttpCache(url, secret=SECRET)
+    assert reader.get("abc123") is None
+    writer.put("abc123", "shared answer")
+    assert reader.get("abc123") == "shared answer"
+    assert writer.stats["published"] == 1 and reader.stats == {"hits": 1, "misses": 1, "expired": 0,
+                                                                "published": 0, "errors": 0}
+
+
+def test_wrong_secret_is_refused(server):
+    _, url = server
+    HttpCache(url, secret=SECRET).put("abc123", "shared answer")
+    intruder = HttpCache(url, secret="other secret")
+    assert intruder.get("abc123") is None
+    assert intruder.stats["errors"] == 1
+
+
+def test_replayed_and_stale_requests_are_refused(server):
+    _, url = server
+    HttpCache(url, secret=SECRET).put("abc123", "shared answer")
+    timestamp = f"{time.time():.6f}"
+    assert _signed_get(url, "abc123", timestamp) == 200
+    assert _signed_get(url, "abc123", timestamp) == 403
+    assert _signed_get(url, "abc123", f"{time.time() - 2 * shared_cache.MAX_CLOCK_SKEW:.6f}") == 403
+
+
+def test_disk_store_is_bounded(tmp_path):
+    root = str(tmp_path / "store")
+    service = CacheServer(port=0, root=root, secret=SECRET, max_entries=2)
+    url = service.start()
+    try:
+        client = HttpCache(url, secret=SECRET)
+        for key in ("aa1", "bb2", "cc3"):
+            client.put(key, key)
+        assert client.get("aa1") is None and client.get("cc3") == "cc3"
+        assert sum(len(files) for _, _, files in os.walk(root)) == 2
+    finally:
+        service.shutdown()
+        service.server_close()
+    # Au redémarrage, les entrées du dossier sont reprises et toujours bornées
+    restarted = CacheServer(port=0, root=root, secret=SECRET, max_entries=1)
+    restarted.server_close()
+    assert sum(len(files) for _, _, files in os.walk(root)) == 1
+
+
+def test_directory_cache_expiry(tmp_path):
+    cache = DirectoryCache(str(tmp_path), ttl=60)
+    cache.put("abc123", "answer")
+    assert cache.get("abc123") == "answer"
+    cache.ttl = -1
+    assert cache.get("abc123") is None and cache.stats["expired"] == 1
+
+
+def test_second_node_documents_from_the_shared_cache(tmp_path, server, fake_model, make_comment):
+    _, url = server
+    source = tmp_path / "double.py"
+    source.write_text(SOURCE)
+    first, second = str(tmp_path / "first.py"), str(tmp_path / "second.py")
+    assert make_comment(shared_cache=HttpCache(url, secret=SECRET)).document_python_code(str(source), first)
+    # Une autre machine documente le même fichier sans appeler le modèle
+    fake_model.offline = True
+    assert make_comment(shared_cache=HttpCache(url, secret=SECRET)).document_python_code(str(source), second)
+    with open(first) as a, open(second) as b:
+        assert a.read() == b.read()
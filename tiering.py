@@ -0,0 +1,180 @@
+# Copyright CEA France
+# PHELIQS / NPSC
+# Complexity-based routing of the docstring requests. Each function is scored from its AST (size, branches,
+# parameters, calls): trivial functions get a docstring built locally from their signature, simple ones go to the
+# small tier and complex ones to the large tier, each tier with its own concurrency limit. Both tiers use
+# gpt-3.5-turbo by default, so the tiers of the model only differ by their concurrency limits until a bigger model
+# is configured for the large tier (gpt-4, about 20 times the cost per token, opt-in).
+import ast
+import textwrap
+import threading
+
+# model None : the docstring is built locally by template_docstring
+TIERS = {"local": {"model": None, "max_concurrency": None},
+         "small": {"model": "gpt-3.5-turbo-0613", "max_concurrency": 8},
+         "large": {"model": "gpt-3.5-turbo-0613", "max_concurrency": 4}}
+
+# Concurrency limit of the models that can be chosen for the large tier (see TierLimiter), TIERS["large"] otherwise
+LARGE_MODEL_CONCURRENCY = {"gpt-4-0613": 2}
+
+# Upper bounds of the score of each tier
+LOCAL_MAX_SCORE = 4
+SMALL_MAX_SCORE = 40
+
+_BRANCHES = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.Try, ast.With, ast.AsyncWith, ast.IfExp, ast.BoolOp,
+             ast.comprehension, ast.ExceptHandler)
+
+
+def _parse_function(function_str):
+    try:
+        tree = ast.parse(textwrap.dedent(function_str))
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return None
+    return tree.body[0]
+
+
+def complexity(function_str):
+    """
+    Measures the complexity of a function.
+
+    Args:
+        function_str (str): Source of the function.
+
+    Returns:
+        dict: lines (non blank), branches, params, calls and the resulting score, or None if the function
+            cannot be parsed.
+    """
+    function = _parse_function(function_str)
+    if function is None:
+        return None
+    args = function.args
+    metrics = {"lines": sum(1 for line in function_str.split("\n") if line.strip()),
+               "branches": 0, "calls": 0,
+               "params": len(args.posonlyargs if hasattr(args, "posonlyargs") else []) + len(args.args)
+               + len(args.kwonlyargs) + (args.vararg is not None) + (args.kwarg is not None)}
+    for node in ast.walk(function):
+        if isinstance(node, _BRANCHES):
+            metrics["branches"] += 1
+        elif isinstance(node, ast.Call):
+            metrics["calls"] += 1
+    metrics["score"] = metrics["lines"] + 3 * metrics["branches"] + metrics["params"] + metrics["calls"]
+    return metrics
+
+
+def choose_tier(function_str):
+    """
+    Chooses the tier of a function: "local" for trivial functions without branches, "small" or "large".
+    A function that cannot be parsed goes to the large model.
+    """
+    metrics = complexity(function_str)
+    if metrics is None:
+        return "large"
+    if metrics["score"] <= LOCAL_MAX_SCORE and metrics["branches"] == 0 and metrics["lines"] <= 3:
+        return "local"
+    if metrics["score"] <= SMALL_MAX_SCORE:
+        return "small"
+    return "large"
+
+
+def _words(name):
+    return " ".join(w for w in name.strip("_").split("_") if w)
+
+
+def _annotation(node, source):
+    if node is None:
+        return ""
+    segment = ast.get_source_segment(source, node) if hasattr(ast, "get_source_segment") else None
+    return segment or ""
+
+
+def template_docstring(function_str):
+    """
+    Builds a google style docstring from the signature and the body of a trivial function.
+
+    Args:
+        function_str (str): Source of the function.
+
+    Returns:
+        tuple: (doc_string, short_docstring) in the format of the model answers, or None if the function cannot
+            be parsed.
+    """
+    source = textwrap.dedent(function_str)
+    function = _parse_function(function_str)
+    if function is None:
+        return None
+    body = [n for n in function.body
+            if not (isinstance(n, ast.Expr) and isinstance(n.value, ast.Constant) and isinstance(n.value.value, str))]
+
+    # Résumé : getter / setter triviaux, sinon le nom de la fonction
+    summary = _words(function.name).capitalize() + "."
+    if len(body) == 1 and isinstance(body[0], ast.Return) and isinstance(body[0].value, ast.Attribute):
+        summary = f"Returns the {_words(body[0].value.attr)}."
+    elif len(body) == 1 and isinstance(body[0], ast.Assign) and isinstance(body[0].targets[0], ast.Attribute):
+        summary = f"Sets the {_words(body[0].targets[0].attr)}."
+
+    lines = [summary]
+    args = [a for a in function.args.args if a.arg not in ("self", "cls")] + function.args.kwonlyargs
+    if function.args.vararg is not None:
+        args.append(function.args.vararg)
+    if function.args.kwarg is not None:
+        args.append(function.args.kwarg)
+    if args:
+        lines += ["", "Args:"]
+        for arg in args:
+            annotation = _annotation(arg.annotation, source)
+            lines.append(f"    {arg.arg}{f' ({annotation})' if annotation else ''}: The {_words(arg.arg)}.")
+
+    returns = [n for n in ast.walk(function) if isinstance(n, ast.Return) and n.value is not None]
+    if returns:
+        annotation = _annotation(function.returns, source)
+        value = returns[0].value
+        what = _words(value.attr if isinstance(value, ast.Attribute) else value.id if isinstance(value, ast.Name)
+                      else "result")
+        lines += ["", "Returns:", f"    {annotation + ': ' if annotation else ''}The {what}."]
+
+    raises = []
+    for node in ast.walk(function):
+        if isinstance(node, ast.Raise) and node.exc is not None:
+            exc = node.exc.func if isinstance(node.exc, ast.Call) else node.exc
+            name = exc.id if isinstance(exc, ast.Name) else exc.attr if isinstance(exc, ast.Attribute) else None
+            if name and name not in raises:
+                raises.append(name)
+    if raises:
+        lines += ["", "Raises:"] + [f"    {name}: On error." for name in raises]
+
+    doc_string = '"""' + "\n".join(lines) + '\n"""'
+    return doc_string, summary
+
+
+class TierLimiter:
+    def __init__(self, tiers=None, large_model=None):
+        """
+        Concurrency limits of the model tiers.
+
+        :param tiers: Configuration of the tiers, TIERS by default
+        :param large_model: Model of the large tier instead of the configured one (e.g. "gpt-4-0613")
+        """
+        self.tiers = dict(tiers if tiers is not None else TIERS)
+        if large_model is not None:
+            self.tiers["large"] = {"model": large_model,
+                                   "max_concurrency": LARGE_MODEL_CONCURRENCY.get(
+                                       large_model, self.tiers["large"]["max_concurrency"])}
+        self._slots = {name: threading.BoundedSemaphore(conf["max_concurrency"])
+                       for name, conf in self.tiers.items() if conf.get("max_concurrency")}
+
+    def model(self, tier):
+        return self.tiers[tier]["model"]
+
+    def slot(self, tier):
+        """Returns a context manager holding one of the concurrency slots of the tier."""
+        return self._slots.get(tier) or _NoLimit()
+
+
+class _NoLimit:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False